@@ -0,0 +1,71 @@
+import time
+import asyncio
+import logging
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """Thread-safe token bucket allowing rate calls per second with bursts up to burst"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a call is allowed"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def throttle_client(client, rate):
+    """Rate limit every API call a boto3 client makes, including paginators and waiters"""
+    limiter = RateLimiter(rate)
+
+    def before_call(**kwargs):
+        limiter.acquire()
+        # Returning None lets botocore carry on with the request
+
+    client.meta.events.register('before-call', before_call)
+    return limiter
+
+class AsyncCore:
+    """Run blocking boto3 calls concurrently from the asyncio controller loop
+
+    boto3 clients are thread-safe, so calls are pushed to a bounded thread
+    pool; max_concurrency caps how many are in flight at once, and the
+    per-service rate limits from throttle_client keep bursts under the
+    API quotas.
+    """
+
+    def __init__(self, max_concurrency=32):
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='aws')
+
+    async def run(self, fn, *args, **kwargs):
+        """Await fn(*args, **kwargs) on the thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def map(self, fn, items, *args):
+        """Run fn(item, *args) for every item concurrently
+
+        Results come back in item order; exceptions are returned in place
+        of results rather than raised, so one failure does not cancel the rest.
+        """
+        return await asyncio.gather(*(self.run(fn, item, *args) for item in items),
+                                    return_exceptions=True)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,210 @@
+import json
+import math
+import time
+import logging
+import argparse
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Applies to every spot request, so our workers share it with anything else
+# running on spot in the account
+SPOT_VCPU_QUOTA_CODE = 'L-34B43A08'
+INSTANCE_VCPUS = {'t3.micro': 2, 't3.small': 2, 't3.medium': 2, 't3.large': 2, 't3.xlarge': 4}
+
+class Autoscaler:
+    """Size max_instances from the backlog, within budget and quota
+
+    Concurrency grows multiplicatively while the backlog can use it, so a
+    country finishes as fast as the caps allow. When the spot interruption
+    rate over the window climbs past interruption_threshold it is cut
+    multiplicatively for each decision that saw new interruptions, and held
+    until the rate falls again. The hard caps are:
+
+    - backlog: locations left, or in drain mode enough workers that each
+      has at least min_worker_seconds of work at the observed duration
+    - budget: hourly_budget divided by the spot price ceiling
+    - quota: the account's spot vCPU quota divided by vCPUs per worker
+    - ceiling: an absolute max_instances
+
+    decide() only depends on its observation and the current limit, and
+    every decision is appended to decision_log with both, so a run can be
+    replayed offline against different settings.
+    """
+
+    def __init__(self, min_instances=1, max_instances=100, hourly_budget=1.0,
+                 spot_max_price=0.04, instance_type='t3.medium', growth=0.5,
+                 decrease_factor=0.5, interruption_threshold=0.2,
+                 min_worker_seconds=600, interval=60, window_seconds=3600,
+                 decision_log=None, clock=time.time):
+        self.min_instances = min_instances
+        self.max_instances = max_instances
+        self.hourly_budget = hourly_budget
+        self.spot_max_price = spot_max_price
+        self.instance_type = instance_type
+        self.growth = growth
+        self.decrease_factor = decrease_factor
+        self.interruption_threshold = interruption_threshold
+        self.min_worker_seconds = min_worker_seconds
+        self.interval = interval
+        self.window_seconds = window_seconds
+        self.decision_log = decision_log
+        self.clock = clock
+        self.limit = min_instances
+        self.decided_at = 0
+        self.launches = deque()  # (timestamp, count)
+        self.interruptions = deque()  # (timestamp, count)
+        self.unseen_interruptions = 0  # Recorded since the last decision
+
+    def record_launches(self, count, now=None):
+        if count:
+            self.launches.append((now or self.clock(), count))
+
+    def record_interruptions(self, count, now=None):
+        """Count spot interruption warnings and leases lost to dead workers"""
+        if count:
+            self.interruptions.append((now or self.clock(), count))
+            self.unseen_interruptions += count
+
+    def interruption_rate(self, now=None):
+        """Interruptions per launch over the sliding window"""
+        horizon = (now or self.clock()) - self.window_seconds
+        for events in (self.launches, self.interruptions):
+            while events and events[0][0] < horizon:
+                events.popleft()
+        launched = sum(count for _, count in self.launches)
+        interrupted = sum(count for _, count in self.interruptions)
+        if not launched:
+            return 0.0
+        return min(1.0, interrupted / launched)
+
+    def caps(self, observation):
+        """Upper bounds on concurrency implied by one observation"""
+        remaining = observation['remaining']
+        if observation.get('worker_mode') == 'drain':
+            # Drain workers run several locations each; do not boot a worker
+            # for less work than min_worker_seconds
+            duration = observation.get('mean_duration') or self.min_worker_seconds
+            work_seconds = remaining * duration / max(1, observation.get('sessions') or 1)
+            backlog_cap = min(remaining, math.ceil(work_seconds / self.min_worker_seconds))
+        else:
+            backlog_cap = remaining
+
+        caps = {
+            'backlog': backlog_cap,
+            # Small epsilon so 1.00 / 0.04 is 25, not 24.999...
+            'budget': math.floor(self.hourly_budget / self.spot_max_price + 1e-9),
+            'ceiling': self.max_instances
+        }
+        if observation.get('vcpu_quota') is not None:
+            caps['quota'] = int(observation['vcpu_quota'] // INSTANCE_VCPUS.get(self.instance_type, 2))
+        return caps
+
+    def decide(self, observation):
+        """Return (limit, reason, caps) for an observation given the current limit"""
+        caps = self.caps(observation)
+        if observation['interruption_rate'] > self.interruption_threshold:
+            if observation.get('new_interruptions'):
+                target = math.floor(self.limit * self.decrease_factor)
+                reason = 'interruptions'
+            else:
+                target = self.limit
+                reason = 'holding for interruption rate'
+        else:
+            target = self.limit + max(1, math.ceil(self.limit * self.growth))
+            reason = 'grow'
+
+        binding = min(caps, key=caps.get)
+        if target >= caps[binding]:
+            target = caps[binding]
+            reason = f'capped by {binding}'
+        # Budget and quota are hard limits, the minimum is not
+        target = max(target, min(self.min_instances, caps['budget'], caps.get('quota', target)))
+        return target, reason, caps
+
+    def update(self, observation, now=None):
+        """Recompute the limit at most once per interval and return it"""
+        now = now or self.clock()
+        if now - self.decided_at < self.interval:
+            return self.limit
+        observation = dict(observation,
+                           interruption_rate=round(self.interruption_rate(now), 4),
+                           new_interruptions=self.unseen_interruptions)
+        self.unseen_interruptions = 0
+
+        previous = self.limit
+        self.limit, reason, caps = self.decide(observation)
+        self.decided_at = now
+        record = {
+            'time': now,
+            'previous': previous,
+            'limit': self.limit,
+            'reason': reason,
+            'caps': caps,
+            'observation': observation
+        }
+        if self.limit != previous:
+            logger.info(f"Autoscaler: max_instances {previous} -> {self.limit} ({reason}), "
+                        f"{observation['remaining']} remaining, "
+                        f"interruption rate {observation['interruption_rate']:.0%}")
+        if self.decision_log:
+            with open(self.decision_log, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        return self.limit
+
+def get_spot_vcpu_quota(service_quotas):
+    """Current spot vCPU quota for the account, or None if it cannot be read"""
+    try:
+        return service_quotas.get_service_quota(
+            ServiceCode='ec2', QuotaCode=SPOT_VCPU_QUOTA_CODE
+        )['Quota']['Value']
+    except Exception as e:
+        logger.warning(f"Could not read spot vCPU quota: {str(e)}")
+        return None
+
+def replay(decision_log, autoscaler):
+    """Re-run logged decisions through an autoscaler and report where they differ
+
+    Each decision starts from the limit the original run had at that point,
+    so differences come from the settings alone.
+    """
+    changed = 0
+    total = 0
+    with open(decision_log) as f:
+        for line in f:
+            record = json.loads(line)
+            total += 1
+            autoscaler.limit = record['previous']
+            limit, reason, caps = autoscaler.decide(record['observation'])
+            if limit != record['limit']:
+                changed += 1
+                print(f"{time.strftime('%H:%M:%S', time.gmtime(record['time']))} "
+                      f"{record['previous']} -> {record['limit']} ({record['reason']}) "
+                      f"now {limit} ({reason})")
+    print(f"{changed}/{total} decisions differ")
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Replay autoscaler decisions logged by task_runner_ec2.py --autoscale",
+        epilog="Example: python3 autoscaler.py autoscaler-decisions.jsonl --hourly-budget 2.0"
+    )
+    parser.add_argument('decision_log', help="JSON lines decision log to replay")
+    parser.add_argument('--hourly-budget', type=float, default=1.0)
+    parser.add_argument('--max-instances', type=int, default=100)
+    parser.add_argument('--min-instances', type=int, default=1)
+    parser.add_argument('--interruption-threshold', type=float, default=0.2)
+    parser.add_argument('--growth', type=float, default=0.5)
+    args = parser.parse_args()
+
+    replay(args.decision_log, Autoscaler(
+        min_instances=args.min_instances,
+        max_instances=args.max_instances,
+        hourly_budget=args.hourly_budget,
+        interruption_threshold=args.interruption_threshold,
+        growth=args.growth
+    ))
@@ -0,0 +1,28 @@
+import os
+
+import boto3
+
+REGION = 'eu-west-2'
+
+# Instance metadata service; point it elsewhere to run a worker against a fake one
+METADATA_URL = os.environ.get('EC2_METADATA_URL', 'http://169.254.169.254').rstrip('/')
+
+_client_factory = None
+
+def set_client_factory(factory):
+    """Create every AWS client through factory(service) instead of boto3, or None to go back
+
+    Used by simulator.py to run the controller and workers against fake services.
+    """
+    global _client_factory
+    _client_factory = factory
+
+def get_client(service):
+    """A client for an AWS service in the scraper's region"""
+    if _client_factory is not None:
+        return _client_factory(service)
+    return boto3.client(service, region_name=REGION)
+
+def metadata_url(path):
+    """URL of an instance metadata path, e.g. 'instance-id'"""
+    return f"{METADATA_URL}/latest/meta-data/{path}"
@@ -0,0 +1,153 @@
+"""Benchmark the per-tick location scan against a local DynamoDB stand-in.
+
+Compares the old two-query tick (get_location_stats + get_inactive_locations,
+first page only) with TaskRunner.scan_country, which paginates once and
+projects only status/location_name.
+
+Usage: python3 benchmarks/bench_location_scan.py [num_locations]
+"""
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from task_runner_ec2 import TaskRunner
+
+PAGE_LIMIT_BYTES = 1024 * 1024
+STATUSES = ['INACTIVE', 'IN_PROGRESS', 'COMPLETE', 'STOPPED']
+
+
+def item_size(item):
+    """Approximate DynamoDB item size: attribute names plus string values"""
+    return sum(len(name) + len(value['S']) for name, value in item.items())
+
+
+class LocalDynamoDB:
+    """Minimal stand-in for the dynamodb client's query call
+
+    Mimics the behaviour that matters for the control loop: results are
+    paged at 1 MB of *unprojected* item data, filters are applied after the
+    page is read, and read capacity is charged per 4 KB read.
+    """
+
+    def __init__(self, items):
+        self.partitions = {}
+        for item in items:
+            self.partitions.setdefault(item['country_code']['S'], []).append(item)
+        for partition in self.partitions.values():
+            partition.sort(key=lambda item: item['location_name']['S'])
+        self.calls = 0
+        self.read_units = 0.0
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues,
+              ExpressionAttributeNames=None, FilterExpression=None,
+              ProjectionExpression=None, ExclusiveStartKey=None):
+        self.calls += 1
+        partition = self.partitions.get(ExpressionAttributeValues[':cc']['S'], [])
+
+        start = 0
+        if ExclusiveStartKey:
+            start_name = ExclusiveStartKey['location_name']['S']
+            while start < len(partition) and partition[start]['location_name']['S'] <= start_name:
+                start += 1
+
+        page, page_bytes = [], 0
+        index = start
+        while index < len(partition) and page_bytes < PAGE_LIMIT_BYTES:
+            page.append(partition[index])
+            page_bytes += item_size(partition[index])
+            index += 1
+        # Eventually consistent reads cost half a unit per 4 KB
+        self.read_units += math.ceil(page_bytes / 4096) * 0.5
+
+        if FilterExpression:
+            wanted = ExpressionAttributeValues[':status']['S']
+            page = [item for item in page if item['status']['S'] == wanted]
+
+        if ProjectionExpression:
+            names = ExpressionAttributeNames or {}
+            fields = [names.get(field.strip(), field.strip()) for field in ProjectionExpression.split(',')]
+            page = [{field: item[field] for field in fields if field in item} for item in page]
+
+        response = {'Items': page, 'Count': len(page)}
+        if index < len(partition):
+            last = partition[index - 1]
+            response['LastEvaluatedKey'] = {
+                'country_code': last['country_code'],
+                'location_name': last['location_name']
+            }
+        return response
+
+
+class BenchRunner(TaskRunner):
+    def __init__(self, dynamodb):
+        self.dynamodb = dynamodb
+        self.clock = time.time
+        self.CONFIG = {'controller_shard': 0, 'controller_shards': 1}
+
+
+def make_items(count, country_code='UK'):
+    rng = random.Random(42)
+    items = []
+    for i in range(count):
+        items.append({
+            'country_code': {'S': country_code},
+            'location_name': {'S': f'{country_code}-postcode-{i:07d}'},
+            'status': {'S': rng.choice(STATUSES)},
+            'last_updated': {'S': '2024-01-01T00:00:00.000000'},
+            'search_url': {'S': f'https://example.com/dentists/{i:07d}?radius=10&sort=distance'},
+            'error_message': {'S': 'x' * rng.randint(0, 200)}
+        })
+    return items
+
+
+def legacy_tick(dynamodb, country_code):
+    """The original tick: two unpaginated queries, one filtered"""
+    stats_response = dynamodb.query(
+        TableName='dental_location_control',
+        KeyConditionExpression='country_code = :cc',
+        ExpressionAttributeValues={':cc': {'S': country_code}}
+    )
+    inactive_response = dynamodb.query(
+        TableName='dental_location_control',
+        KeyConditionExpression='country_code = :cc',
+        FilterExpression='#status = :status',
+        ExpressionAttributeNames={'#status': 'status'},
+        ExpressionAttributeValues={
+            ':cc': {'S': country_code},
+            ':status': {'S': 'INACTIVE'}
+        }
+    )
+    return len(stats_response['Items']), len(inactive_response['Items'])
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    items = make_items(count)
+    expected_inactive = sum(1 for item in items if item['status']['S'] == 'INACTIVE')
+    print(f"Locations: {count}, INACTIVE: {expected_inactive}")
+
+    dynamodb = LocalDynamoDB(items)
+    started = time.perf_counter()
+    total, inactive = legacy_tick(dynamodb, 'UK')
+    elapsed = time.perf_counter() - started
+    print(f"legacy tick:  {dynamodb.calls} calls, {dynamodb.read_units:.1f} RCU, "
+          f"{elapsed * 1000:.1f} ms, saw total={total} inactive={inactive}")
+
+    dynamodb = LocalDynamoDB(items)
+    runner = BenchRunner(dynamodb)
+    started = time.perf_counter()
+    stats, inactive_locations, _ = runner.scan_country('UK')
+    elapsed = time.perf_counter() - started
+    print(f"scan_country: {dynamodb.calls} calls, {dynamodb.read_units:.1f} RCU, "
+          f"{elapsed * 1000:.1f} ms, saw total={stats['total']} inactive={len(inactive_locations)}")
+
+    # What the legacy tick would cost if both queries were paginated correctly
+    print(f"legacy tick paginated would cost {2 * dynamodb.read_units:.1f} RCU")
+
+
+if __name__ == "__main__":
+    main()
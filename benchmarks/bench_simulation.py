@@ -0,0 +1,81 @@
+"""Benchmark controller and worker modes end to end on the simulator.
+
+Runs the real TaskRunner against simulator.py's fake EC2, DynamoDB,
+metadata service and workers, on a simulated clock, for each scenario and
+backlog size. Reports locations per hour, slot utilization (running
+workers over max_instances), busy ratio (scraping seconds per instance
+second; drain workers run several sessions), API calls and DynamoDB read
+units per location, and time to drain. The seed fixes boot times, scrape
+durations, failures and interruptions, so runs are repeatable and
+scheduler changes can be compared offline.
+
+Usage: python3 benchmarks/bench_simulation.py [--sizes 10 100 1000 10000]
+           [--scenarios single drain-index-events] [--max-instances 50] [--json results.jsonl]
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO_DIR)
+
+from simulator import Simulation
+
+# name -> (controller config, Simulation arguments, Simulation.run arguments)
+SCENARIOS = {
+    'single': ({'worker_mode': 'single', 'queue_mode': 'filter'}, {}, {}),
+    'single-baked': ({'worker_mode': 'single', 'queue_mode': 'filter', 'image_id': 'ami-prebaked'}, {}, {}),
+    'single-warm': ({'worker_mode': 'single', 'queue_mode': 'index'}, {}, {'warm_pool': True}),
+    'drain-index': ({'worker_mode': 'drain', 'queue_mode': 'index'}, {}, {}),
+    'drain-index-events': ({'worker_mode': 'drain', 'queue_mode': 'index'}, {'event_mode': True}, {}),
+    'drain-index-warm': ({'worker_mode': 'drain', 'queue_mode': 'index'}, {}, {'warm_pool': True}),
+}
+
+
+def run_scenario(name, size, max_instances, seed, interruption_rate, capacity_error_rate):
+    config, sim_args, run_args = SCENARIOS[name]
+    sim = Simulation(seed=seed, interruption_rate=interruption_rate,
+                     capacity_error_rate=capacity_error_rate, **sim_args)
+    sim.add_locations('UK', size)
+    report = sim.run(['UK'], dict(config, max_instances=max_instances), **run_args)
+    report.update({'scenario': name, 'max_instances': max_instances, 'seed': seed})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated end-to-end throughput benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--max-instances', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--interruption-rate', type=float, default=0.05,
+                        help="Spot interruptions per instance-hour")
+    parser.add_argument('--capacity-error-rate', type=float, default=0.0)
+    parser.add_argument('--json', default=None, help="Append each report as a JSON line to this file")
+    args = parser.parse_args()
+
+    # The controller uploads its worker bundle from the working directory
+    os.chdir(REPO_DIR)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"{'scenario':<20} {'locations':>9} {'loc/hour':>9} {'slots':>6} {'busy':>6} "
+          f"{'calls/loc':>9} {'RCU/loc':>8} {'drain':>8} {'launches':>8} {'wall s':>7}")
+    for size in args.sizes:
+        for name in args.scenarios:
+            report = run_scenario(name, size, args.max_instances, args.seed,
+                                  args.interruption_rate, args.capacity_error_rate)
+            hours, seconds = divmod(report['drain_seconds'], 3600)
+            drain = f"{hours}:{seconds // 60:02d}" + ('' if report['finished'] else '+')
+            print(f"{name:<20} {size:>9} {report['locations_per_hour']:>9.1f} "
+                  f"{report['slot_utilization']:>6.2f} {report['busy_ratio']:>6.2f} "
+                  f"{report['api_calls_per_location']:>9.2f} {report['read_units'] / size:>8.1f} "
+                  f"{drain:>8} {report['launches']:>8} {report['wall_seconds']:>7.1f}")
+            if args.json:
+                with open(args.json, 'a') as f:
+                    f.write(json.dumps(report) + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/bin/bash
+# Install everything the scraper needs on a fresh Ubuntu 22.04 host.
+#
+# Used three ways: inlined into user data when launching from the stock
+# Ubuntu AMI, run once by image_builder.py to bake a worker/controller AMI,
+# and run by the Dockerfile to build a local container image.
+#
+# Usage: bootstrap.sh [worker|controller]
+#   worker      Chrome, AWS CLI, CloudWatch agent and Python dependencies (default)
+#   controller  Same without Chrome
+set -ex
+
+ROLE="${1:-worker}"
+export DEBIAN_FRONTEND=noninteractive
+
+cd /tmp
+
+# Install required packages
+apt-get update
+apt-get install -y wget unzip python3-pip curl
+
+if [ "$ROLE" = "worker" ]; then
+    # Install system dependencies for Chrome
+    apt-get install -y fonts-liberation libasound2 libatk-bridge2.0-0 libatk1.0-0 libatspi2.0-0 \
+        libcairo2 libcups2 libdbus-1-3 libdrm2 libgbm1 libgdk-pixbuf2.0-0 libgtk-3-0 libnspr4 \
+        libnss3 libpango-1.0-0 libx11-6 libxcb1 libxcomposite1 libxdamage1 libxext6 libxfixes3 \
+        libxrandr2 xdg-utils libu2f-udev libvulkan1 libxkbcommon0 libxss1
+fi
+
+# Install AWS CLI
+echo "[$(date '+%Y-%m-%d %H:%M:%S')] Installing AWS CLI..."
+curl "https://awscli.amazonaws.com/awscli-exe-linux-x86_64.zip" -o "awscliv2.zip"
+unzip -q -o awscliv2.zip
+./aws/install --update
+rm -rf awscliv2.zip aws
+
+# Install CloudWatch agent
+echo "[$(date '+%Y-%m-%d %H:%M:%S')] Installing CloudWatch agent..."
+wget -q https://s3.amazonaws.com/amazoncloudwatch-agent/ubuntu/amd64/latest/amazon-cloudwatch-agent.deb
+dpkg -i -E ./amazon-cloudwatch-agent.deb
+rm -f amazon-cloudwatch-agent.deb
+
+if [ "$ROLE" = "worker" ]; then
+    # Install Chrome
+    echo "[$(date '+%Y-%m-%d %H:%M:%S')] Installing Chrome..."
+    wget -q https://dl.google.com/linux/direct/google-chrome-stable_current_amd64.deb
+    dpkg -i google-chrome-stable_current_amd64.deb || apt-get -f install -y
+    rm -f google-chrome-stable_current_amd64.deb
+fi
+
+# Install Python dependencies
+pip3 install selenium==4.15.2 boto3 requests
+
+apt-get clean
+mkdir -p /var/lib/dental-scraper
+echo "$ROLE $(date -u '+%Y-%m-%dT%H:%M:%SZ')" > /var/lib/dental-scraper/bootstrap-complete
+echo "[$(date '+%Y-%m-%d %H:%M:%S')] Bootstrap complete"
@@ -0,0 +1,163 @@
+import time
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = 'dental_location_control'
+CHECKPOINT_INTERVAL = 60  # Seconds between checkpoints while a location is being scraped
+# Row attributes holding a checkpoint; a COMPLETE location drops them
+CHECKPOINT_ATTRIBUTES = ('checkpoint_cursor', 'checkpoint_items', 'checkpoint_at')
+
+class LocationCheckpoint:
+    """How far a worker has got through one location
+
+    cursor is the index of the next page to scrape; every page before it
+    is done. page_items holds the ids of the items already written from
+    the page at cursor, so a resumed scrape starts at cursor and skips
+    those items. emitted holds every id this process has written, so a
+    scrape that meets an item twice writes it once.
+    """
+
+    def __init__(self, country_code, location_name, cursor=0, page_items=(), saved_at=None):
+        self.country_code = country_code
+        self.location_name = location_name
+        self.cursor = cursor
+        self.page_items = set(page_items)
+        self.emitted = set(page_items)
+        self.saved_at = time.time() if saved_at is None else saved_at
+        self.lock = threading.Lock()
+
+    def seen(self, item_id):
+        with self.lock:
+            return item_id in self.emitted
+
+    def emit(self, item_id):
+        """Record an item once its record has been written"""
+        with self.lock:
+            self.emitted.add(item_id)
+            self.page_items.add(item_id)
+
+    def advance(self, cursor):
+        """Record that every page before cursor is done"""
+        with self.lock:
+            if cursor != self.cursor:
+                # Pages before the cursor are never scraped again, so their ids need not be kept
+                self.page_items = set()
+            self.cursor = cursor
+
+class CheckpointStore:
+    """Location checkpoints kept on their control table rows
+
+    A row carries checkpoint_cursor and checkpoint_items, the ids already
+    written from the page at the cursor. Earlier pages are covered by the
+    cursor alone, so the row holds at most one page of ids however many
+    items a location has, and stays well inside DynamoDB's 400 KB. Saves are conditional on the location being IN_PROGRESS, so a released
+    or finished location is left alone. Checkpoints survive STOPPED and
+    lease requeues, and a COMPLETE status write removes them.
+
+    Records must be durable before the checkpoint that covers them. With
+    a result sink, each save therefore closes the location's open object
+    before it writes the row. A worker that dies between the two re-emits
+    those items on resume, so delivery is at least once. Records carry
+    their item_id so readers can deduplicate.
+    """
+
+    def __init__(self, dynamodb, result_sink=None, interval=CHECKPOINT_INTERVAL, clock=time.time):
+        self.dynamodb = dynamodb
+        self.result_sink = result_sink
+        self.interval = interval
+        self.clock = clock
+        self.active = {}  # (country_code, location_name) -> LocationCheckpoint
+        self.lock = threading.Lock()
+
+    def key(self, country_code, location_name):
+        return {
+            'country_code': {'S': country_code},
+            'location_name': {'S': location_name}
+        }
+
+    def load(self, country_code, location_name):
+        """Read a location's checkpoint, or start a new one, and track it until forget()"""
+        response = self.dynamodb.get_item(
+            TableName=TABLE_NAME,
+            Key=self.key(country_code, location_name),
+            ProjectionExpression='checkpoint_cursor, checkpoint_items',
+            ConsistentRead=True
+        )
+        item = response.get('Item', {})
+        checkpoint = LocationCheckpoint(country_code, location_name,
+                                        int(item.get('checkpoint_cursor', {}).get('N', '0')),
+                                        item.get('checkpoint_items', {}).get('SS', []),
+                                        saved_at=self.clock())
+        if checkpoint.cursor or checkpoint.page_items:
+            logger.info(f"Resuming {country_code}:{location_name} at page {checkpoint.cursor}, "
+                        f"{len(checkpoint.page_items)} items of it already written")
+        with self.lock:
+            self.active[(country_code, location_name)] = checkpoint
+        return checkpoint
+
+    def forget(self, checkpoint):
+        with self.lock:
+            self.active.pop((checkpoint.country_code, checkpoint.location_name), None)
+
+    def save(self, checkpoint):
+        """Make the location's records durable, then write its checkpoint
+
+        Returns False if the location is no longer IN_PROGRESS.
+        """
+        country_code, location_name = checkpoint.country_code, checkpoint.location_name
+        # Everything in the snapshot was written before it, so closing the
+        # object afterwards covers it
+        with checkpoint.lock:
+            cursor, items = checkpoint.cursor, sorted(checkpoint.page_items)
+        if self.result_sink is not None:
+            self.result_sink.close_location(country_code, location_name)
+
+        update_expr = "SET checkpoint_cursor = :cursor, checkpoint_at = :timestamp"
+        expr_attrs = {
+            ':cursor': {'N': str(cursor)},
+            ':timestamp': {'S': datetime.utcnow().isoformat()},
+            ':in_progress': {'S': 'IN_PROGRESS'}
+        }
+        if items:
+            update_expr += ", checkpoint_items = :items"
+            expr_attrs[':items'] = {'SS': items}
+        else:
+            # DynamoDB has no empty sets
+            update_expr += " REMOVE checkpoint_items"
+        try:
+            self.dynamodb.update_item(
+                TableName=TABLE_NAME,
+                Key=self.key(country_code, location_name),
+                UpdateExpression=update_expr,
+                ConditionExpression='#status = :in_progress',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues=expr_attrs
+            )
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            logger.warning(f"Not checkpointing {country_code}:{location_name}, it is no longer IN_PROGRESS")
+            return False
+        with checkpoint.lock:
+            checkpoint.saved_at = self.clock()
+        logger.info(f"Checkpointed {country_code}:{location_name} at page {cursor}, "
+                    f"{len(items)} items of it written")
+        return True
+
+    def maybe_save(self, checkpoint):
+        """Save once interval seconds have passed since the last save"""
+        if self.clock() - checkpoint.saved_at >= self.interval:
+            return self.save(checkpoint)
+        return False
+
+    def save_all(self):
+        """Save every tracked checkpoint, e.g. on a spot interruption notice"""
+        with self.lock:
+            checkpoints = list(self.active.values())
+        for checkpoint in checkpoints:
+            try:
+                self.save(checkpoint)
+            except Exception as e:
+                logger.error(f"Failed to checkpoint {checkpoint.country_code}:{checkpoint.location_name}: "
+                             f"{str(e)}")
@@ -0,0 +1,81 @@
+import io
+import os
+import gzip
+import tarfile
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+CODE_BUCKET = 'dental-scraper-code'
+
+# What each role needs on disk to run
+WORKER_FILES = ['simple_test.py', 'status_writer.py', 'async_core.py', 'result_sink.py',
+                'page_cache.py', 'fetcher.py', 'aws_backend.py', 'metrics.py', 'checkpoint.py']
+CONTROLLER_FILES = ['task_runner_ec2.py', 'simple_test.py', 'image_builder.py',
+                    'code_bundle.py', 'log_tailer.py', 'controller_events.py', 'async_core.py',
+                    'scheduler.py', 'autoscaler.py', 'placement.py', 'status_writer.py',
+                    'result_sink.py', 'page_cache.py', 'fetcher.py', 'aws_backend.py',
+                    'metrics.py', 'warm_pool.py', 'local_executor.py', 'checkpoint.py',
+                    'bootstrap.sh']
+
+def build_bundle(files, base_dir='.'):
+    """Pack files into a reproducible .tar.gz and return (data, sha256 hex digest)
+
+    Timestamps, ownership and ordering are fixed so the same sources always
+    produce the same bytes, and so the same hash.
+    """
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode='w') as tar:
+        for name in sorted(files):
+            with open(os.path.join(base_dir, name), 'rb') as f:
+                content = f.read()
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mode = 0o755 if name.endswith(('.py', '.sh')) else 0o644
+            info.mtime = 0
+            tar.addfile(info, io.BytesIO(content))
+
+    data = gzip.compress(tar_buffer.getvalue(), compresslevel=9, mtime=0)
+    return data, hashlib.sha256(data).hexdigest()
+
+def source_fingerprint(files, base_dir='.'):
+    """Modification time and size of each file, to tell when a bundle needs rebuilding"""
+    fingerprint = []
+    for name in sorted(files):
+        stat = os.stat(os.path.join(base_dir, name))
+        fingerprint.append((name, stat.st_mtime_ns, stat.st_size))
+    return tuple(fingerprint)
+
+def bundle_key(bundle_hash):
+    """S3 key for a bundle"""
+    return f'bundles/{bundle_hash}.tar.gz'
+
+def upload_bundle(s3, files, base_dir='.'):
+    """Upload a bundle of files unless one with the same hash is already there
+
+    Returns the bundle hash.
+    """
+    data, bundle_hash = build_bundle(files, base_dir)
+    key = bundle_key(bundle_hash)
+    try:
+        s3.head_object(Bucket=CODE_BUCKET, Key=key)
+        logger.info(f"Code bundle {bundle_hash[:12]} already uploaded, skipping")
+        return bundle_hash
+    except s3.exceptions.ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+            raise
+
+    s3.put_object(Bucket=CODE_BUCKET, Key=key, Body=data, ContentType='application/gzip')
+    logger.info(f"Uploaded code bundle {bundle_hash[:12]} ({len(data)} bytes, {len(files)} files)")
+    return bundle_hash
+
+def get_fetch_script(bundle_hash, target_dir):
+    """User data snippet that downloads a bundle, checks its hash and unpacks it"""
+    return f'''# Fetch and verify code bundle {bundle_hash[:12]}
+mkdir -p {target_dir}
+aws s3 cp s3://{CODE_BUCKET}/{bundle_key(bundle_hash)} /tmp/code-bundle.tar.gz
+echo "{bundle_hash}  /tmp/code-bundle.tar.gz" | sha256sum -c - || exit 1
+tar -xzf /tmp/code-bundle.tar.gz -C {target_dir}
+rm -f /tmp/code-bundle.tar.gz
+'''
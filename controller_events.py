@@ -0,0 +1,224 @@
+import json
+import time
+import queue
+import random
+import logging
+import argparse
+
+from aws_backend import get_client
+
+logger = logging.getLogger(__name__)
+
+EVENT_QUEUE_NAME = 'dental-scraper-controller-events'
+EC2_RULE_NAME = 'dental-scraper-instance-events'
+TABLE_PIPE_NAME = 'dental-scraper-table-events'
+
+def parse_event(body):
+    """Reduce an EventBridge/Pipes message to {'source': ..., ...}
+
+    EC2 state changes and spot interruption warnings arrive from an
+    EventBridge rule; control table changes arrive from a DynamoDB stream
+    through an EventBridge Pipe.
+    """
+    message = json.loads(body)
+    if message.get('source') == 'aws.ec2':
+        detail = message.get('detail', {})
+        return {
+            'source': 'ec2',
+            'type': message.get('detail-type'),
+            'instance_id': detail.get('instance-id'),
+            'state': detail.get('state')
+        }
+    if message.get('eventSource') == 'aws:dynamodb':
+        keys = message.get('dynamodb', {}).get('Keys', {})
+        new_image = message.get('dynamodb', {}).get('NewImage', {})
+        return {
+            'source': 'dynamodb',
+            'type': message.get('eventName'),
+            'country_code': keys.get('country_code', {}).get('S'),
+            'location_name': keys.get('location_name', {}).get('S'),
+            'status': new_image.get('status', {}).get('S')
+        }
+    return {'source': 'unknown', 'type': message.get('detail-type')}
+
+class LocalEventSource:
+    """In-process event source for tests and local runs
+
+    Anything can publish() events; the controller loop wakes as soon as
+    one arrives.
+    """
+
+    def __init__(self):
+        self.events = queue.Queue()
+
+    def publish(self, event):
+        self.events.put(event)
+
+    def wait(self, timeout):
+        """Block up to timeout seconds for events and return all that are ready"""
+        try:
+            events = [self.events.get(timeout=max(0, timeout))]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+class SqsEventSource:
+    """Long-poll the controller's SQS event queue"""
+
+    def __init__(self, queue_url, sqs=None):
+        self.sqs = sqs or get_client('sqs')
+        self.queue_url = queue_url
+
+    def wait(self, timeout):
+        """Block up to timeout seconds for events and return all that are ready"""
+        deadline = time.time() + timeout
+        while True:
+            wait_seconds = int(max(0, min(20, deadline - time.time())))
+            response = self.sqs.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=10,
+                WaitTimeSeconds=wait_seconds
+            )
+            messages = response.get('Messages', [])
+            if messages:
+                self.sqs.delete_message_batch(
+                    QueueUrl=self.queue_url,
+                    Entries=[{'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']}
+                             for i, message in enumerate(messages)]
+                )
+                events = []
+                for message in messages:
+                    try:
+                        events.append(parse_event(message['Body']))
+                    except (ValueError, KeyError) as e:
+                        logger.warning(f"Ignoring unparseable event: {str(e)}")
+                return events
+            if time.time() >= deadline:
+                return []
+
+class AdaptivePoller:
+    """Interval between control loop ticks
+
+    Ticks that change something keep the interval at min_interval; idle
+    ticks double it up to max_interval. Every delay is jittered so several
+    controllers do not poll in lockstep.
+    """
+
+    def __init__(self, min_interval=2, max_interval=60, jitter=0.2):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.interval = min_interval
+
+    def next_delay(self, active):
+        if active:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * 2)
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+class EventQueueSetup:
+    """Create the SQS queue, EventBridge rule and DynamoDB stream pipe that feed the controller"""
+
+    def __init__(self):
+        self.sqs = get_client('sqs')
+        self.events = get_client('events')
+        self.dynamodb = get_client('dynamodb')
+        self.pipes = get_client('pipes')
+        self.table_name = 'dental_location_control'
+
+    def ensure_queue(self):
+        """Create the event queue if needed and return (url, arn)"""
+        queue_url = self.sqs.create_queue(
+            QueueName=EVENT_QUEUE_NAME,
+            Attributes={'MessageRetentionPeriod': '3600', 'ReceiveMessageWaitTimeSeconds': '20'}
+        )['QueueUrl']
+        queue_arn = self.sqs.get_queue_attributes(
+            QueueUrl=queue_url, AttributeNames=['QueueArn']
+        )['Attributes']['QueueArn']
+        return queue_url, queue_arn
+
+    def ensure_ec2_rule(self, queue_url, queue_arn):
+        """Forward worker state changes and spot interruption warnings to the queue"""
+        rule_arn = self.events.put_rule(
+            Name=EC2_RULE_NAME,
+            EventPattern=json.dumps({
+                'source': ['aws.ec2'],
+                'detail-type': [
+                    'EC2 Instance State-change Notification',
+                    'EC2 Spot Instance Interruption Warning'
+                ]
+            }),
+            State='ENABLED'
+        )['RuleArn']
+        self.events.put_targets(Rule=EC2_RULE_NAME, Targets=[{'Id': 'controller-queue', 'Arn': queue_arn}])
+        self.sqs.set_queue_attributes(
+            QueueUrl=queue_url,
+            Attributes={'Policy': json.dumps({
+                'Version': '2012-10-17',
+                'Statement': [{
+                    'Effect': 'Allow',
+                    'Principal': {'Service': 'events.amazonaws.com'},
+                    'Action': 'sqs:SendMessage',
+                    'Resource': queue_arn,
+                    'Condition': {'ArnEquals': {'aws:SourceArn': rule_arn}}
+                }]
+            })}
+        )
+        logger.info(f"EventBridge rule {EC2_RULE_NAME} forwards EC2 events to {EVENT_QUEUE_NAME}")
+
+    def ensure_table_pipe(self, queue_arn, role_arn):
+        """Forward control table status changes to the queue via a DynamoDB stream"""
+        table = self.dynamodb.describe_table(TableName=self.table_name)['Table']
+        if not table.get('StreamSpecification', {}).get('StreamEnabled'):
+            table = self.dynamodb.update_table(
+                TableName=self.table_name,
+                StreamSpecification={'StreamEnabled': True, 'StreamViewType': 'NEW_AND_OLD_IMAGES'}
+            )['TableDescription']
+            logger.info(f"Enabled stream on {self.table_name}")
+
+        try:
+            self.pipes.create_pipe(
+                Name=TABLE_PIPE_NAME,
+                RoleArn=role_arn,
+                Source=table['LatestStreamArn'],
+                SourceParameters={
+                    'DynamoDBStreamParameters': {'StartingPosition': 'LATEST', 'BatchSize': 10},
+                    # Only status transitions matter to the scheduler
+                    'FilterCriteria': {'Filters': [{'Pattern': json.dumps({
+                        'eventName': ['MODIFY', 'INSERT'],
+                        'dynamodb': {'NewImage': {'status': {'S': ['INACTIVE', 'COMPLETE', 'STOPPED']}}}
+                    })}]}
+                },
+                Target=queue_arn
+            )
+            logger.info(f"Created pipe {TABLE_PIPE_NAME} from {self.table_name} stream")
+        except self.pipes.exceptions.ConflictException:
+            logger.info(f"Pipe {TABLE_PIPE_NAME} already exists")
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Create the event queue that wakes the controller on instance and table changes",
+        epilog="Example: python3 controller_events.py --pipe-role-arn arn:aws:iam::123456789012:role/dental-scraper-pipe"
+    )
+    parser.add_argument('--pipe-role-arn',
+                        help="IAM role the DynamoDB stream pipe assumes (skip the pipe if not given)")
+    args = parser.parse_args()
+
+    setup = EventQueueSetup()
+    queue_url, queue_arn = setup.ensure_queue()
+    setup.ensure_ec2_rule(queue_url, queue_arn)
+    if args.pipe_role_arn:
+        setup.ensure_table_pipe(queue_arn, args.pipe_role_arn)
+    else:
+        logger.info("No --pipe-role-arn given, table changes will be picked up by polling")
+    logger.info(f"Run the controller with: --event-queue {queue_url}")
@@ -0,0 +1,171 @@
+import re
+import json
+import logging
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Matches headless Chrome on the workers, so servers send the same markup to both engines
+USER_AGENT = ('Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
+
+# Statuses bot protection answers with when it wants a browser
+CHALLENGE_STATUSES = (403, 503)
+JS_MARKERS = ('enable javascript', 'javascript is required', 'requires javascript',
+              'cf-browser-verification', 'challenge-platform')
+
+def visible_text_length(html):
+    """Rough amount of text a reader would see, ignoring scripts, styles and tags"""
+    html = re.sub(r'<(script|style|noscript)\b.*?</\1>', ' ', html, flags=re.IGNORECASE | re.DOTALL)
+    text = re.sub(r'<[^>]+>', ' ', html)
+    return len(' '.join(text.split()))
+
+def needs_browser(response, min_text=200):
+    """Why a plain HTTP response is not the page a browser would see, or None if it is"""
+    if response.status_code in CHALLENGE_STATUSES:
+        return f'status {response.status_code}'
+    content_type = response.headers.get('Content-Type', '')
+    if 'html' not in content_type:
+        return None
+    html = response.text
+    lowered = html.lower()
+    for marker in JS_MARKERS:
+        if marker in lowered:
+            return f'"{marker}" in page'
+    if visible_text_length(html) < min_text and '<script' in lowered:
+        return 'page is rendered by scripts'
+    return None
+
+class EngineDetector:
+    """Learn per domain whether pages need a browser
+
+    Every domain starts on the HTTP engine. Each fetch records whether the
+    plain response was usable; once a domain has needed the browser
+    min_samples times, and did on its latest fetch, it goes straight to
+    Chrome. Every recheck_every pages such a domain is probed over HTTP
+    again, so a site that drops its JS wall moves back after one probe.
+
+    Counts can be shared between workers through a page cache backend: load()
+    reads them and save() merges this process's new observations in.
+    """
+
+    def __init__(self, backend=None, min_samples=2, recheck_every=50):
+        self.backend = backend
+        self.min_samples = min_samples
+        self.recheck_every = recheck_every
+        self.domains = {}  # domain -> {'http': n, 'browser': n, 'last': engine}
+        self.deltas = {}  # same, observed since the last save
+        self.since_probe = {}  # domain -> browser fetches since the last HTTP probe
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def domain(url):
+        return urlparse(url).netloc.lower()
+
+    def load(self):
+        if self.backend is None:
+            return self
+        try:
+            data = self.backend.get('engines', 'domains.json')
+            if data:
+                with self.lock:
+                    self.domains = json.loads(data)
+                logger.info(f"Loaded engine choices for {len(self.domains)} domains")
+        except Exception as e:
+            logger.warning(f"Failed to load engine choices: {str(e)}")
+        return self
+
+    def save(self):
+        """Merge new observations into the shared counts"""
+        if self.backend is None or not self.deltas:
+            return
+        with self.lock:
+            deltas, self.deltas = self.deltas, {}
+        try:
+            data = self.backend.get('engines', 'domains.json')
+            merged = json.loads(data) if data else {}
+            for domain, counts in deltas.items():
+                current = merged.setdefault(domain, {'http': 0, 'browser': 0})
+                for engine in ('http', 'browser'):
+                    current[engine] = current.get(engine, 0) + counts[engine]
+                current['last'] = counts['last']
+            self.backend.put('engines', 'domains.json', json.dumps(merged, sort_keys=True).encode('utf-8'))
+        except Exception as e:
+            logger.warning(f"Failed to save engine choices: {str(e)}")
+
+    def engine_for(self, url):
+        """'http' or 'browser' for the next page on url's domain"""
+        domain = self.domain(url)
+        with self.lock:
+            counts = self.domains.get(domain, {})
+            if counts.get('browser', 0) < self.min_samples or counts.get('last') != 'browser':
+                return 'http'
+            self.since_probe[domain] = self.since_probe.get(domain, 0) + 1
+            if self.since_probe[domain] >= self.recheck_every:
+                self.since_probe[domain] = 0
+                return 'http'
+            return 'browser'
+
+    def record(self, url, engine):
+        """Record which engine a page on url's domain turned out to need"""
+        domain = self.domain(url)
+        with self.lock:
+            for counts in (self.domains, self.deltas):
+                domain_counts = counts.setdefault(domain, {'http': 0, 'browser': 0})
+                domain_counts[engine] += 1
+                domain_counts['last'] = engine
+
+class PageFetcher:
+    """Fetch pages over pooled HTTP, falling back to Chrome only when a page needs it
+
+    mode is 'auto' (ask the detector), 'http' or 'browser'. fetch() returns
+    (html, engine, etag, last_modified); the validators come from the HTTP
+    response when there was one.
+    """
+
+    def __init__(self, detector=None, mode='auto', pool_size=10, timeout=20, session=None):
+        self.detector = detector or EngineDetector()
+        self.mode = mode
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=2)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'User-Agent': USER_AGENT})
+        self.session = session
+        self.counts = {'http': 0, 'browser': 0}
+        self.lock = threading.Lock()
+
+    def fetch(self, url, get_driver, headers=None):
+        engine = self.detector.engine_for(url) if self.mode == 'auto' else self.mode
+        etag = last_modified = None
+        if engine == 'http':
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+            etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+            reason = needs_browser(response)
+            if reason is None:
+                # Other HTTP errors fail the location rather than scraping an error page
+                response.raise_for_status()
+                self.detector.record(url, 'http')
+                with self.lock:
+                    self.counts['http'] += 1
+                return response.text, 'http', etag, last_modified
+            if self.mode == 'http':
+                raise ValueError(f"{url} needs a browser: {reason}")
+            logger.info(f"Falling back to Chrome for {url}: {reason}")
+            self.detector.record(url, 'browser')
+
+        driver = get_driver()
+        driver.get(url)
+        with self.lock:
+            self.counts['browser'] += 1
+        return driver.page_source, 'browser', etag, last_modified
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
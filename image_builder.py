@@ -0,0 +1,135 @@
+import time
+import logging
+import argparse
+from datetime import datetime
+
+from aws_backend import get_client
+
+logger = logging.getLogger(__name__)
+
+BASE_IMAGE_ID = 'ami-003c3655bc8e97ae1'  # Ubuntu 22.04 LTS
+IMAGE_PURPOSE = 'dental-scraper-image'
+
+def get_bootstrap_script(role='worker'):
+    """User data snippet that writes out bootstrap.sh and runs it for a role"""
+    with open('bootstrap.sh', 'r') as f:
+        script = f.read()
+    return f'''# Install dependencies
+cat > /tmp/bootstrap.sh << 'BOOTSTRAP_EOF'
+{script}
+BOOTSTRAP_EOF
+bash /tmp/bootstrap.sh {role}
+'''
+
+def find_latest_image(ec2):
+    """Get the ID of the newest prebaked scraper image, or None if none has been built"""
+    images = ec2.describe_images(
+        Owners=['self'],
+        Filters=[
+            {'Name': 'tag:Purpose', 'Values': [IMAGE_PURPOSE]},
+            {'Name': 'state', 'Values': ['available']}
+        ]
+    )['Images']
+    if not images:
+        return None
+    return max(images, key=lambda image: image['CreationDate'])['ImageId']
+
+class ImageBuilder:
+    """Bake bootstrap.sh into a versioned AMI so launches skip the installs"""
+
+    def __init__(self):
+        self.ec2 = get_client('ec2')
+        self.CONFIG = {
+            'security_group_id': 'sg-0baac2c985b88fd23',
+            'subnet_id': 'subnet-0d00b3a1ba2dd811b',
+        }
+
+    def get_builder_user_data(self):
+        """Run the worker bootstrap, then power off so the image can be taken"""
+        return f'''#!/bin/bash
+exec 1> >(tee -a /var/log/user-data.log) 2>&1
+set -x
+
+# Wait for instance to fully initialize
+sleep 10
+
+{get_bootstrap_script('worker')}
+# Stay up on failure; the builder times out and is terminated without an image
+[ -f /var/lib/dental-scraper/bootstrap-complete ] || exit 1
+
+# Let derived instances run their own user data on first boot
+cloud-init clean --logs
+shutdown -h now
+'''
+
+    def build(self, version=None):
+        """Build a new image and return its AMI ID"""
+        version = version or datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+        image_name = f'dental-scraper-{version}'
+        logger.info(f"Building image {image_name} from {BASE_IMAGE_ID}")
+
+        response = self.ec2.run_instances(
+            ImageId=BASE_IMAGE_ID,
+            InstanceType='t3.medium',
+            MinCount=1,
+            MaxCount=1,
+            SecurityGroupIds=[self.CONFIG['security_group_id']],
+            SubnetId=self.CONFIG['subnet_id'],
+            IamInstanceProfile={'Name': 'venue-scraper-profile'},
+            InstanceInitiatedShutdownBehavior='stop',
+            UserData=self.get_builder_user_data(),
+            TagSpecifications=[{
+                'ResourceType': 'instance',
+                'Tags': [
+                    {'Key': 'Name', 'Value': f'dental-scraper-image-builder-{version}'},
+                    {'Key': 'Purpose', 'Value': 'dental-scraper-image-builder'}
+                ]
+            }]
+        )
+        instance_id = response['Instances'][0]['InstanceId']
+        logger.info(f"Launched builder instance {instance_id}, waiting for bootstrap to finish...")
+
+        try:
+            # The builder powers itself off once bootstrap.sh succeeds
+            waiter = self.ec2.get_waiter('instance_stopped')
+            waiter.wait(InstanceIds=[instance_id], WaiterConfig={'Delay': 15, 'MaxAttempts': 120})
+
+            image_id = self.ec2.create_image(
+                InstanceId=instance_id,
+                Name=image_name,
+                Description=f'Dental scraper worker/controller image {version}',
+                TagSpecifications=[{
+                    'ResourceType': 'image',
+                    'Tags': [
+                        {'Key': 'Purpose', 'Value': IMAGE_PURPOSE},
+                        {'Key': 'Version', 'Value': version}
+                    ]
+                }]
+            )['ImageId']
+            logger.info(f"Creating image {image_id}...")
+
+            waiter = self.ec2.get_waiter('image_available')
+            waiter.wait(ImageIds=[image_id], WaiterConfig={'Delay': 15, 'MaxAttempts': 120})
+            logger.info(f"Image {image_name} is available: {image_id}")
+            return image_id
+        finally:
+            self.ec2.terminate_instances(InstanceIds=[instance_id])
+            logger.info(f"Terminated builder instance {instance_id}")
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Build a prebaked AMI with Chrome, the AWS CLI, the CloudWatch agent and Python dependencies",
+        epilog="Example: python3 image_builder.py --version 2024-06-01"
+    )
+    parser.add_argument('--version', help="Image version (default: current UTC timestamp)")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    image_id = ImageBuilder().build(args.version)
+    logger.info(f"Built {image_id} in {time.time() - start_time:.0f}s")
+    logger.info(f"Launch with: python3 launch_controller.py UK --image-id {image_id}")
@@ -1,7 +1,11 @@
-import boto3
 import time
 import logging
 import sys
+import argparse
+
+from image_builder import BASE_IMAGE_ID, get_bootstrap_script, find_latest_image
+from code_bundle import CODE_BUCKET, CONTROLLER_FILES, upload_bundle, get_fetch_script
+from aws_backend import get_client
 
 logging.basicConfig(
     level=logging.INFO,
@@ -11,14 +15,25 @@ logger = logging.getLogger(__name__)
 
 class ControllerLauncher:
     def __init__(self):
-        self.ec2 = boto3.client('ec2', region_name='eu-west-2')
+        self.ec2 = get_client('ec2')
         self.CONFIG = {
             'security_group_id': 'sg-0baac2c985b88fd23',
             'subnet_id': 'subnet-0d00b3a1ba2dd811b',
+            'image_id': None  # Prebaked image from image_builder.py, None bootstraps the stock AMI
         }
     
-    def get_controller_user_data(self, country_code):
-        """Generate user data script for controller instance"""
+    def get_controller_user_data(self, country_codes, bundle_hash, controller_args=''):
+        """Generate user data script for controller instance
+
+        With a prebaked image_id the installs are skipped and the script
+        only configures logging, fetches the code bundle and starts the controller.
+        """
+        if self.CONFIG['image_id']:
+            bootstrap = ''
+        else:
+            bootstrap = "# Wait for instance to fully initialize\nsleep 10\n\n" + get_bootstrap_script('controller') + "\n"
+        fetch_script = get_fetch_script(bundle_hash, '/opt/dental-scraper')
+
         cloudwatch_config = '''{
     "agent": {
         "run_as_user": "root"
@@ -50,20 +65,9 @@ class ControllerLauncher:
 exec 1> >(tee -a /var/log/user-data.log) 2>&1
 set -x
 
-# Wait for instance to fully initialize
-sleep 10
-
-# Install required packages
-apt-get update
-apt-get install -y python3-pip git awscli
-
-# Set region
+{bootstrap}# Set region
 export AWS_DEFAULT_REGION=eu-west-2
 
-# Install CloudWatch agent
-wget https://s3.amazonaws.com/amazoncloudwatch-agent/ubuntu/amd64/latest/amazon-cloudwatch-agent.deb
-dpkg -i -E ./amazon-cloudwatch-agent.deb
-
 # Configure CloudWatch agent
 cat > /opt/aws/amazon-cloudwatch-agent/bin/config.json << 'EOF'
 {cloudwatch_config}
@@ -73,36 +77,20 @@ EOF
 /opt/aws/amazon-cloudwatch-agent/bin/amazon-cloudwatch-agent-ctl -a fetch-config -m ec2 -s -c file:/opt/aws/amazon-cloudwatch-agent/bin/config.json
 systemctl start amazon-cloudwatch-agent
 
-# Install Python dependencies
-pip3 install boto3 requests selenium
-
-# Create working directory
-mkdir -p /opt/dental-scraper
-cd /opt/dental-scraper
-
 # Debug AWS configuration
 aws sts get-caller-identity || echo "Failed to get caller identity"
-aws s3 ls || echo "Failed to list S3 buckets"
-
-# Download our code files
-echo "Downloading code files from S3..."
-aws s3 ls s3://dental-scraper-code/ || echo "Failed to list dental-scraper-code bucket"
-aws s3 cp s3://dental-scraper-code/task_runner_ec2.py . --debug || echo "Failed to download task_runner_ec2.py"
-aws s3 cp s3://dental-scraper-code/simple_test.py . --debug || echo "Failed to download simple_test.py"
 
+# Download our code
+echo "Downloading code bundle from S3..."
+{fetch_script}
 # Check if files exist
 echo "Checking downloaded files..."
 ls -la /opt/dental-scraper/
-[ -f task_runner_ec2.py ] && echo "task_runner_ec2.py exists" || echo "task_runner_ec2.py not found"
-[ -f simple_test.py ] && echo "simple_test.py exists" || echo "simple_test.py not found"
-
-# Make files executable
-chmod +x *.py 2>/dev/null || echo "Failed to make files executable"
 
 # Run the controller (it will keep running until manually stopped)
 cd /opt/dental-scraper
 if [ -f task_runner_ec2.py ]; then
-    python3 -u task_runner_ec2.py {country_code} 2>&1 | tee controller.log
+    python3 -u task_runner_ec2.py {' '.join(country_codes)} {controller_args} 2>&1 | tee controller.log
 else
     echo "ERROR: task_runner_ec2.py not found. Cannot start controller."
     exit 1
@@ -110,51 +98,52 @@ fi
 '''
 
     def upload_code_to_s3(self):
-        """Upload our code files to S3"""
+        """Upload the controller code bundle to S3 and return its hash
+
+        The bundle is content addressed, so unchanged code is not uploaded again.
+        """
         try:
-            s3 = boto3.client('s3', region_name='eu-west-2')
+            s3 = get_client('s3')
             
             # Create bucket if it doesn't exist
             try:
                 s3.create_bucket(
-                    Bucket='dental-scraper-code',
+                    Bucket=CODE_BUCKET,
                     CreateBucketConfiguration={'LocationConstraint': 'eu-west-2'}
                 )
-                logger.info("Created S3 bucket: dental-scraper-code")
+                logger.info(f"Created S3 bucket: {CODE_BUCKET}")
             except s3.exceptions.BucketAlreadyExists:
                 pass
             except s3.exceptions.BucketAlreadyOwnedByYou:
                 pass
             
-            # Upload files
-            s3.upload_file('task_runner_ec2.py', 'dental-scraper-code', 'task_runner_ec2.py')
-            s3.upload_file('simple_test.py', 'dental-scraper-code', 'simple_test.py')
-            logger.info("Uploaded code files to S3")
+            return upload_bundle(s3, CONTROLLER_FILES)
             
         except Exception as e:
             logger.error(f"Failed to upload code to S3: {str(e)}")
             raise
 
-    def launch_controller(self, country_code):
-        """Launch t3.micro instance as controller"""
+    def launch_controller(self, country_codes, controller_args='', name_suffix='', bundle_hash=None):
+        """Launch t3.micro instance as controller for one or more countries"""
         try:
             # First upload our code to S3
-            self.upload_code_to_s3()
+            if bundle_hash is None:
+                bundle_hash = self.upload_code_to_s3()
             
             # Launch controller instance
             response = self.ec2.run_instances(
-                ImageId='ami-003c3655bc8e97ae1',  # Ubuntu 22.04 LTS
+                ImageId=self.CONFIG['image_id'] or BASE_IMAGE_ID,
                 InstanceType='t3.micro',
                 MinCount=1,
                 MaxCount=1,
                 SecurityGroupIds=[self.CONFIG['security_group_id']],
                 SubnetId=self.CONFIG['subnet_id'],
                 IamInstanceProfile={'Name': 'venue-scraper-profile'},
-                UserData=self.get_controller_user_data(country_code),
+                UserData=self.get_controller_user_data(country_codes, bundle_hash, controller_args),
                 TagSpecifications=[{
                     'ResourceType': 'instance',
                     'Tags': [
-                        {'Key': 'Name', 'Value': f'dental-scraper-controller-{country_code}'},
+                        {'Key': 'Name', 'Value': f"dental-scraper-controller-{'-'.join(country_codes)}{name_suffix}"},
                         {'Key': 'Purpose', 'Value': 'dental-scraper-controller'}
                     ]
                 }]
@@ -191,11 +180,71 @@ fi
             raise
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python3 launch_controller.py <country_code>")
-        print("Example: python3 launch_controller.py UK")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Launch a controller instance for one or more countries",
+        epilog="Example: python3 launch_controller.py UK FR DE --priority UK=2"
+    )
+    parser.add_argument('country_codes', nargs='+',
+                        help="Countries to process, all scheduled by the same controller")
+    parser.add_argument('--priority', action='append', default=[], metavar='COUNTRY=WEIGHT',
+                        help="Fair-share weight passed through to task_runner_ec2.py")
+    parser.add_argument('--quota', action='append', default=[], metavar='COUNTRY=MAX',
+                        help="Per-country instance quota passed through to task_runner_ec2.py")
+    parser.add_argument('--queue-mode', choices=['filter', 'index'], default='filter',
+                        help="Queue mode passed through to task_runner_ec2.py")
+    parser.add_argument('--worker-mode', choices=['single', 'drain'], default='single',
+                        help="Worker mode passed through to task_runner_ec2.py")
+    parser.add_argument('--controllers', type=int, default=1,
+                        help="Number of controllers to shard the country across")
+    parser.add_argument('--image-id', default=None,
+                        help="Prebaked AMI for the controller and its workers, or 'latest'")
+    parser.add_argument('--event-queue', default=None,
+                        help="SQS queue URL from controller_events.py, passed through to the controller")
+    parser.add_argument('--subnets', default=None,
+                        help="Comma separated worker subnets, passed through to the controller")
+    parser.add_argument('--instance-types', default=None,
+                        help="Comma separated worker instance types, passed through to the controller")
+    parser.add_argument('--warm-pool', action='store_true',
+                        help="Have the controller stop and resume workers instead of terminating them")
+    parser.add_argument('--autoscale', action='store_true',
+                        help="Let the controller size max_instances within --hourly-budget")
+    parser.add_argument('--hourly-budget', type=float, default=None,
+                        help="Autoscaler spend ceiling in dollars per hour, passed through to the controller")
+    args = parser.parse_args()
     
-    country_code = sys.argv[1].upper()
+    country_codes = [country_code.upper() for country_code in args.country_codes]
+    controller_args = f"--queue-mode {args.queue_mode} --worker-mode {args.worker_mode}"
+    for priority in args.priority:
+        controller_args += f" --priority {priority}"
+    for quota in args.quota:
+        controller_args += f" --quota {quota}"
     launcher = ControllerLauncher()
-    launcher.launch_controller(country_code)
+    if args.image_id == 'latest':
+        launcher.CONFIG['image_id'] = find_latest_image(launcher.ec2)
+    else:
+        launcher.CONFIG['image_id'] = args.image_id
+    if launcher.CONFIG['image_id']:
+        controller_args += f" --image-id {launcher.CONFIG['image_id']}"
+    if args.event_queue:
+        controller_args += f" --event-queue {args.event_queue}"
+    if args.subnets:
+        controller_args += f" --subnets {args.subnets}"
+    if args.instance_types:
+        controller_args += f" --instance-types {args.instance_types}"
+    if args.warm_pool:
+        controller_args += " --warm-pool"
+    if args.autoscale:
+        controller_args += " --autoscale"
+    if args.hourly_budget is not None:
+        controller_args += f" --hourly-budget {args.hourly_budget}"
+    if args.controllers == 1:
+        launcher.launch_controller(country_codes, controller_args)
+    else:
+        bundle_hash = launcher.upload_code_to_s3()
+        for shard in range(args.controllers):
+            launcher.launch_controller(
+                country_codes,
+                f"{controller_args} --shard {shard} --shards {args.controllers}",
+                name_suffix=f'-{shard}',
+                bundle_hash=bundle_hash
+            )
@@ -0,0 +1,248 @@
+import os
+import sys
+import uuid
+import shlex
+import logging
+import threading
+import subprocess
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+LOCAL_HOST = 'localhost'
+# Left free on the controller host for the controller itself
+CONTROLLER_RESERVE_CPUS = 1
+CONTROLLER_RESERVE_GB = 1.0
+WORKER_IMAGE = 'dental-scraper-worker'  # Built from the Dockerfile
+LOG_DIR = '/tmp/dental-workers'
+# Passed into local containers from the controller's environment when set
+CONTAINER_ENV = ['AWS_DEFAULT_REGION', 'AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SESSION_TOKEN']
+
+class WorkerHost:
+    """A machine local workers run on: this one, or an on-prem box reached over ssh"""
+
+    def __init__(self, name, cpus, memory_gb):
+        self.name = name
+        self.cpus = cpus
+        self.memory_gb = memory_gb
+
+    @property
+    def remote(self):
+        return self.name != LOCAL_HOST
+
+    def __repr__(self):
+        return f"{self.name} ({self.cpus} CPUs, {self.memory_gb:g} GB)"
+
+def memory_total_gb():
+    """Total memory of this machine in GB"""
+    with open('/proc/meminfo') as f:
+        for line in f:
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1]) / (1024 * 1024)
+    raise OSError("No MemTotal in /proc/meminfo")
+
+def parse_host(spec):
+    """'localhost', 'localhost:8:16' or 'user@box:32:64' (name:CPUs:memory GB)
+
+    Without sizes, localhost is sized from this machine less what the
+    controller needs; remote hosts must give theirs.
+    """
+    name, *sizes = spec.split(':')
+    if len(sizes) == 2:
+        return WorkerHost(name, int(sizes[0]), float(sizes[1]))
+    if sizes:
+        raise ValueError(f"Expected NAME or NAME:CPUS:MEMORY_GB, got {spec!r}")
+    if name != LOCAL_HOST:
+        raise ValueError(f"Remote host {name} needs its size, e.g. {name}:16:32")
+    return WorkerHost(name, max(1, (os.cpu_count() or 1) - CONTROLLER_RESERVE_CPUS),
+                      max(1.0, memory_total_gb() - CONTROLLER_RESERVE_GB))
+
+def host_slots(host, used_cpus, used_memory_gb, cpus, memory_gb):
+    """How many more workers of one size fit on a host"""
+    return max(0, int(min((host.cpus - used_cpus) // cpus, (host.memory_gb - used_memory_gb) // memory_gb)))
+
+def pack_workers(hosts, used, count, cpus, memory_gb):
+    """Hosts for up to count new workers of one size, tightest fit first
+
+    used maps host name to the (CPUs, GB) its workers already hold. Each
+    worker goes to the host it leaves fullest, by the larger of its CPU and
+    memory share, so whole hosts stay free for bigger drain workers and
+    remote boxes are only used once this one is full. Returns one host per
+    worker that fits, fewer than count once every host is full.
+    """
+    used = {host.name: list(used.get(host.name, (0, 0))) for host in hosts}
+    placed = []
+    for _ in range(count):
+        fits = [host for host in hosts
+                if host_slots(host, *used[host.name], cpus, memory_gb) > 0]
+        if not fits:
+            break
+        host = max(fits, key=lambda host: (not host.remote, max(
+            (used[host.name][0] + cpus) / host.cpus,
+            (used[host.name][1] + memory_gb) / host.memory_gb)))
+        used[host.name][0] += cpus
+        used[host.name][1] += memory_gb
+        placed.append(host)
+    return placed
+
+class LocalExecutor:
+    """Run simple_test.py workers as processes or containers instead of EC2 instances
+
+    Workers run on this machine or on on-prem hosts over ssh, either as
+    plain processes (runtime 'process', with the code at worker_dir) or as
+    containers from the Dockerfile's image (runtime 'docker', limited to
+    the CPUs and memory they reserve). Every worker reserves worker_cpus
+    and worker_memory_gb and is packed onto the hosts with pack_workers,
+    so the number of free slots follows the hosts' size rather than
+    max_instances. Workers are started with --worker-id, which they use as
+    the owner of their claims, and their output goes to log_dir.
+
+    Workers are described like EC2 instances (InstanceId, State, LaunchTime
+    and the Purpose, Country and Location tags), so the controller counts, reaps
+    and terminates them the same way as instances.
+    """
+
+    def __init__(self, hosts, runtime='process', worker_cpus=1, worker_memory_gb=1.0,
+                 image=WORKER_IMAGE, worker_dir=None, log_dir=LOG_DIR):
+        self.hosts = hosts
+        self.runtime = runtime
+        self.worker_cpus = worker_cpus
+        self.worker_memory_gb = worker_memory_gb
+        self.image = image
+        self.worker_dir = worker_dir or os.path.dirname(os.path.abspath(__file__))
+        self.log_dir = log_dir
+        self.workers = {}  # worker id -> {'host', 'process', 'tags', 'started', 'log'}
+        self.lock = threading.Lock()
+        os.makedirs(log_dir, exist_ok=True)
+
+    def reap(self):
+        """Forget workers whose process has exited"""
+        for worker_id, worker in list(self.workers.items()):
+            returncode = worker['process'].poll()
+            if returncode is None:
+                continue
+            log = logger.info if returncode == 0 else logger.warning
+            log(f"Worker {worker_id} on {worker['host'].name} exited with {returncode}")
+            worker['log'].close()
+            del self.workers[worker_id]
+
+    def running_instances(self):
+        """Running workers in the shape of describe_instances results"""
+        with self.lock:
+            self.reap()
+            return [{
+                'InstanceId': worker_id,
+                'State': {'Name': 'running'},
+                'LaunchTime': worker['started'],
+                'Tags': [{'Key': key, 'Value': value} for key, value in worker['tags'].items()]
+            } for worker_id, worker in self.workers.items()]
+
+    def used(self):
+        """CPUs and GB held on each host by running workers"""
+        used = {}
+        for worker in self.workers.values():
+            cpus, memory_gb = used.get(worker['host'].name, (0, 0))
+            used[worker['host'].name] = (cpus + self.worker_cpus, memory_gb + self.worker_memory_gb)
+        return used
+
+    def free_slots(self):
+        """Workers that still fit across all hosts"""
+        with self.lock:
+            self.reap()
+            used = self.used()
+            return sum(host_slots(host, *used.get(host.name, (0, 0)), self.worker_cpus, self.worker_memory_gb)
+                       for host in self.hosts)
+
+    def worker_command(self, host, worker_id, worker_args):
+        """Command line that runs one worker on a host"""
+        if self.runtime == 'docker':
+            command = ['docker', 'run', '--rm', '--name', worker_id,
+                       '--cpus', str(self.worker_cpus), '--memory', f'{int(self.worker_memory_gb * 1024)}m']
+            if not host.remote:
+                # Remote hosts use their own credentials
+                command += [arg for name in CONTAINER_ENV if name in os.environ for arg in ('-e', name)]
+            command.append(self.image)
+        else:
+            python = 'python3' if host.remote else sys.executable
+            command = [python, os.path.join(self.worker_dir, 'simple_test.py')]
+        command += worker_args + ['--worker-id', worker_id]
+        if host.remote:
+            command = ['ssh', '-o', 'BatchMode=yes', host.name, shlex.join(command)]
+        return command
+
+    def start_workers(self, country_code, worker_args, tags):
+        """Start one worker per (worker_args, tags) pair while the hosts have room
+
+        Returns the IDs of the workers started, in order; a worker that
+        fails to start ends the batch.
+        """
+        worker_ids = []
+        with self.lock:
+            self.reap()
+            hosts = pack_workers(self.hosts, self.used(), len(worker_args),
+                                 self.worker_cpus, self.worker_memory_gb)
+            for host, args, worker_tags in zip(hosts, worker_args, tags):
+                worker_id = f"local-{uuid.uuid4().hex[:12]}"
+                log = open(os.path.join(self.log_dir, f'{worker_id}.log'), 'ab')
+                try:
+                    process = subprocess.Popen(self.worker_command(host, worker_id, args),
+                                               stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+                except OSError as e:
+                    logger.error(f"Failed to start a worker on {host.name}: {str(e)}")
+                    log.close()
+                    break
+                self.workers[worker_id] = {
+                    'host': host,
+                    'process': process,
+                    'tags': dict({'Purpose': 'dental-scraper', 'Country': country_code}, **worker_tags),
+                    'started': datetime.now(timezone.utc),
+                    'log': log
+                }
+                worker_ids.append(worker_id)
+        if worker_ids:
+            logger.info(f"Started {len(worker_ids)} local {country_code} worker(s), "
+                        f"logging to {self.log_dir}")
+        return worker_ids
+
+    def start_location_workers(self, country_code, location_names):
+        """Start a worker for each claimed location; returns location name to worker ID"""
+        worker_ids = self.start_workers(
+            country_code,
+            [[country_code, location_name] for location_name in location_names],
+            [{'Name': f'dental-scraper-{location_name}', 'Location': f'{country_code}#{location_name}'}
+             for location_name in location_names])
+        return dict(zip(location_names, worker_ids))
+
+    def start_drain_workers(self, country_code, count, queue_mode='filter', sessions=1):
+        """Start up to count workers that claim locations until the queue is empty"""
+        return self.start_workers(
+            country_code,
+            [[country_code, '--drain', '--queue-mode', queue_mode, '--sessions', str(sessions)]] * count,
+            [{'Name': f'dental-scraper-{country_code}-worker'}] * count)
+
+    def terminate_instances(self, worker_ids):
+        """Stop workers, e.g. after their lease expired"""
+        with self.lock:
+            workers = [(worker_id, self.workers.pop(worker_id)) for worker_id in worker_ids
+                       if worker_id in self.workers]
+        for worker_id, worker in workers:
+            host = worker['host']
+            if self.runtime == 'docker':
+                stop = ['docker', 'rm', '-f', worker_id]
+            elif host.remote:
+                # Ending ssh leaves the remote process running
+                stop = ['pkill', '-f', f'worker-id {worker_id}']
+            else:
+                stop = None
+            try:
+                if stop is not None:
+                    if host.remote:
+                        stop = ['ssh', '-o', 'BatchMode=yes', host.name, shlex.join(stop)]
+                    subprocess.run(stop, stdin=subprocess.DEVNULL, capture_output=True, timeout=30)
+                worker['process'].terminate()
+                worker['process'].wait(timeout=10)
+            except (OSError, subprocess.SubprocessError) as e:
+                logger.warning(f"Failed to stop worker {worker_id} on {host.name}: {str(e)}")
+                worker['process'].kill()
+            worker['log'].close()
+            logger.info(f"Stopped worker {worker_id} on {host.name}")
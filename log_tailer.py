@@ -0,0 +1,143 @@
+import time
+import heapq
+import random
+import logging
+import argparse
+
+from aws_backend import get_client
+
+logger = logging.getLogger(__name__)
+
+THROTTLING_ERRORS = ('ThrottlingException', 'LimitExceededException', 'ServiceUnavailableException')
+# Streams the CloudWatch agent writes for each instance, see get_cloudwatch_config
+STREAM_SUFFIXES = ('user-data', 'chromedriver')
+# filter_log_events takes at most this many logStreamNames
+MAX_STREAM_NAMES = 100
+
+class LogTailer:
+    """Incrementally tail the CloudWatch log streams of many instances at once
+
+    Each poll is one filter_log_events query (plus its pages) per 100 log
+    streams, naming each instance's streams so the service only reads
+    those, starting from the newest timestamp already printed. A short
+    lookback window catches events that are ingested late, and the eventIds
+    seen inside that window are the only thing remembered, so memory stays
+    bounded however long the tail runs. Throttling backs off exponentially
+    with jitter.
+    """
+
+    def __init__(self, logs, log_group, instance_ids, poll_interval=5,
+                 lookback_ms=30000, max_backoff=60):
+        self.logs = logs
+        self.log_group = log_group
+        self.instance_ids = list(instance_ids)
+        self.poll_interval = poll_interval
+        self.lookback_ms = lookback_ms
+        self.max_backoff = max_backoff
+        self.cursor = int(time.time() * 1000) - lookback_ms
+        self.seen = set()  # eventIds inside the lookback window
+        self.expiry = []  # Heap of (timestamp, eventId), to forget the oldest first
+        self.backoff = 0
+
+    def query_args(self):
+        """Arguments for one query per chunk of the instances' log streams"""
+        streams = [f"{instance_id}/{suffix}" for instance_id in self.instance_ids for suffix in STREAM_SUFFIXES]
+        start_time = max(0, self.cursor - self.lookback_ms)
+        return [{
+            'logGroupName': self.log_group,
+            'startTime': start_time,
+            'logStreamNames': streams[i:i + MAX_STREAM_NAMES]
+        } for i in range(0, len(streams), MAX_STREAM_NAMES)]
+    
+    def fetch(self, args):
+        """All pages of one query's events
+
+        Naming a stream that does not exist yet, as for an instance still
+        booting, fails the whole query, so that chunk falls back to one
+        prefix query per instance.
+        """
+        try:
+            yield from self.fetch_pages(args)
+        except self.logs.exceptions.ResourceNotFoundException:
+            instance_ids = sorted({name.partition('/')[0] for name in args['logStreamNames']})
+            for instance_id in instance_ids:
+                yield from self.fetch_pages({
+                    'logGroupName': args['logGroupName'],
+                    'startTime': args['startTime'],
+                    'logStreamNamePrefix': f"{instance_id}/"
+                })
+    
+    def fetch_pages(self, args):
+        while True:
+            response = self.logs.filter_log_events(**args)
+            yield from response.get('events', [])
+            next_token = response.get('nextToken')
+            if not next_token:
+                return
+            args = dict(args, nextToken=next_token)
+
+    def forget_old_events(self):
+        """Drop eventIds that have fallen out of the lookback window
+
+        Streams and pages interleave timestamps, so arrival order says
+        nothing about age; the heap pops them by timestamp instead.
+        """
+        horizon = self.cursor - self.lookback_ms
+        while self.expiry and self.expiry[0][0] < horizon:
+            _, event_id = heapq.heappop(self.expiry)
+            self.seen.discard(event_id)
+
+    def poll(self):
+        """Fetch events since the last poll and return them in timestamp order"""
+        events = []
+        for args in self.query_args():
+            for event in self.fetch(args):
+                if event['eventId'] in self.seen:
+                    continue
+                self.seen.add(event['eventId'])
+                heapq.heappush(self.expiry, (event['timestamp'], event['eventId']))
+                events.append(event)
+
+        events.sort(key=lambda event: event['timestamp'])
+        if events:
+            self.cursor = max(self.cursor, events[-1]['timestamp'])
+        self.forget_old_events()
+        return events
+
+    def run(self, stop=None):
+        """Print new events until interrupted, or until stop() returns True"""
+        logger.info(f"Tailing {self.log_group} for {len(self.instance_ids)} instance(s)")
+        try:
+            while not (stop and stop()):
+                try:
+                    for event in self.poll():
+                        print(f"[{event['logStreamName']}] {event['message']}")
+                    self.backoff = 0
+                    time.sleep(self.poll_interval)
+                except self.logs.exceptions.ClientError as e:
+                    if e.response['Error']['Code'] not in THROTTLING_ERRORS:
+                        raise
+                    self.backoff = min(self.max_backoff, max(self.poll_interval, self.backoff * 2))
+                    delay = self.backoff / 2 + random.uniform(0, self.backoff / 2)
+                    logger.warning(f"CloudWatch Logs throttled, backing off {delay:.1f}s")
+                    time.sleep(delay)
+        except KeyboardInterrupt:
+            logger.info("Stopped tailing logs")
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Tail CloudWatch logs for one or more scraper instances",
+        epilog="Example: python3 log_tailer.py i-0123456789abcdef0 i-0fedcba9876543210"
+    )
+    parser.add_argument('instance_ids', nargs='+', help="Instances whose log streams to tail")
+    parser.add_argument('--log-group', default='/aws/ec2/selenium-scraper')
+    parser.add_argument('--interval', type=float, default=5, help="Seconds between polls")
+    args = parser.parse_args()
+
+    logs = get_client('logs')
+    LogTailer(logs, args.log_group, args.instance_ids, poll_interval=args.interval).run()
@@ -0,0 +1,144 @@
+import math
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_NAMESPACE = 'DentalScraper'
+# PutMetricData limits per datum and per call
+MAX_VALUES_PER_DATUM = 150
+MAX_DATUMS_PER_CALL = 1000
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not samples:
+        return None
+    return samples[max(0, math.ceil(fraction * len(samples)) - 1)]
+
+def summarize(samples):
+    """count, p50, p95, p99 and max of a list of samples"""
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'p50': percentile(samples, 0.50),
+        'p95': percentile(samples, 0.95),
+        'p99': percentile(samples, 0.99),
+        'max': samples[-1] if samples else None
+    }
+
+class Metrics:
+    """Thread-safe histograms and counters, exported to CloudWatch
+
+    observe() records a sample (seconds unless a unit is given) and
+    increment() bumps a counter. Every interval the background thread, or
+    flush(), logs p50/p95/p99 per histogram and sends the window to
+    CloudWatch as value/count pairs, so CloudWatch can compute the same
+    percentiles across every instance reporting the metric. Without a
+    cloudwatch client the summary is only logged. totals keeps counters
+    across flushes.
+    """
+
+    def __init__(self, cloudwatch=None, namespace=METRICS_NAMESPACE, dimensions=None, interval=60):
+        self.cloudwatch = cloudwatch
+        self.namespace = namespace
+        self.dimensions = [{'Name': name, 'Value': value} for name, value in (dimensions or {}).items()]
+        self.interval = interval
+        self.histograms = {}  # name -> (unit, [samples])
+        self.counters = {}
+        self.totals = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        """Stop the background flush and export what is left"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+        self.flush()
+
+    def observe(self, name, value, unit='Seconds'):
+        with self.lock:
+            self.histograms.setdefault(name, (unit, []))[1].append(value)
+
+    def increment(self, name, count=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+            self.totals[name] = self.totals.get(name, 0) + count
+
+    @contextmanager
+    def timer(self, name):
+        """Observe how long the block took, whether or not it raised"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started)
+
+    def summary(self):
+        """Percentiles of every histogram and the counters in the current window"""
+        with self.lock:
+            summary = {name: summarize(samples) for name, (_, samples) in self.histograms.items()}
+            summary.update(self.counters)
+        return summary
+
+    def flush(self):
+        """Log and export the current window, then start a new one"""
+        with self.lock:
+            histograms, self.histograms = self.histograms, {}
+            counters, self.counters = self.counters, {}
+        if not histograms and not counters:
+            return
+
+        for name, (unit, samples) in sorted(histograms.items()):
+            stats = summarize(samples)
+            logger.info(f"Metric {name}: n={stats['count']} p50={stats['p50']:.3f} "
+                        f"p95={stats['p95']:.3f} p99={stats['p99']:.3f} max={stats['max']:.3f}")
+        if counters:
+            logger.info("Counters: " + ", ".join(f"{name}={count}" for name, count in sorted(counters.items())))
+        if self.cloudwatch is None:
+            return
+
+        datums = []
+        for name, (unit, samples) in histograms.items():
+            # Identical values share a count; each datum holds at most 150 distinct values
+            counts = {}
+            for sample in samples:
+                value = round(sample, 3)
+                counts[value] = counts.get(value, 0) + 1
+            values = sorted(counts)
+            for start in range(0, len(values), MAX_VALUES_PER_DATUM):
+                chunk = values[start:start + MAX_VALUES_PER_DATUM]
+                datums.append({'MetricName': name, 'Dimensions': self.dimensions, 'Unit': unit,
+                               'Values': chunk, 'Counts': [counts[value] for value in chunk]})
+        for name, count in counters.items():
+            datums.append({'MetricName': name, 'Dimensions': self.dimensions, 'Unit': 'Count', 'Value': count})
+
+        for start in range(0, len(datums), MAX_DATUMS_PER_CALL):
+            try:
+                self.cloudwatch.put_metric_data(Namespace=self.namespace,
+                                                MetricData=datums[start:start + MAX_DATUMS_PER_CALL])
+            except Exception as e:
+                logger.warning(f"Failed to export metrics: {str(e)}")
+
+def count_api_calls(client, metrics):
+    """Count every API call a boto3 client makes as api_calls and api_calls.<service>.<Operation>"""
+    def before_call(event_name=None, **kwargs):
+        # event_name is before-call.<service>.<Operation>
+        metrics.increment('api_calls')
+        metrics.increment(f"api_calls.{event_name.split('.', 1)[1]}")
+        # Returning None lets botocore carry on with the request
+
+    client.meta.events.register('before-call', before_call)
@@ -0,0 +1,213 @@
+import time
+import logging
+import argparse
+
+from status_writer import PENDING_INDEX_NAME, pending_shard_key
+from aws_backend import get_client
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# Non-key attributes the controller and workers read from the pending
+# index; retry_after lets them skip locations still backing off
+PENDING_INDEX_ATTRIBUTES = ['retry_after']
+
+def missing_projection(index):
+    """Required attributes an existing index does not project"""
+    projection = index.get('Projection', {})
+    if projection.get('ProjectionType') == 'ALL':
+        return []
+    included = set(projection.get('NonKeyAttributes', []))
+    return [name for name in PENDING_INDEX_ATTRIBUTES if name not in included]
+
+class PendingIndexMigration:
+    """Create the sparse pending index and backfill pending_shard on existing rows"""
+
+    def __init__(self, dry_run=False, recreate=False):
+        self.dynamodb = get_client('dynamodb')
+        self.table_name = 'dental_location_control'
+        self.dry_run = dry_run
+        self.recreate = recreate
+
+    def create_index(self):
+        """Add the pending GSI to the control table if it is missing
+
+        An existing index must project PENDING_INDEX_ATTRIBUTES; an index
+        created before retry_after was added would silently break backoff.
+        GSI projections cannot be changed in place, so such an index is
+        deleted and created again with recreate, and is an error otherwise.
+        """
+        table = self.dynamodb.describe_table(TableName=self.table_name)['Table']
+        existing = {index['IndexName']: index for index in table.get('GlobalSecondaryIndexes', [])}
+        if PENDING_INDEX_NAME in existing:
+            missing = missing_projection(existing[PENDING_INDEX_NAME])
+            if not missing:
+                logger.info(f"Index {PENDING_INDEX_NAME} already exists")
+                return
+            if not self.recreate:
+                raise RuntimeError(f"Index {PENDING_INDEX_NAME} does not project {', '.join(missing)}; "
+                                   f"rerun with --recreate-index to rebuild it")
+            self.delete_index()
+
+        index = {
+            'IndexName': PENDING_INDEX_NAME,
+            'KeySchema': [
+                {'AttributeName': 'pending_shard', 'KeyType': 'HASH'},
+                {'AttributeName': 'location_name', 'KeyType': 'RANGE'}
+            ],
+            'Projection': {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': PENDING_INDEX_ATTRIBUTES}
+        }
+        billing_mode = table.get('BillingModeSummary', {}).get('BillingMode', 'PROVISIONED')
+        if billing_mode == 'PROVISIONED':
+            throughput = table['ProvisionedThroughput']
+            index['ProvisionedThroughput'] = {
+                'ReadCapacityUnits': throughput['ReadCapacityUnits'],
+                'WriteCapacityUnits': throughput['WriteCapacityUnits']
+            }
+
+        if self.dry_run:
+            logger.info(f"[dry run] Would create index {PENDING_INDEX_NAME}")
+            return
+
+        self.dynamodb.update_table(
+            TableName=self.table_name,
+            AttributeDefinitions=[
+                {'AttributeName': 'pending_shard', 'AttributeType': 'S'},
+                {'AttributeName': 'location_name', 'AttributeType': 'S'}
+            ],
+            GlobalSecondaryIndexUpdates=[{'Create': index}]
+        )
+        logger.info(f"Creating index {PENDING_INDEX_NAME}...")
+
+    def delete_index(self, poll_seconds=15):
+        """Delete the pending index and wait until it is gone"""
+        if self.dry_run:
+            logger.info(f"[dry run] Would delete and recreate index {PENDING_INDEX_NAME}")
+            return
+        self.dynamodb.update_table(
+            TableName=self.table_name,
+            GlobalSecondaryIndexUpdates=[{'Delete': {'IndexName': PENDING_INDEX_NAME}}]
+        )
+        logger.info(f"Deleting index {PENDING_INDEX_NAME} to rebuild its projection...")
+        while True:
+            table = self.dynamodb.describe_table(TableName=self.table_name)['Table']
+            if not any(index['IndexName'] == PENDING_INDEX_NAME
+                       for index in table.get('GlobalSecondaryIndexes', [])):
+                return
+            time.sleep(poll_seconds)
+
+    def wait_for_index(self, poll_seconds=15):
+        """Wait until the pending index is ACTIVE"""
+        if self.dry_run:
+            return
+        while True:
+            table = self.dynamodb.describe_table(TableName=self.table_name)['Table']
+            for index in table.get('GlobalSecondaryIndexes', []):
+                if index['IndexName'] == PENDING_INDEX_NAME:
+                    status = index['IndexStatus']
+                    break
+            else:
+                raise RuntimeError(f"Index {PENDING_INDEX_NAME} not found on {self.table_name}")
+
+            if status == 'ACTIVE':
+                logger.info(f"Index {PENDING_INDEX_NAME} is active")
+                return
+            logger.info(f"Index {PENDING_INDEX_NAME} is {status}, waiting...")
+            time.sleep(poll_seconds)
+
+    def iter_locations(self, country_codes=None):
+        """Yield the key, status and pending_shard of every location"""
+        projection = {
+            'ProjectionExpression': 'country_code, location_name, #status, pending_shard',
+            'ExpressionAttributeNames': {'#status': 'status'}
+        }
+        if country_codes:
+            operations = [('query', {
+                'TableName': self.table_name,
+                'KeyConditionExpression': 'country_code = :cc',
+                'ExpressionAttributeValues': {':cc': {'S': country_code}},
+                **projection
+            }) for country_code in country_codes]
+        else:
+            operations = [('scan', {'TableName': self.table_name, **projection})]
+
+        for operation, args in operations:
+            while True:
+                response = getattr(self.dynamodb, operation)(**args)
+                yield from response.get('Items', [])
+                last_key = response.get('LastEvaluatedKey')
+                if not last_key:
+                    break
+                args['ExclusiveStartKey'] = last_key
+
+    def backfill(self, country_codes=None):
+        """Set pending_shard on INACTIVE rows and remove it everywhere else"""
+        counts = {'scanned': 0, 'added': 0, 'removed': 0, 'skipped': 0}
+        for item in self.iter_locations(country_codes):
+            counts['scanned'] += 1
+            country_code = item['country_code']['S']
+            location_name = item['location_name']['S']
+            status = item.get('status', {}).get('S', '')
+            current_shard = item.get('pending_shard', {}).get('S')
+
+            if status == 'INACTIVE':
+                wanted_shard = pending_shard_key(country_code, location_name)
+                if current_shard == wanted_shard:
+                    continue
+                update_expr = "SET pending_shard = :shard"
+                expr_attrs = {':shard': {'S': wanted_shard}}
+                action = 'added'
+            elif current_shard is not None:
+                update_expr = "REMOVE pending_shard"
+                expr_attrs = {}
+                action = 'removed'
+            else:
+                continue
+
+            if self.dry_run:
+                counts[action] += 1
+                continue
+
+            # Only touch the row if its status has not moved since we read it
+            expr_attrs[':status'] = {'S': status}
+            try:
+                self.dynamodb.update_item(
+                    TableName=self.table_name,
+                    Key={
+                        'country_code': {'S': country_code},
+                        'location_name': {'S': location_name}
+                    },
+                    UpdateExpression=update_expr,
+                    ConditionExpression='#status = :status',
+                    ExpressionAttributeNames={'#status': 'status'},
+                    ExpressionAttributeValues=expr_attrs
+                )
+                counts[action] += 1
+            except self.dynamodb.exceptions.ConditionalCheckFailedException:
+                counts['skipped'] += 1
+
+        logger.info(f"Backfill {'(dry run) ' if self.dry_run else ''}complete: "
+                    f"{counts['scanned']} scanned, {counts['added']} added, "
+                    f"{counts['removed']} removed, {counts['skipped']} changed during backfill")
+        return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create the pending GSI on dental_location_control and backfill pending_shard",
+        epilog="Example: python3 migrate_pending_index.py --countries UK IE"
+    )
+    parser.add_argument('--countries', nargs='*', help="Only backfill these countries (default: whole table)")
+    parser.add_argument('--skip-index', action='store_true', help="Only run the backfill")
+    parser.add_argument('--dry-run', action='store_true', help="Report what would change without writing")
+    parser.add_argument('--recreate-index', action='store_true',
+                        help="Rebuild an existing index that does not project retry_after")
+    args = parser.parse_args()
+
+    migration = PendingIndexMigration(dry_run=args.dry_run, recreate=args.recreate_index)
+    if not args.skip_index:
+        migration.create_index()
+        migration.wait_for_index()
+    migration.backfill([country_code.upper() for country_code in args.countries or []])
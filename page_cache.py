@@ -0,0 +1,314 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+import threading
+from urllib.parse import urlparse
+
+import requests
+
+from aws_backend import get_client
+
+logger = logging.getLogger(__name__)
+
+CACHE_BUCKET = 'dental-scraper-cache'
+DEFAULT_CACHE_URL = f's3://{CACHE_BUCKET}/pages'
+
+# Request headers that change what a server sends back, and so the cache key
+VARY_HEADERS = ('accept', 'accept-language', 'user-agent')
+# Eviction frees space down to this share of max_bytes, so a full cache is
+# not rescanned on every put
+EVICT_TO = 0.9
+
+def cache_key(url, headers=None):
+    """Key for a URL and the request headers that affect its response"""
+    varying = {name.lower(): value for name, value in (headers or {}).items()
+               if name.lower() in VARY_HEADERS}
+    material = url + '\n' + json.dumps(varying, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+class LocalCacheBackend:
+    """Cache on local disk, evicting least recently used entries beyond max_bytes
+
+    The cache's size is scanned once at start and then kept as a running
+    total, so the directory is only scanned again when a put takes it past
+    max_bytes, and eviction then frees down to EVICT_TO of it.
+    """
+
+    def __init__(self, root, max_bytes=1024 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(root, 'meta'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'bodies'), exist_ok=True)
+        self.total_bytes = sum(size for _, size, _, _ in self.files())
+
+    def path(self, kind, name):
+        return os.path.join(self.root, kind, name)
+
+    def size(self, kind, name):
+        try:
+            return os.stat(self.path(kind, name)).st_size
+        except FileNotFoundError:
+            return 0
+
+    def files(self):
+        """(mtime, size, kind, name) of every cached file"""
+        files = []
+        for kind in ('meta', 'bodies'):
+            for name in os.listdir(os.path.join(self.root, kind)):
+                if name.endswith('.partial'):
+                    continue
+                try:
+                    stat = os.stat(self.path(kind, name))
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, kind, name))
+        return files
+
+    def get(self, kind, name):
+        try:
+            with open(self.path(kind, name), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # mtime doubles as last access time for LRU eviction
+        os.utime(self.path(kind, name))
+        return data
+
+    def put(self, kind, name, data):
+        path = self.path(kind, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.partial', 'wb') as f:
+            f.write(data)
+        with self.lock:
+            previous = self.size(kind, name)
+            os.replace(path + '.partial', path)
+            self.total_bytes += len(data) - previous
+            full = self.total_bytes > self.max_bytes
+        if full:
+            self.evict()
+
+    def exists(self, kind, name):
+        return os.path.exists(self.path(kind, name))
+
+    def delete(self, kind, name):
+        with self.lock:
+            self.remove(kind, name)
+
+    def remove(self, kind, name):
+        """Delete a file and take it off the running total; the caller holds the lock"""
+        size = self.size(kind, name)
+        try:
+            os.remove(self.path(kind, name))
+        except FileNotFoundError:
+            return
+        self.total_bytes -= size
+
+    def evict(self):
+        """Drop least recently used entries, then bodies no entry refers to, once over max_bytes"""
+        with self.lock:
+            files = self.files()
+            self.total_bytes = sum(size for _, size, _, _ in files)
+            if self.total_bytes <= self.max_bytes:
+                return
+
+            metas = sorted(f for f in files if f[2] == 'meta')
+            evicted_until = float('inf')
+            while metas and self.total_bytes > self.max_bytes * EVICT_TO:
+                evicted_until, _, kind, name = metas.pop(0)
+                self.remove(kind, name)
+
+            referenced = set()
+            for _, _, kind, name in metas:
+                # Read directly so the scan does not count as an access
+                with open(self.path(kind, name), 'rb') as f:
+                    referenced.add(json.loads(f.read())['body_hash'])
+            for mtime, _, kind, name in files:
+                # A body newer than every evicted entry may be one whose entry
+                # is still being stored, since store() writes the body first
+                if kind == 'bodies' and name[:-len('.gz')] not in referenced and mtime <= evicted_until:
+                    self.remove(kind, name)
+
+class S3CacheBackend:
+    """Cache shared by every worker through S3
+
+    S3 has no access times, so there is no LRU here: entries past the
+    cache's max_age are deleted when next read, and an S3 lifecycle rule
+    on the prefix should expire what is never read again.
+    """
+
+    def __init__(self, s3, bucket, prefix=''):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+
+    def key(self, kind, name):
+        return f'{self.prefix}/{kind}/{name}' if self.prefix else f'{kind}/{name}'
+
+    def get(self, kind, name):
+        try:
+            return self.s3.get_object(Bucket=self.bucket, Key=self.key(kind, name))['Body'].read()
+        except self.s3.exceptions.NoSuchKey:
+            return None
+
+    def put(self, kind, name, data):
+        self.s3.put_object(Bucket=self.bucket, Key=self.key(kind, name), Body=data)
+
+    def exists(self, kind, name):
+        try:
+            self.s3.head_object(Bucket=self.bucket, Key=self.key(kind, name))
+            return True
+        except self.s3.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def delete(self, kind, name):
+        self.s3.delete_object(Bucket=self.bucket, Key=self.key(kind, name))
+
+def cache_backend_from_url(url, s3=None):
+    """Backend for s3://bucket/prefix or file:///path (a bare path also works)"""
+    parsed = urlparse(url)
+    if parsed.scheme == 's3':
+        s3 = s3 or get_client('s3')
+        return S3CacheBackend(s3, parsed.netloc, parsed.path)
+    if parsed.scheme in ('', 'file'):
+        return LocalCacheBackend(parsed.path)
+    raise ValueError(f"Unsupported cache URL: {url}")
+
+class PageCache:
+    """Content-addressed page cache with conditional revalidation
+
+    An entry (keyed by URL and varying request headers) records the
+    response's ETag and Last-Modified and points at a gzip body stored
+    under its own SHA-256, so identical pages are stored once. Entries
+    younger than ttl are served as is. Older ones are revalidated with a
+    conditional GET; a 304 refreshes the entry and serves the stored body
+    without re-rendering the page. Entries older than max_age, or without
+    validators once stale, are dropped.
+    """
+
+    def __init__(self, backend, ttl=24 * 3600, max_age=30 * 24 * 3600, session=None, timeout=15,
+                 clock=time.time):
+        self.backend = backend
+        self.clock = clock
+        self.ttl = ttl
+        self.max_age = max_age
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def get_entry(self, key):
+        data = self.backend.get('meta', f'{key}.json')
+        return json.loads(data) if data else None
+
+    def get_body(self, entry):
+        data = self.backend.get('bodies', f"{entry['body_hash']}.gz")
+        return gzip.decompress(data).decode('utf-8') if data else None
+
+    def lookup(self, url, headers=None):
+        """Return the cached body for url if it is fresh or still valid at the origin, else None"""
+        key = cache_key(url, headers)
+        entry = self.get_entry(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        age = self.clock() - entry['stored_at']
+        if age >= self.max_age:
+            self.backend.delete('meta', f'{key}.json')
+            self.misses += 1
+            return None
+        if age >= self.ttl:
+            if not self.revalidate(url, headers, entry):
+                self.misses += 1
+                return None
+            entry['stored_at'] = self.clock()
+            self.backend.put('meta', f'{key}.json', json.dumps(entry).encode('utf-8'))
+            self.revalidated += 1
+        else:
+            self.hits += 1
+
+        body = self.get_body(entry)
+        if body is None:
+            self.backend.delete('meta', f'{key}.json')
+        return body
+
+    def revalidate(self, url, headers, entry):
+        """Ask the origin whether the cached version is still current"""
+        conditional = dict(headers or {})
+        if entry.get('etag'):
+            conditional['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            conditional['If-Modified-Since'] = entry['last_modified']
+        if len(conditional) == len(headers or {}):
+            return False
+        try:
+            response = self.session.get(url, headers=conditional, timeout=self.timeout, stream=True)
+            response.close()
+            return response.status_code == 304
+        except requests.RequestException as e:
+            logger.warning(f"Failed to revalidate {url}: {str(e)}")
+            return False
+
+    def validators(self, url, headers=None):
+        """ETag and Last-Modified for url, from a HEAD request"""
+        try:
+            response = self.session.head(url, headers=headers, timeout=self.timeout, allow_redirects=True)
+            return response.headers.get('ETag'), response.headers.get('Last-Modified')
+        except requests.RequestException as e:
+            logger.warning(f"Failed to read validators for {url}: {str(e)}")
+            return None, None
+
+    def store(self, url, body, headers=None, etag=None, last_modified=None):
+        """Cache a page body for url"""
+        data = body.encode('utf-8')
+        body_hash = hashlib.sha256(data).hexdigest()
+        if not self.backend.exists('bodies', f'{body_hash}.gz'):
+            self.backend.put('bodies', f'{body_hash}.gz', gzip.compress(data, mtime=0))
+        entry = {
+            'url': url,
+            'body_hash': body_hash,
+            'etag': etag,
+            'last_modified': last_modified,
+            'stored_at': self.clock()
+        }
+        self.backend.put('meta', f'{cache_key(url, headers)}.json', json.dumps(entry).encode('utf-8'))
+
+    def stats(self):
+        return {'hits': self.hits, 'revalidated': self.revalidated, 'misses': self.misses}
+
+def load_page(get_driver, url, cache=None, headers=None, fetcher=None):
+    """Page source for url, from the cache when possible, otherwise fetched
+
+    Misses go through fetcher (plain HTTP with a browser fallback) when one
+    is given, otherwise straight to Chrome. get_driver is only called when
+    a page has to be rendered, so a fully cached rerun never starts a
+    browser. Returns (html, source) with source 'cache', 'http' or 'browser'.
+    """
+    if cache is not None:
+        html = cache.lookup(url, headers)
+        if html is not None:
+            logger.info(f"Cache hit for {url}")
+            return html, 'cache'
+
+    etag = last_modified = None
+    if fetcher is not None:
+        html, source, etag, last_modified = fetcher.fetch(url, get_driver, headers)
+    else:
+        driver = get_driver()
+        driver.get(url)
+        html, source = driver.page_source, 'browser'
+    if cache is not None:
+        try:
+            if source == 'browser' and etag is None and last_modified is None:
+                etag, last_modified = cache.validators(url, headers)
+            cache.store(url, html, headers, etag, last_modified)
+        except Exception as e:
+            logger.warning(f"Failed to cache {url}: {str(e)}")
+    return html, source
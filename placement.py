@@ -0,0 +1,97 @@
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# RunInstances error codes by what they say about where to launch next
+CAPACITY_ERRORS = ('InsufficientInstanceCapacity', 'InsufficientCapacity', 'InsufficientHostCapacity',
+                   'Unsupported', 'SpotCapacityNotAvailable')
+PRICE_ERRORS = ('SpotMaxPriceTooLow',)
+QUOTA_ERRORS = ('MaxSpotInstanceCountExceeded', 'VcpuLimitExceeded', 'InstanceLimitExceeded')
+# Capacity errors that exhaust the subnet for every instance type
+SUBNET_ERRORS = ('InsufficientFreeAddressesInSubnet',)
+
+class NoCapacityError(Exception):
+    """Every placement is cooling down or failed; the launch should wait"""
+
+def classify_launch_error(error):
+    """Return 'capacity', 'subnet', 'price', 'quota' or None for a RunInstances ClientError"""
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    if code in CAPACITY_ERRORS:
+        return 'capacity'
+    if code in SUBNET_ERRORS:
+        return 'subnet'
+    if code in PRICE_ERRORS:
+        return 'price'
+    if code in QUOTA_ERRORS:
+        return 'quota'
+    return None
+
+class PlacementEngine:
+    """Choose instance type and subnet for spot launches, routing around failures
+
+    Every (instance type, subnet) pair is a placement. A capacity error
+    cools down that placement; a subnet out of free addresses is cooled
+    down for every instance type, for capacity_cooldown; a price error
+    cools down the instance type in every subnet; a quota error stops all
+    launches for quota_cooldown.
+    Cooldowns double with each consecutive failure up to max_cooldown and
+    reset on success. Placements are tried in order of recent success, so
+    the pool that last worked is tried first.
+    """
+
+    def __init__(self, instance_types, subnet_ids, capacity_cooldown=300, price_cooldown=900,
+                 quota_cooldown=600, max_cooldown=3600, clock=time.time):
+        self.placements = [(instance_type, subnet_id)
+                           for instance_type in instance_types for subnet_id in subnet_ids]
+        self.cooldowns = {
+            'capacity': capacity_cooldown,
+            'subnet': capacity_cooldown,
+            'price': price_cooldown,
+            'quota': quota_cooldown
+        }
+        self.max_cooldown = max_cooldown
+        self.blocked_until = {}  # placement, instance type, subnet or 'all' -> timestamp
+        self.failures = {}  # same keys -> consecutive failures
+        self.last_success = {}  # placement -> timestamp
+        self.clock = clock
+
+    def blocked(self, key, now):
+        return self.blocked_until.get(key, 0) > now
+
+    def candidates(self, now=None):
+        """Placements that are not cooling down, most recently successful first"""
+        now = now or self.clock()
+        if self.blocked('all', now):
+            return []
+        available = [placement for placement in self.placements
+                     if not any(self.blocked(key, now) for key in (placement, *placement))]
+        # Stable sort keeps the configured preference order among equals
+        return sorted(available, key=lambda placement: -self.last_success.get(placement, 0))
+
+    def available(self, now=None):
+        return bool(self.candidates(now))
+
+    def record_success(self, placement, now=None):
+        self.last_success[placement] = now or self.clock()
+        for key in (placement, *placement, 'all'):
+            self.failures.pop(key, None)
+
+    def record_failure(self, placement, kind, now=None):
+        """Cool down whatever the error says is exhausted"""
+        now = now or self.clock()
+        key = {'capacity': placement, 'subnet': placement[1], 'price': placement[0], 'quota': 'all'}[kind]
+        self.failures[key] = self.failures.get(key, 0) + 1
+        cooldown = min(self.max_cooldown, self.cooldowns[kind] * 2 ** (self.failures[key] - 1))
+        self.blocked_until[key] = now + cooldown
+        scope = {'capacity': f"{placement[0]} in {placement[1]}", 'subnet': f"every type in {placement[1]}",
+                 'price': f"{placement[0]} everywhere", 'quota': "all launches"}[kind]
+        logger.warning(f"{kind.capitalize()} error launching {placement[0]} in {placement[1]}, "
+                       f"pausing {scope} for {cooldown}s")
+
+    def next_available_at(self):
+        """When the first cooled-down placement can be tried again"""
+        now = self.clock()
+        times = [max(self.blocked_until.get(key, 0) for key in (placement, *placement))
+                 for placement in self.placements]
+        return max(min(times), self.blocked_until.get('all', 0), now)
@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import zlib
+import logging
+import threading
+from urllib.parse import quote, urlparse
+
+from aws_backend import get_client
+
+logger = logging.getLogger(__name__)
+
+RESULTS_BUCKET = 'dental-scraper-results'
+DEFAULT_RESULTS_URL = f's3://{RESULTS_BUCKET}/results'
+
+# S3 needs every part but the last to be at least 5 MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+class S3ObjectWriter:
+    """Stream bytes to one S3 object
+
+    Bytes are buffered until part_size and then sent as a multipart upload
+    part, so memory stays bounded however large the object gets. Objects
+    that never reach part_size are sent with a single put_object.
+    """
+
+    def __init__(self, s3, bucket, key, part_size=8 * 1024 * 1024):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts = []
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.part_size:
+            self.upload_part()
+
+    def upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType='application/x-ndjson',
+                ContentEncoding='gzip'
+            )['UploadId']
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=bytes(self.buffer)
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.buffer.clear()
+
+    def close(self):
+        if self.upload_id is None:
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer),
+                               ContentType='application/x-ndjson', ContentEncoding='gzip')
+        else:
+            if self.buffer:
+                self.upload_part()
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={'Parts': self.parts}
+            )
+        self.buffer.clear()
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        self.buffer.clear()
+
+class S3Backend:
+    def __init__(self, s3, bucket, prefix='', part_size=8 * 1024 * 1024):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.part_size = part_size
+
+    def open(self, key):
+        full_key = f'{self.prefix}/{key}' if self.prefix else key
+        return S3ObjectWriter(self.s3, self.bucket, full_key, self.part_size)
+
+    def describe(self, key):
+        return f's3://{self.bucket}/{self.prefix}/{key}' if self.prefix else f's3://{self.bucket}/{key}'
+
+class LocalObjectWriter:
+    """Write one file, renamed into place on close so readers never see a partial object"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path + '.partial', 'wb')
+
+    def write(self, data):
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        os.replace(self.path + '.partial', self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.path + '.partial')
+
+class LocalBackend:
+    """Filesystem backend for tests and local runs"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def open(self, key):
+        return LocalObjectWriter(os.path.join(self.root, key))
+
+    def describe(self, key):
+        return os.path.join(self.root, key)
+
+def backend_from_url(url, s3=None):
+    """Backend for s3://bucket/prefix or file:///path (a bare path also works)"""
+    parsed = urlparse(url)
+    if parsed.scheme == 's3':
+        s3 = s3 or get_client('s3')
+        return S3Backend(s3, parsed.netloc, parsed.path)
+    if parsed.scheme in ('', 'file'):
+        return LocalBackend(parsed.path)
+    raise ValueError(f"Unsupported results URL: {url}")
+
+class Partition:
+    """One open, gzip-compressed NDJSON object for a country/location"""
+
+    def __init__(self, writer, key):
+        self.writer = writer
+        self.key = key
+        # wbits=31 writes a gzip header and trailer, so objects gunzip directly
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self.records = 0
+        self.raw_bytes = 0
+        self.opened_at = time.time()
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def write(self, line):
+        self.writer.write(self.compressor.compress(line))
+        self.records += 1
+        self.raw_bytes += len(line)
+
+    def close(self):
+        self.closed = True
+        self.writer.write(self.compressor.flush())
+        self.writer.close()
+
+class ResultSink:
+    """Stream scraped records into compressed objects partitioned by country and location
+
+    Records are appended to an open gzip NDJSON object per location at
+    country=<cc>/location=<name>/<worker>-<seq>.ndjson.gz. The object is
+    closed, and the next record starts a new one, once it holds
+    max_object_bytes of uncompressed data or has been open for
+    max_object_seconds; close_location() closes it when the location is
+    done. Only closed objects are visible, so close a location before
+    marking it COMPLETE.
+    """
+
+    def __init__(self, backend, worker_id='local', max_object_bytes=64 * 1024 * 1024,
+                 max_object_seconds=300, check_interval=5):
+        self.backend = backend
+        self.worker_id = worker_id
+        self.max_object_bytes = max_object_bytes
+        self.max_object_seconds = max_object_seconds
+        self.check_interval = check_interval
+        self.partitions = {}  # (country_code, location_name) -> Partition
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Close objects that reach max_object_seconds even when no more records arrive"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.check_interval):
+            now = time.time()
+            with self.lock:
+                expired = [key for key, partition in self.partitions.items()
+                           if now - partition.opened_at >= self.max_object_seconds]
+            for key in expired:
+                self.close_location(*key)
+
+    def partition_key(self, country_code, location_name):
+        with self.lock:
+            self.sequence += 1
+            sequence = self.sequence
+        return (f"country={quote(country_code, safe='')}/location={quote(location_name, safe='')}/"
+                f"{self.worker_id}-{sequence:06d}.ndjson.gz")
+
+    def write(self, country_code, location_name, record):
+        """Append one record to its location's open object"""
+        line = (json.dumps(record, default=str, separators=(',', ':')) + '\n').encode('utf-8')
+        location = (country_code, location_name)
+        while True:
+            with self.lock:
+                partition = self.partitions.get(location)
+            if partition is None:
+                key = self.partition_key(country_code, location_name)
+                opened = Partition(self.backend.open(key), key)
+                with self.lock:
+                    partition = self.partitions.setdefault(location, opened)
+                if partition is not opened:
+                    opened.writer.abort()
+
+            with partition.lock:
+                # Another thread may have rolled the object over meanwhile
+                if partition.closed:
+                    continue
+                partition.write(line)
+                full = partition.raw_bytes >= self.max_object_bytes
+            break
+        if full:
+            self.close_location(country_code, location_name)
+
+    def close_location(self, country_code, location_name):
+        """Close a location's open object, making its records durable"""
+        with self.lock:
+            partition = self.partitions.pop((country_code, location_name), None)
+        if partition is None:
+            return None
+        with partition.lock:
+            partition.close()
+        logger.info(f"Wrote {partition.records} records for {country_code}:{location_name} "
+                    f"to {self.backend.describe(partition.key)}")
+        return partition.key
+
+    def abort_location(self, country_code, location_name):
+        """Drop a location's open object, e.g. when its scrape fails"""
+        with self.lock:
+            partition = self.partitions.pop((country_code, location_name), None)
+        if partition is not None:
+            with partition.lock:
+                partition.closed = True
+                partition.writer.abort()
+
+    def close(self):
+        """Stop the age check and close every open object"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.check_interval + 1)
+        with self.lock:
+            locations = list(self.partitions)
+        for location in locations:
+            try:
+                self.close_location(*location)
+            except Exception as e:
+                logger.error(f"Failed to close results for {location[0]}:{location[1]}: {str(e)}")
@@ -0,0 +1,48 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+def parse_country_settings(values, cast=int):
+    """Turn ['UK=2', 'FR=1'] from the command line into {'UK': 2, 'FR': 1}"""
+    settings = {}
+    for value in values or []:
+        country_code, _, setting = value.partition('=')
+        if not setting:
+            raise ValueError(f"Expected COUNTRY=VALUE, got {value!r}")
+        settings[country_code.upper()] = cast(setting)
+    return settings
+
+def allocate_slots(free_slots, demand, running, priorities=None, quotas=None):
+    """Share free instance slots between countries
+
+    demand is the number of launchable locations per country and running
+    the instances each country already has. Slots go one at a time to the
+    country with the fewest instances per unit of priority (weighted
+    max-min fairness), so a country with priority 2 settles at twice the
+    instances of a priority 1 country while both have work. A country
+    never gets more than its demand or beyond its quota of running
+    instances. Returns {country_code: slots}.
+    """
+    priorities = priorities or {}
+    quotas = quotas or {}
+    slots = {country_code: 0 for country_code in demand}
+
+    def can_take(country_code):
+        if slots[country_code] >= demand[country_code]:
+            return False
+        quota = quotas.get(country_code)
+        return quota is None or running.get(country_code, 0) + slots[country_code] < quota
+
+    def load(country_code):
+        weight = max(priorities.get(country_code, 1), 1e-9)
+        return (running.get(country_code, 0) + slots[country_code]) / weight
+
+    for _ in range(max(0, free_slots)):
+        candidates = [country_code for country_code in demand if can_take(country_code)]
+        if not candidates:
+            break
+        # Ties go to the higher priority, then alphabetically for stable plans
+        country_code = min(candidates, key=lambda c: (load(c), -priorities.get(c, 1), c))
+        slots[country_code] += 1
+
+    return slots
@@ -1,12 +1,28 @@
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
-import boto3
 import logging
 import sys
+import os
+import re
 import json
+import time
+import random
+import shutil
+import functools
+import argparse
+import socket
+import threading
 import requests
 from datetime import datetime
 
+from status_writer import StatusWriter, PENDING_INDEX_NAME, PENDING_SHARDS, TABLE_NAME, held_by
+from metrics import Metrics
+from result_sink import ResultSink, DEFAULT_RESULTS_URL, backend_from_url
+from page_cache import PageCache, DEFAULT_CACHE_URL, cache_backend_from_url, load_page
+from fetcher import PageFetcher, EngineDetector
+from checkpoint import CheckpointStore
+from aws_backend import get_client, metadata_url
+
 # Set up logging
 logging.basicConfig(
     level=logging.INFO,
@@ -18,103 +34,999 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def update_location_status(country_code, location_name, status, error_message=None):
-    """Update location status in DynamoDB"""
+# The controller requeues a location whose lease runs out, so keep
+# extending it while we work
+LEASE_SECONDS = 600
+HEARTBEAT_INTERVAL = 60
+
+# Returns 404 until EC2 schedules this spot instance for interruption,
+# about two minutes before it happens
+SPOT_ACTION_URL = metadata_url('spot/instance-action')
+INTERRUPTION_CHECK_INTERVAL = 5
+
+# Warm pool workers remember their last location across a stop, so a
+# resumed worker never mistakes its old Location tag for new work
+LAST_LOCATION_FILE = '/var/tmp/dental-scraper-last-location'
+WARM_POLL_INTERVAL = 15
+
+# The pending index is eventually consistent and can keep listing rows
+# that were just claimed, so a worker that loses every race backs off and
+# eventually gives up instead of spinning on Query and UpdateItem
+CLAIM_ROUNDS = 5
+CLAIM_BACKOFF = 0.5  # Seconds, doubled per round and jittered
+
+# Set by --worker-id when the local executor runs this worker outside EC2;
+# it replaces the instance ID as the owner of claims
+WORKER_ID = None
+
+class LeaseHeartbeat:
+    """Background thread that keeps the leases on held locations alive
+
+    Each location is held under the owner that claimed it, and every beat
+    and release is conditional on that owner still holding it, so a worker
+    whose lease was requeued and claimed by another worker cannot extend
+    or release the new claim.
+    """
+
+    def __init__(self, interval=HEARTBEAT_INTERVAL, lease_seconds=LEASE_SECONDS, status_writer=None,
+                 clock=time.time):
+        self.interval = interval
+        self.lease_seconds = lease_seconds
+        self.status_writer = status_writer or get_status_writer()
+        self.dynamodb = self.status_writer.dynamodb
+        self.clock = clock
+        self.locations = {}  # (country_code, location_name) -> owner
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join(timeout=5)
+
+    def add(self, country_code, location_name, owner):
+        with self.lock:
+            self.locations[(country_code, location_name)] = owner
+        self.beat(country_code, location_name, owner)
+
+    def remove(self, country_code, location_name):
+        with self.lock:
+            self.locations.pop((country_code, location_name), None)
+
+    def owner(self, country_code, location_name):
+        with self.lock:
+            return self.locations.get((country_code, location_name))
+
+    def beat(self, country_code, location_name, owner):
+        """Extend the lease on one location while owner still holds it"""
+        condition, values, names = held_by(owner)
+        try:
+            self.dynamodb.update_item(
+                TableName='dental_location_control',
+                Key={
+                    'country_code': {'S': country_code},
+                    'location_name': {'S': location_name}
+                },
+                UpdateExpression="SET lease_expires = :expires, heartbeat_at = :timestamp",
+                ConditionExpression=condition,
+                ExpressionAttributeNames=dict({'#status': 'status'}, **names),
+                ExpressionAttributeValues=dict({
+                    ':expires': {'N': str(int(self.clock()) + self.lease_seconds)},
+                    ':timestamp': {'S': datetime.utcfromtimestamp(self.clock()).isoformat()}
+                }, **values)
+            )
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            logger.warning(f"Lost lease on {country_code}:{location_name}, it was requeued or reclaimed")
+            self.remove(country_code, location_name)
+        except Exception as e:
+            logger.error(f"Failed to heartbeat {country_code}:{location_name}: {str(e)}")
+
+    def beat_all(self):
+        """Extend the lease on every held location"""
+        with self.lock:
+            locations = list(self.locations.items())
+        for (country_code, location_name), owner in locations:
+            self.beat(country_code, location_name, owner)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.beat_all()
+
+    def release(self, country_code, location_name, reason):
+        """Hand a held location straight back to the queue
+
+        Unlike a lease the controller reaps, this does not count as a
+        failed attempt and the location is claimable again immediately.
+        """
+        owner = self.owner(country_code, location_name)
+        if owner is None:
+            return
+        self.remove(country_code, location_name)
+        try:
+            released = self.status_writer.write_with_retry(
+                (country_code, location_name), 'INACTIVE', {'error_message': reason},
+                condition=held_by(owner),
+                remove=('owner', 'lease_expires', 'retry_after')
+            )
+            if released:
+                logger.info(f"Released location {country_code}:{location_name}: {reason}")
+            else:
+                logger.warning(f"Location {country_code}:{location_name} is no longer ours, not releasing")
+        except Exception as e:
+            logger.error(f"Failed to release {country_code}:{location_name}: {str(e)}")
+
+    def release_all(self, reason):
+        with self.lock:
+            locations = list(self.locations)
+        for country_code, location_name in locations:
+            self.release(country_code, location_name, reason)
+
+class InterruptionWatcher:
+    """Background thread that watches for the spot interruption notice
+
+    On notice the registered callbacks run first, so work in flight can be
+    checkpointed and sessions stop claiming, then every location the
+    heartbeat holds is released back to the queue without waiting for its
+    lease to expire.
+    """
+
+    def __init__(self, heartbeat, interval=INTERRUPTION_CHECK_INTERVAL):
+        self.heartbeat = heartbeat
+        self.interval = interval
+        self.callbacks = []
+        self.interrupted = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join(timeout=5)
+
+    def on_interruption(self, callback):
+        self.callbacks.append(callback)
+
+    def check(self):
+        """Return the pending interruption notice, or None"""
+        if WORKER_ID:
+            # Only spot instances get interruption notices
+            return None
+        try:
+            response = requests.get(SPOT_ACTION_URL, timeout=2)
+            if response.status_code == 200:
+                return response.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.debug(f"Failed to read spot instance action: {str(e)}")
+        return None
+
+    def handle(self, notice):
+        """Run the callbacks, then release every held location"""
+        logger.warning(f"Spot interruption notice: {notice.get('action')} at {notice.get('time')}")
+        self.interrupted.set()
+        for callback in self.callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Interruption callback failed: {str(e)}", exc_info=True)
+        self.heartbeat.release_all(f"Spot interruption at {notice.get('time')}")
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            notice = self.check()
+            if notice is not None:
+                self.handle(notice)
+                return
+
+# Where scraped records go, s3://bucket/prefix or a local directory
+RESULTS_URL = DEFAULT_RESULTS_URL
+# Shared page cache, s3://bucket/prefix, a local directory or None
+PAGE_CACHE_URL = DEFAULT_CACHE_URL
+# 'auto' tries plain HTTP and falls back to Chrome, 'http' or 'browser' force one engine
+FETCH_ENGINE = 'auto'
+# 'lean' blocks heavy resources and keeps the profile in memory, 'full' loads
+# everything with verbose Chrome logging for debugging
+BROWSER_MODE = 'lean'
+
+# Blocked in lean mode through the DevTools protocol; stylesheets still load
+# since layout can change what scripts render
+BLOCKED_URL_PATTERNS = [
+    # Images, fonts and media
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.avif', '*.bmp', '*.ico', '*.svg',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*.mp4', '*.webm', '*.ogg', '*.mp3', '*.wav', '*.m4a',
+    # Analytics, ads and trackers
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+    '*googlesyndication.com*', '*facebook.net*', '*connect.facebook.com*', '*hotjar.com*',
+    '*segment.io*', '*segment.com/analytics*', '*mixpanel.com*', '*clarity.ms*',
+    '*newrelic.com*', '*nr-data.net*', '*intercom.io*', '*hubspot.com*', '*optimizely.com*'
+]
+# Rough resident memory per Chrome session, for sizing the session pool
+SESSION_MEMORY_GB = {'lean': 0.5, 'full': 1.0}
+
+_status_writer = None
+_status_writer_lock = threading.Lock()
+_result_sink = None
+_checkpoint_store = None
+_page_cache = None
+_fetcher = None
+_metrics = None
+_metrics_lock = threading.Lock()
+_instance_timings = None
+
+def get_metrics():
+    """The process's metrics, exported to CloudWatch every minute and on terminate"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics(get_client('cloudwatch'), dimensions={'Role': 'worker'}).start()
+        return _metrics
+
+def get_status_writer():
+    """The process's buffered status writer, whose client every table call shares"""
+    global _status_writer
+    metrics = get_metrics()
+    with _status_writer_lock:
+        if _status_writer is None:
+            _status_writer = StatusWriter(metrics=metrics).start()
+        return _status_writer
+
+def get_result_sink():
+    """The process's result sink, shared by every browser session"""
+    global _result_sink
+    with _status_writer_lock:
+        if _result_sink is None:
+            worker_id = f"{socket.gethostname()}-{os.getpid()}"
+            _result_sink = ResultSink(backend_from_url(RESULTS_URL), worker_id).start()
+        return _result_sink
+
+def get_checkpoint_store():
+    """The process's location checkpoints, saved through the status writer's client"""
+    global _checkpoint_store
+    dynamodb = get_status_writer().dynamodb
+    result_sink = get_result_sink()
+    with _status_writer_lock:
+        if _checkpoint_store is None:
+            _checkpoint_store = CheckpointStore(dynamodb, result_sink)
+        return _checkpoint_store
+
+def keep_progress(country_code, location_name, checkpoint):
+    """Checkpoint a failed location so its rerun resumes, or drop its unsaved records if that fails"""
     try:
-        # Get credentials from instance metadata
-        session = boto3.Session(region_name='eu-west-2')
-        dynamodb = session.client('dynamodb')
-        
-        update_expr = "SET #status = :status, last_updated = :timestamp"
-        expr_attrs = {
-            ':status': {'S': status},
-            ':timestamp': {'S': datetime.utcnow().isoformat()}
+        if checkpoint is not None and get_checkpoint_store().save(checkpoint):
+            return
+    except Exception as e:
+        logger.error(f"Failed to checkpoint {country_code}:{location_name}: {str(e)}")
+    get_result_sink().abort_location(country_code, location_name)
+
+def get_page_cache():
+    """The process's page cache, or None when caching is off"""
+    global _page_cache
+    with _status_writer_lock:
+        if _page_cache is None and PAGE_CACHE_URL:
+            _page_cache = PageCache(cache_backend_from_url(PAGE_CACHE_URL))
+        return _page_cache
+
+def get_fetcher():
+    """The process's page fetcher, sharing its connection pool and engine choices"""
+    global _fetcher
+    cache = get_page_cache()
+    with _status_writer_lock:
+        if _fetcher is None:
+            # Engine choices are shared between workers through the page cache
+            detector = EngineDetector(cache.backend if cache else None).load()
+            _fetcher = PageFetcher(detector, FETCH_ENGINE)
+        return _fetcher
+
+def update_location_status(country_code, location_name, status, error_message=None, timings=None, owner=None,
+                           clock=time.time):
+    """Queue a location status update; it is written within a second, or on terminate
+
+    timings is the location's span, phase name to seconds. It is written
+    to the row as a timings map and each phase is recorded as a metric.
+    With owner, the update is only written while owner still holds the
+    location's lease.
+    """
+    attributes = {}
+    if status == 'COMPLETE':
+        # With started_at from the claim, gives the controller per-location durations
+        attributes['finished_at'] = int(clock())
+    if timings:
+        metrics = get_metrics()
+        for phase, seconds in timings.items():
+            metrics.observe(phase, seconds)
+        attributes['timings'] = {phase: round(seconds, 3) for phase, seconds in timings.items()}
+    condition = held_by(owner) if owner else None
+    get_status_writer().update(country_code, location_name, status, error_message, condition, **attributes)
+
+def take_instance_timings():
+    """Boot-to-user-data and bootstrap seconds for this instance, for the first span only
+
+    User data exports USER_DATA_STARTED when it starts and
+    BOOTSTRAP_FINISHED just before it runs this script; the boot time
+    comes from /proc/uptime.
+    """
+    global _instance_timings
+    with _metrics_lock:
+        if _instance_timings is not None:
+            return {}
+        _instance_timings = {}
+        try:
+            user_data_started = float(os.environ['USER_DATA_STARTED'])
+            bootstrap_finished = float(os.environ['BOOTSTRAP_FINISHED'])
+            with open('/proc/uptime') as f:
+                booted_at = time.time() - float(f.read().split()[0])
+        except (KeyError, ValueError, OSError):
+            # Not started from user data
+            return {}
+        _instance_timings = {
+            'boot_to_user_data': max(0.0, user_data_started - booted_at),
+            'bootstrap': bootstrap_finished - user_data_started
         }
-        expr_names = {'#status': 'status'}
-        
-        if error_message:
-            update_expr += ", error_message = :error"
-            expr_attrs[':error'] = {'S': error_message}
-        
-        dynamodb.update_item(
-            TableName='dental_location_control',
-            Key={
-                'country_code': {'S': country_code},
-                'location_name': {'S': location_name}
-            },
-            UpdateExpression=update_expr,
-            ExpressionAttributeNames=expr_names,
-            ExpressionAttributeValues=expr_attrs
-        )
-        logger.info(f"Updated location {country_code}:{location_name} status to {status}")
+        return dict(_instance_timings)
+
+def get_assigned_location(country_code, timeout=300, poll_interval=5, previous=None):
+    """Read this instance's location from its Location tag
+
+    Batch launches tag each instance with its location just after
+    RunInstances returns, so keep polling instance metadata until it shows
+    up. A warm worker passes the location it last finished as previous and
+    waits for the controller to retag it.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            response = requests.get(metadata_url('tags/instance/Location'), timeout=2)
+            if response.status_code == 200 and response.text:
+                tag_country, location_name = response.text.split('#', 1)
+                if tag_country != country_code:
+                    raise ValueError(f"Instance is tagged for {tag_country}, expected {country_code}")
+                if location_name != previous:
+                    return location_name
+        except requests.RequestException as e:
+            logger.warning(f"Failed to read Location tag: {str(e)}")
+        time.sleep(poll_interval)
+    raise TimeoutError(f"No Location tag after {timeout} seconds")
+
+def last_location():
+    """The location this instance last finished, if it has been stopped and resumed"""
+    try:
+        with open(LAST_LOCATION_FILE) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def remember_location(location_name):
+    try:
+        with open(LAST_LOCATION_FILE, 'w') as f:
+            f.write(location_name)
+    except OSError as e:
+        logger.warning(f"Failed to record last location: {str(e)}")
+
+def set_worker_state(state):
+    """Tag this instance busy or idle so the controller knows it can take work"""
+    tags = [{'Key': 'WorkerState', 'Value': state}]
+    if state == 'idle':
+        tags.append({'Key': 'IdleSince', 'Value': str(int(time.time()))})
+    try:
+        get_client('ec2').create_tags(Resources=[get_instance_id()], Tags=tags)
     except Exception as e:
-        logger.error(f"Failed to update DynamoDB: {str(e)}", exc_info=True)
+        logger.warning(f"Failed to tag worker {state}: {str(e)}")
 
-def terminate_instance():
-    """Terminate the current instance"""
+def wait_for_pending(country_code, queue_mode, timeout):
+    """Poll the queue for up to timeout seconds; True once an INACTIVE location shows up"""
+    deadline = time.time() + timeout
+    dynamodb = get_status_writer().dynamodb
+    while time.time() < deadline:
+        if find_inactive_locations(dynamodb, country_code, queue_mode, limit=1):
+            return True
+        time.sleep(WARM_POLL_INTERVAL)
+    return False
+
+def terminate_instance(stop=False):
+    """Write any pending results and status updates, then terminate the current instance
+
+    With stop the instance is stopped instead, leaving it in the warm pool
+    for the controller to resume. Local workers only write.
+    """
+    if _page_cache is not None:
+        logger.info(f"Page cache: {_page_cache.stats()}")
+    if _fetcher is not None:
+        logger.info(f"Pages fetched by engine: {_fetcher.stats()}")
+        _fetcher.detector.save()
+    if _result_sink is not None:
+        _result_sink.close()
+    if _status_writer is not None:
+        _status_writer.close()
+    if WORKER_ID:
+        # A local worker has no instance to terminate; the process just exits
+        get_metrics().close()
+        return
     try:
         # Get instance ID from metadata
-        instance_id = requests.get(
-            'http://169.254.169.254/latest/meta-data/instance-id',
-            timeout=2
-        ).text
+        instance_id = get_instance_id()
         
-        # Get credentials from instance metadata
-        session = boto3.Session(region_name='eu-west-2')
-        ec2 = session.client('ec2')
-        
-        ec2.terminate_instances(InstanceIds=[instance_id])
-        logger.info(f"Initiated termination of instance {instance_id}")
+        ec2 = get_client('ec2')
+        if stop:
+            with get_metrics().timer('stop'):
+                ec2.stop_instances(InstanceIds=[instance_id])
+            logger.info(f"Stopping instance {instance_id} for the warm pool")
+        else:
+            with get_metrics().timer('terminate'):
+                ec2.terminate_instances(InstanceIds=[instance_id])
+            logger.info(f"Initiated termination of instance {instance_id}")
     except Exception as e:
         logger.error(f"Failed to terminate instance: {str(e)}", exc_info=True)
+        get_metrics().close()
         sys.exit(1)
+    # Shutdown takes a while yet, long enough to export the last metrics
+    get_metrics().close()
 
-def run_test(country_code, location_name):
-    try:
-        logger.info(f"Starting test for {country_code}:{location_name}")
-        
-        logger.info("Setting up Chrome options...")
-        options = Options()
+def create_driver(session_id=0):
+    """Start a headless Chrome session
+
+    Each session_id gets its own debugging port and profile directory so
+    several sessions can run side by side on one instance.
+    """
+    logger.info(f"Setting up Chrome options ({BROWSER_MODE} mode)...")
+    options = Options()
+    if BROWSER_MODE == 'full':
         options.add_argument('--verbose')
         options.add_argument('--log-level=0')
-        options.add_argument('--headless')
-        options.add_argument('--no-sandbox')
-        options.add_argument('--disable-setuid-sandbox')
-        options.add_argument('--disable-dev-shm-usage')
-        options.add_argument('--disable-blink-features=AutomationControlled')
-        options.add_argument('--window-size=1920,1080')
-        options.add_argument('--remote-debugging-port=9222')
-        options.add_argument('--user-data-dir=/tmp/chrome-data')
+    else:
+        options.add_argument('--log-level=3')
+        # Incognito keeps cookies and cache in memory, and the profile
+        # directory itself sits on tmpfs when there is room
+        options.add_argument('--incognito')
+        options.add_argument('--blink-settings=imagesEnabled=false')
+        options.add_argument('--disable-extensions')
+        options.add_argument('--disable-background-networking')
+        options.add_argument('--disable-default-apps')
+        options.add_argument('--disable-sync')
+        options.add_argument('--disable-gpu')
+        options.add_argument('--mute-audio')
+        options.add_argument('--no-first-run')
+    options.add_argument('--headless')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-setuid-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--disable-blink-features=AutomationControlled')
+    options.add_argument('--window-size=1920,1080')
+    # Local workers share their host with other workers, so Chrome picks a free port
+    options.add_argument(f'--remote-debugging-port={0 if WORKER_ID else 9222 + session_id}')
+    options.add_argument(f'--user-data-dir={profile_dir(session_id)}')
+    # Network events for per-page transfer stats
+    options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+    options.add_experimental_option('perfLoggingPrefs', {'enableNetwork': True, 'enablePage': False})
+    
+    logger.info("Starting Chrome...")
+    driver = webdriver.Chrome(options=options)
+    if BROWSER_MODE != 'full':
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+    return driver
+
+@functools.lru_cache(maxsize=None)
+def profile_root():
+    """tmpfs for lean profiles when it has room (Docker's default /dev/shm is 64 MB), else /tmp"""
+    if BROWSER_MODE != 'full':
+        try:
+            if shutil.disk_usage('/dev/shm').free >= 256 * 1024 * 1024:
+                return '/dev/shm'
+        except OSError:
+            pass
+    return '/tmp'
+
+def profile_dir(session_id):
+    """Chrome profile directory for a session"""
+    name = 'chrome-data' if session_id == 0 else f'chrome-data-{session_id}'
+    if WORKER_ID:
+        name += f'-{WORKER_ID}'
+    return os.path.join(profile_root(), name)
+
+def page_transfer_stats(driver):
+    """Bytes, requests and blocked requests since the last call, from Chrome's network log"""
+    stats = {'transfer_bytes': 0, 'requests': 0, 'blocked_requests': 0}
+    try:
+        entries = driver.get_log('performance')
+    except Exception as e:
+        logger.warning(f"Failed to read Chrome network log: {str(e)}")
+        return stats
+    for entry in entries:
+        message = json.loads(entry['message'])['message']
+        if message['method'] == 'Network.loadingFinished':
+            stats['requests'] += 1
+            stats['transfer_bytes'] += int(message['params'].get('encodedDataLength', 0))
+        elif message['method'] == 'Network.loadingFailed' and message['params'].get('blockedReason'):
+            stats['blocked_requests'] += 1
+    return stats
+
+def default_session_count():
+    """One Chrome session per vCPU, limited by the memory each session mode needs"""
+    sessions = os.cpu_count() or 1
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    available_gb = int(line.split()[1]) / (1024 * 1024)
+                    sessions = min(sessions, int(available_gb / SESSION_MEMORY_GB[BROWSER_MODE]))
+                    break
+    except OSError:
+        pass
+    return max(1, sessions)
+
+class BrowserSession:
+    """One isolated Chrome session that is recycled after a number of pages
+
+    Restarting the browser every recycle_after locations, with a fresh
+    profile directory, bounds the memory a long-lived Chrome accumulates.
+    Time spent starting Chrome is kept for the span of the location that
+    needed it.
+    """
+
+    def __init__(self, session_id, recycle_after=50):
+        self.session_id = session_id
+        self.recycle_after = recycle_after
+        self.driver = None
+        self.pages = 0
+        self.chrome_start = 0.0
+
+    def get_driver(self):
+        if self.driver is None:
+            shutil.rmtree(profile_dir(self.session_id), ignore_errors=True)
+            started = time.time()
+            self.driver = create_driver(self.session_id)
+            self.chrome_start += time.time() - started
+            self.pages = 0
+        return self.driver
+
+    def take_chrome_start(self):
+        """Seconds spent starting Chrome since the last call"""
+        seconds, self.chrome_start = self.chrome_start, 0.0
+        return seconds
+
+    def page_done(self):
+        self.pages += 1
+        if self.recycle_after and self.pages >= self.recycle_after:
+            logger.info(f"Recycling browser session {self.session_id} after {self.pages} locations")
+            self.close()
+
+    def close(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+            self.driver = None
+        shutil.rmtree(profile_dir(self.session_id), ignore_errors=True)
+
+def page_title(html):
+    match = re.search(r'<title[^>]*>(.*?)</title>', html, re.IGNORECASE | re.DOTALL)
+    return match.group(1).strip() if match else ''
+
+def location_pages(country_code, location_name):
+    """A location's page URLs, in a stable order so a checkpoint's page index stays valid"""
+    return ["https://github.com"]
+
+def scrape_location(get_driver, country_code, location_name, checkpoint):
+    """Scrape a location from its checkpoint on, starting Chrome through get_driver only if a page needs it
+
+    Pages before the checkpoint's cursor are skipped, and so are items it
+    has already emitted. Each record carries its item_id, and the
+    checkpoint is saved every CHECKPOINT_INTERVAL seconds. Returns the
+    location's page load seconds for its span.
+    """
+    store = get_checkpoint_store()
+    pages = location_pages(country_code, location_name)
+    page_load = 0.0
+    for index in range(checkpoint.cursor, len(pages)):
+        url = pages[index]
+        logger.info(f"Visiting {url} (page {index + 1} of {len(pages)})...")
+        started = time.time()
+        html, source = load_page(get_driver, url, get_page_cache(), fetcher=get_fetcher())
+        stats = {'fetch_seconds': round(time.time() - started, 3), 'page_bytes': len(html.encode('utf-8'))}
+        page_load += stats['fetch_seconds']
         
-        logger.info("Starting Chrome...")
-        driver = webdriver.Chrome(options=options)
+        title = page_title(html)
+        logger.info(f"Success! Page title: {title} (from {source})")
+        if source == 'browser':
+            stats.update(page_transfer_stats(get_driver()))
+            get_driver().save_screenshot('/tmp/github.png')
+            logger.info("Saved screenshot to /tmp/github.png")
+        logger.info(f"Page stats for {url}: {stats}")
         
-        logger.info("Visiting GitHub...")
-        driver.get("https://github.com")
+        # One item per page for now; its URL identifies it
+        item_id = url
+        if not checkpoint.seen(item_id):
+            get_result_sink().write(country_code, location_name, dict({
+                'country_code': country_code,
+                'location_name': location_name,
+                'item_id': item_id,
+                'url': url,
+                'title': title,
+                'source': source,
+                'scraped_at': datetime.utcnow().isoformat()
+            }, **stats))
+            checkpoint.emit(item_id)
+        checkpoint.advance(index + 1)
+        store.maybe_save(checkpoint)
+    return {'page_load': page_load}
+
+def find_inactive_locations(dynamodb, country_code, queue_mode, limit=10, clock=time.time):
+    """Find up to limit INACTIVE location names that look claimable"""
+    now = int(clock())
+    if queue_mode == 'index':
+        shards = list(range(PENDING_SHARDS))
+        random.shuffle(shards)
+        query_args_list = [{
+            'TableName': 'dental_location_control',
+            'IndexName': PENDING_INDEX_NAME,
+            'KeyConditionExpression': 'pending_shard = :shard',
+            'ExpressionAttributeValues': {':shard': {'S': f"{country_code}#{shard}"}},
+            'Limit': limit
+        } for shard in shards]
+    else:
+        query_args_list = [{
+            'TableName': 'dental_location_control',
+            'KeyConditionExpression': 'country_code = :cc',
+            'FilterExpression': '#status = :status',
+            'ProjectionExpression': 'location_name, retry_after',
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': {
+                ':cc': {'S': country_code},
+                ':status': {'S': 'INACTIVE'}
+            }
+        }]
+
+    names = []
+    for query_args in query_args_list:
+        while len(names) < limit:
+            response = dynamodb.query(**query_args)
+            for item in response.get('Items', []):
+                if int(item.get('retry_after', {}).get('N', '0')) <= now:
+                    names.append(item['location_name']['S'])
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key:
+                break
+            query_args['ExclusiveStartKey'] = last_key
+        if len(names) >= limit:
+            break
+    return names[:limit]
+
+def claim_next_location(dynamodb, country_code, owner, queue_mode='filter', timings=None, clock=time.time):
+    """Claim the next INACTIVE location for this worker, or None when the queue is drained
+
+    Candidates are tried in random order so workers draining the same
+    country rarely race for the same row. A round in which every candidate
+    was claimed first is retried after a jittered backoff, up to
+    CLAIM_ROUNDS rounds. If a timings dict is given, the claimed location's
+    queue_wait is added to it.
+    """
+    for attempt in range(CLAIM_ROUNDS):
+        if attempt:
+            time.sleep(random.uniform(0, CLAIM_BACKOFF * 2 ** (attempt - 1)))
+        candidates = find_inactive_locations(dynamodb, country_code, queue_mode, clock=clock)
+        if not candidates:
+            return None
+        random.shuffle(candidates)
         
-        logger.info(f"Success! Page title: {driver.title}")
-        driver.save_screenshot('/tmp/github.png')
-        logger.info("Saved screenshot to /tmp/github.png")
+        for location_name in candidates:
+            try:
+                response = dynamodb.update_item(
+                    TableName='dental_location_control',
+                    Key={
+                        'country_code': {'S': country_code},
+                        'location_name': {'S': location_name}
+                    },
+                    UpdateExpression="SET #status = :in_progress, last_updated = :timestamp, "
+                                     "#owner = :owner, lease_expires = :expires, started_at = :now "
+                                     "REMOVE pending_shard",
+                    ConditionExpression='#status = :inactive AND '
+                                        '(attribute_not_exists(retry_after) OR retry_after <= :now)',
+                    ExpressionAttributeNames={'#status': 'status', '#owner': 'owner'},
+                    ExpressionAttributeValues={
+                        ':in_progress': {'S': 'IN_PROGRESS'},
+                        ':inactive': {'S': 'INACTIVE'},
+                        ':timestamp': {'S': datetime.utcfromtimestamp(clock()).isoformat()},
+                        ':owner': {'S': owner},
+                        ':now': {'N': str(int(clock()))},
+                        ':expires': {'N': str(int(clock()) + LEASE_SECONDS)}
+                    },
+                    ReturnValues='ALL_OLD'
+                )
+                logger.info(f"Claimed location {country_code}:{location_name}")
+                queued_at = response.get('Attributes', {}).get('queued_at')
+                if timings is not None and queued_at:
+                    timings['queue_wait'] = max(0.0, clock() - float(queued_at['N']))
+                return location_name
+            except dynamodb.exceptions.ConditionalCheckFailedException:
+                continue
+    logger.warning(f"Every {country_code} candidate was claimed first in {CLAIM_ROUNDS} rounds, giving up")
+    return None
+
+def lease_owner(dynamodb, country_code, location_name):
+    """Owner of a location's lease, or None if it is not IN_PROGRESS
+
+    An assigned location is claimed by the controller before this worker
+    starts, so the worker keeps the lease under the controller's owner.
+    """
+    item = dynamodb.get_item(
+        TableName=TABLE_NAME,
+        Key={
+            'country_code': {'S': country_code},
+            'location_name': {'S': location_name}
+        },
+        ProjectionExpression='#status, #owner',
+        ExpressionAttributeNames={'#status': 'status', '#owner': 'owner'},
+        ConsistentRead=True
+    ).get('Item', {})
+    if item.get('status', {}).get('S') != 'IN_PROGRESS':
+        return None
+    return item.get('owner', {}).get('S')
+
+def get_instance_id():
+    """Get this instance's ID from metadata, or the local worker ID outside EC2"""
+    if WORKER_ID:
+        return WORKER_ID
+    return requests.get(metadata_url('instance-id'), timeout=2).text
+
+def run_test(country_code, location_name):
+    """Scrape one assigned location and report it; the caller decides what happens to the instance
+
+    The scrape resumes from the location's checkpoint, and a failure or
+    interruption checkpoints it again so the next attempt carries on.
+    """
+    heartbeat = LeaseHeartbeat()
+    owner = lease_owner(heartbeat.dynamodb, country_code, location_name)
+    if owner is None:
+        logger.warning(f"Location {country_code}:{location_name} is not IN_PROGRESS, its lease is not ours")
+        owner = get_instance_id()
+    heartbeat.add(country_code, location_name, owner)
+    heartbeat.start()
+    watcher = InterruptionWatcher(heartbeat)
+    watcher.on_interruption(get_checkpoint_store().save_all)
+    watcher.start()
+    timings = take_instance_timings()
+    checkpoint = None
+    try:
+        logger.info(f"Starting test for {country_code}:{location_name}")
+        checkpoint = get_checkpoint_store().load(country_code, location_name)
         
-        driver.quit()
+        # Chrome only starts if a page is not cached and needs rendering
+        session = BrowserSession(0, recycle_after=0)
+        started = time.time()
+        try:
+            timings.update(scrape_location(session.get_driver, country_code, location_name, checkpoint))
+        finally:
+            session.close()
+        timings.update(chrome_start=session.take_chrome_start(), scrape=time.time() - started)
         logger.info("Test completed successfully")
         
-        # Update DynamoDB and terminate
-        update_location_status(country_code, location_name, 'COMPLETE')
-        terminate_instance()
+        # Make the results durable, then update DynamoDB
+        get_result_sink().close_location(country_code, location_name)
+        watcher.stop()
+        heartbeat.stop()
+        update_location_status(country_code, location_name, 'COMPLETE', timings=timings, owner=owner)
         
     except Exception as e:
         error_msg = str(e)
         logger.error(f"Test failed: {error_msg}", exc_info=True)
-        update_location_status(country_code, location_name, 'STOPPED', error_msg)
-        terminate_instance()
+        watcher.stop()
+        # A failure during interruption is the shutdown, not the location;
+        # the watcher has already checkpointed it and handed it back
+        if watcher.interrupted.is_set():
+            get_result_sink().abort_location(country_code, location_name)
+        else:
+            keep_progress(country_code, location_name, checkpoint)
+        heartbeat.stop()
+        if not watcher.interrupted.is_set():
+            update_location_status(country_code, location_name, 'STOPPED', error_msg, timings=timings,
+                                   owner=owner)
+    finally:
+        if checkpoint is not None:
+            get_checkpoint_store().forget(checkpoint)
+        remember_location(location_name)
+
+class LocationQueue:
+    """Work queue shared by the browser sessions on one worker
+
+    Claims go through a lock so sessions on the same instance never race
+    each other for a row, and once the country is drained every session
+    sees it.
+    """
+
+    def __init__(self, country_code, owner, queue_mode='filter'):
+        self.country_code = country_code
+        self.owner = owner
+        self.queue_mode = queue_mode
+        self.dynamodb = get_status_writer().dynamodb
+        self.lock = threading.Lock()
+        self.drained = False
+
+    def stop(self):
+        """Stop handing out locations, e.g. when the instance is being interrupted"""
+        with self.lock:
+            self.drained = True
+
+    def next(self, timings=None):
+        """Claim the next location, or None once the queue is drained"""
+        with self.lock:
+            if self.drained:
+                return None
+            location_name = claim_next_location(
+                self.dynamodb, self.country_code, self.owner, self.queue_mode, timings)
+            if location_name is None:
+                logger.info(f"No INACTIVE locations left in {self.country_code}")
+                self.drained = True
+            return location_name
+
+def run_session(session, queue, heartbeat, watcher):
+    """Scrape locations from the queue with one browser session until it is drained"""
+    processed = 0
+    country_code = queue.country_code
+    try:
+        while True:
+            timings = {}
+            location_name = queue.next(timings)
+            if location_name is None:
+                break
+            
+            heartbeat.add(country_code, location_name, queue.owner)
+            checkpoint = None
+            try:
+                logger.info(f"[session {session.session_id}] Starting test for {country_code}:{location_name}")
+                timings.update(take_instance_timings())
+                checkpoint = get_checkpoint_store().load(country_code, location_name)
+                started = time.time()
+                timings.update(scrape_location(session.get_driver, country_code, location_name, checkpoint))
+                timings.update(chrome_start=session.take_chrome_start(), scrape=time.time() - started)
+                get_result_sink().close_location(country_code, location_name)
+                heartbeat.remove(country_code, location_name)
+                update_location_status(country_code, location_name, 'COMPLETE', timings=timings,
+                                       owner=queue.owner)
+                session.page_done()
+            except Exception as e:
+                error_msg = str(e)
+                logger.error(f"Test failed: {error_msg}", exc_info=True)
+                if watcher.interrupted.is_set():
+                    get_result_sink().abort_location(country_code, location_name)
+                else:
+                    keep_progress(country_code, location_name, checkpoint)
+                heartbeat.remove(country_code, location_name)
+                if not watcher.interrupted.is_set():
+                    update_location_status(country_code, location_name, 'STOPPED', error_msg,
+                                           timings=dict(timings, chrome_start=session.take_chrome_start()),
+                                           owner=queue.owner)
+                # The session may be wedged, start a fresh one for the next location
+                session.close()
+            finally:
+                if checkpoint is not None:
+                    get_checkpoint_store().forget(checkpoint)
+            processed += 1
+    except Exception as e:
+        logger.error(f"Browser session {session.session_id} failed: {str(e)}", exc_info=True)
+    finally:
+        session.close()
+    return processed
+
+def run_worker(country_code, queue_mode='filter', sessions=1, recycle_after=50, warm_idle=0):
+    """Drain a country's queue with a pool of long-lived Chrome sessions
+
+    Claims location after location from the control table until none are
+    left, then terminates the instance. Boot and browser start-up are paid
+    once per instance rather than once per location, and the sessions
+    share the instance's CPU and memory. With warm_idle the worker keeps
+    polling the queue that long once it is drained, and then stops rather
+    than terminates so the controller can resume it later.
+    """
+    heartbeat = LeaseHeartbeat()
+    heartbeat.start()
+    watcher = InterruptionWatcher(heartbeat)
+    watcher.on_interruption(get_checkpoint_store().save_all)
+    watcher.start()
+    processed = []
+    try:
+        while True:
+            queue = LocationQueue(country_code, get_instance_id(), queue_mode)
+            watcher.on_interruption(queue.stop)
+            logger.info(f"Starting {sessions} browser session(s), recycling every {recycle_after} locations")
+            
+            threads = []
+            for session_id in range(sessions):
+                session = BrowserSession(session_id, recycle_after)
+                thread = threading.Thread(
+                    target=lambda session=session, queue=queue: processed.append(
+                        run_session(session, queue, heartbeat, watcher)),
+                    name=f'browser-session-{session_id}'
+                )
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+            
+            if not warm_idle or watcher.interrupted.is_set():
+                break
+            set_worker_state('idle')
+            if not wait_for_pending(country_code, queue_mode, warm_idle):
+                break
+            set_worker_state('busy')
+    except Exception as e:
+        logger.error(f"Worker failed: {str(e)}", exc_info=True)
+    finally:
+        watcher.stop()
+        heartbeat.stop()
+        logger.info(f"Worker processed {sum(processed)} locations")
+        # A warm pool worker is a persistent spot instance, which would
+        # only be replaced if it terminated itself
+        terminate_instance(stop=bool(warm_idle))
 
 if __name__ == "__main__":
-    # Get location from command line args
-    if len(sys.argv) != 3:
-        logger.error("Usage: python simple_test.py <country_code> <location_name>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Scrape dental practice locations")
+    parser.add_argument('country_code')
+    parser.add_argument('location_name', nargs='?',
+                        help="Location to scrape (default: read the Location tag)")
+    parser.add_argument('--drain', action='store_true',
+                        help="Keep claiming locations until the country's queue is empty")
+    parser.add_argument('--queue-mode', choices=['filter', 'index'], default='filter',
+                        help="How --drain finds INACTIVE locations")
+    parser.add_argument('--sessions', type=int, default=None,
+                        help="Parallel browser sessions for --drain (default: based on CPU and memory)")
+    parser.add_argument('--warm-idle', type=int, default=0,
+                        help="Wait this many seconds for more work when done, then stop the instance "
+                             "for the warm pool instead of terminating it (default 0: terminate)")
+    parser.add_argument('--recycle-after', type=int, default=50,
+                        help="Restart each browser session after this many locations (0 to never)")
+    parser.add_argument('--results', default=DEFAULT_RESULTS_URL,
+                        help="Where to write scraped records: s3://bucket/prefix or a local directory")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_URL,
+                        help="Page cache: s3://bucket/prefix, a local directory, or 'none'")
+    parser.add_argument('--engine', choices=['auto', 'http', 'browser'], default='auto',
+                        help="Fetch pages over plain HTTP with a Chrome fallback, or force one engine")
+    parser.add_argument('--browser-mode', choices=['lean', 'full'], default='lean',
+                        help="Block images, fonts, media and trackers (lean), or load everything "
+                             "with verbose Chrome logging (full)")
+    parser.add_argument('--worker-id', default=None,
+                        help="Run outside EC2 under this ID, as the local executor does; "
+                             "no instance metadata is read and nothing is terminated")
+    args = parser.parse_args()
+    RESULTS_URL = args.results
+    PAGE_CACHE_URL = None if args.cache == 'none' else args.cache
+    FETCH_ENGINE = args.engine
+    BROWSER_MODE = args.browser_mode
+    WORKER_ID = args.worker_id
+    
+    country_code = args.country_code
+    if args.drain:
+        run_worker(country_code, args.queue_mode,
+                   sessions=args.sessions or default_session_count(),
+                   recycle_after=args.recycle_after, warm_idle=args.warm_idle)
+        sys.exit(0)
     
-    country_code = sys.argv[1]
-    location_name = sys.argv[2]
-    run_test(country_code, location_name)
+    # Get location from command line args, or from the Location tag
+    location_name = args.location_name
+    if location_name is None:
+        try:
+            location_name = get_assigned_location(country_code, previous=last_location())
+        except Exception as e:
+            # Nothing to report against; the controller's lease on the
+            # claimed location will expire and requeue it
+            logger.error(f"Failed to get assigned location: {str(e)}", exc_info=True)
+            terminate_instance(stop=bool(args.warm_idle))
+            sys.exit(1)
+    while True:
+        run_test(country_code, location_name)
+        if not args.warm_idle or args.location_name:
+            break
+        # Stay warm for a while in case the controller retags us with more work
+        set_worker_state('idle')
+        try:
+            location_name = get_assigned_location(country_code, timeout=args.warm_idle,
+                                                  previous=location_name)
+        except Exception as e:
+            logger.info(f"No new assignment, stopping: {str(e)}")
+            break
+    terminate_instance(stop=bool(args.warm_idle))
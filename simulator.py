@@ -0,0 +1,1371 @@
+import io
+import re
+import copy
+import json
+import math
+import time
+import heapq
+import shlex
+import bisect
+import random
+import logging
+import argparse
+import operator
+import functools
+import itertools
+import threading
+from types import SimpleNamespace
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from botocore.exceptions import ClientError
+
+import aws_backend
+from task_runner_ec2 import TaskRunner
+from image_builder import BASE_IMAGE_ID
+from placement import PlacementEngine
+from autoscaler import INSTANCE_VCPUS
+from status_writer import StatusWriter, TABLE_NAME, PENDING_INDEX_NAME, pending_shard_key, held_by
+from metrics import summarize
+from checkpoint import CheckpointStore
+from simple_test import (claim_next_location, find_inactive_locations, lease_owner, LeaseHeartbeat,
+                         InterruptionWatcher, HEARTBEAT_INTERVAL, INTERRUPTION_CHECK_INTERVAL, WARM_POLL_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
+# DynamoDB stops a query page after this much item data has been read
+PAGE_LIMIT_BYTES = 1024 * 1024
+# Attributes projected into the pending index, see migrate_pending_index.py
+PENDING_INDEX_ATTRIBUTES = ('country_code', 'location_name', 'pending_shard', 'retry_after')
+DESCRIBE_PAGE_SIZE = 1000
+USER_DATA_LIMIT = 16384
+# EC2 gives spot instances two minutes' notice
+INTERRUPTION_NOTICE_SECONDS = 120
+# get_assigned_location gives up on the Location tag after this long
+ASSIGNMENT_TIMEOUT = 300
+
+class ConditionalCheckFailedException(ClientError):
+    pass
+
+class ResourceAlreadyExistsException(ClientError):
+    pass
+
+class NoSuchKey(ClientError):
+    pass
+
+def client_error(code, operation, message='', error_class=ClientError):
+    """A botocore ClientError as the real client would raise it"""
+    return error_class({'Error': {'Code': code, 'Message': message}}, operation)
+
+_TOKEN = re.compile(r'\s*(<=|>=|<>|[=<>(),]|[#:]?[A-Za-z_][A-Za-z0-9_]*)')
+_COMPARISONS = {'=': operator.eq, '<>': operator.ne, '<': operator.lt, '<=': operator.le,
+                '>': operator.gt, '>=': operator.ge}
+
+class ConditionParser:
+    """Parse the subset of DynamoDB condition syntax the scraper uses
+
+    Comparisons between attributes and placeholders, attribute_exists,
+    attribute_not_exists, AND, OR, NOT and parentheses. The result is a
+    tree of tuples for evaluate_condition.
+    """
+
+    def __init__(self, expression):
+        self.tokens = []
+        expression = expression.strip()
+        pos = 0
+        while pos < len(expression):
+            match = _TOKEN.match(expression, pos)
+            if not match:
+                raise ValueError(f"Cannot parse condition at {expression[pos:]!r}")
+            self.tokens.append(match.group(1))
+            pos = match.end()
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos].upper() if self.pos < len(self.tokens) else None
+
+    def take(self, expected=None):
+        if self.pos >= len(self.tokens) or (expected and self.peek() != expected):
+            raise ValueError(f"Expected {expected or 'a token'} in condition {' '.join(self.tokens)!r}")
+        self.pos += 1
+        return self.tokens[self.pos - 1]
+
+    def parse(self):
+        node = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"Unexpected {self.tokens[self.pos]!r} in condition")
+        return node
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.peek() == 'OR':
+            self.take()
+            node = ('or', node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_not()
+        while self.peek() == 'AND':
+            self.take()
+            node = ('and', node, self.parse_not())
+        return node
+
+    def parse_not(self):
+        if self.peek() == 'NOT':
+            self.take()
+            return ('not', self.parse_not())
+        return self.parse_primary()
+
+    def parse_primary(self):
+        token = self.take()
+        if token == '(':
+            node = self.parse_or()
+            self.take(')')
+            return node
+        if token in ('attribute_exists', 'attribute_not_exists'):
+            self.take('(')
+            path = self.take()
+            self.take(')')
+            return (token, path)
+        comparison = self.take()
+        if comparison not in _COMPARISONS:
+            raise ValueError(f"Unsupported comparison {comparison!r} in condition")
+        return ('compare', comparison, token, self.take())
+
+@functools.lru_cache(maxsize=None)
+def parse_condition(expression):
+    return ConditionParser(expression).parse()
+
+def attribute_value(value):
+    """Python value of a DynamoDB attribute value, numbers as floats"""
+    if value is None:
+        return None
+    if 'N' in value:
+        return float(value['N'])
+    return next(iter(value.values()))
+
+def evaluate_condition(node, item, names, values):
+    """Evaluate a parsed condition against an item"""
+    kind = node[0]
+    if kind == 'or':
+        return evaluate_condition(node[1], item, names, values) or evaluate_condition(node[2], item, names, values)
+    if kind == 'and':
+        return evaluate_condition(node[1], item, names, values) and evaluate_condition(node[2], item, names, values)
+    if kind == 'not':
+        return not evaluate_condition(node[1], item, names, values)
+    if kind == 'attribute_exists':
+        return names.get(node[1], node[1]) in item
+    if kind == 'attribute_not_exists':
+        return names.get(node[1], node[1]) not in item
+
+    def operand(token):
+        if token.startswith(':'):
+            return attribute_value(values[token])
+        return attribute_value(item.get(names.get(token, token)))
+
+    left, right = operand(node[2]), operand(node[3])
+    if left is None or right is None or type(left) is not type(right):
+        # Comparisons with a missing attribute or across types are false
+        return node[1] == '<>'
+    return _COMPARISONS[node[1]](left, right)
+
+@functools.lru_cache(maxsize=None)
+def parse_update(expression):
+    """(action, path, placeholder) triples for a SET/REMOVE/ADD update expression"""
+    parts = re.split(r'\b(SET|REMOVE|ADD)\b', expression)
+    if parts[0].strip():
+        raise ValueError(f"Unsupported update expression {expression!r}")
+    actions = []
+    for keyword, body in zip(parts[1::2], parts[2::2]):
+        for clause in body.split(','):
+            if keyword == 'SET':
+                path, placeholder = (part.strip() for part in clause.split('='))
+                actions.append(('SET', path, placeholder))
+            elif keyword == 'ADD':
+                path, placeholder = clause.split()
+                actions.append(('ADD', path, placeholder))
+            else:
+                actions.append(('REMOVE', clause.strip(), None))
+    return tuple(actions)
+
+def item_size(item):
+    """Approximate DynamoDB item size: attribute names plus values"""
+    return sum(len(name) + len(str(attribute_value(value))) for name, value in item.items())
+
+class FakePaginator:
+    """Follow NextToken through a fake list operation"""
+
+    def __init__(self, operation):
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        while True:
+            page = self.operation(**kwargs)
+            yield page
+            if not page.get('NextToken'):
+                return
+            kwargs['NextToken'] = page['NextToken']
+
+class FakeClient:
+    """What the scraper touches on a boto3 client besides its operations
+
+    Every operation counts as one API call. throttle_client registers a
+    before-call hook on meta.events; the fakes accept it but never pace
+    calls, since simulated time does not pass during a call.
+    """
+
+    service = None
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.exceptions = SimpleNamespace(ClientError=ClientError)
+        self.meta = SimpleNamespace(events=SimpleNamespace(register=lambda event_name, handler: None))
+
+    def record(self, operation):
+        self.sim.api_calls[f"{self.service}.{operation}"] += 1
+
+class FakeDynamoDB(FakeClient):
+    """The control table and its sparse pending index
+
+    Queries page at 1 MB of item data read and Limit counts items read,
+    both before filters and projections, as in DynamoDB. Writes support
+    the SET/REMOVE/ADD updates and conditions the controller and workers
+    use; ADD covers numbers and string sets.
+    """
+
+    service = 'dynamodb'
+
+    def __init__(self, sim):
+        super().__init__(sim)
+        self.exceptions.ConditionalCheckFailedException = ConditionalCheckFailedException
+        self.items = {}  # (country_code, location_name) -> item
+        self.partitions = {}  # country_code -> sorted location names
+        self.pending = {}  # pending_shard -> sorted location names
+        self.sizes = {}  # (country_code, location_name) -> item_size of the stored item
+        self.read_units = 0.0
+        self.write_units = 0
+
+    def store(self, item):
+        """Write an item without counting a call, keeping the partitions and index in order"""
+        key = (item['country_code']['S'], item['location_name']['S'])
+        old = self.items.get(key)
+        self.items[key] = item
+        self.sizes[key] = item_size(item)
+        if old is None:
+            bisect.insort(self.partitions.setdefault(key[0], []), key[1])
+        old_shard = (old or {}).get('pending_shard', {}).get('S')
+        new_shard = item.get('pending_shard', {}).get('S')
+        if old_shard != new_shard:
+            if old_shard is not None:
+                names = self.pending[old_shard]
+                del names[bisect.bisect_left(names, key[1])]
+            if new_shard is not None:
+                bisect.insort(self.pending.setdefault(new_shard, []), key[1])
+        return old
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, IndexName=None,
+              ExpressionAttributeNames=None, FilterExpression=None, ProjectionExpression=None,
+              ExclusiveStartKey=None, Limit=None, ConsistentRead=False):
+        with self.sim.lock:
+            self.record('Query')
+            names = ExpressionAttributeNames or {}
+            match = re.fullmatch(r'\s*([#\w]+)\s*=\s*(:\w+)\s*', KeyConditionExpression)
+            if not match:
+                raise client_error('ValidationException', 'Query', 'Only key equality is simulated')
+            key_name = names.get(match.group(1), match.group(1))
+            key_value = ExpressionAttributeValues[match.group(2)]['S']
+            if IndexName is None and key_name == 'country_code':
+                country_code, candidates = key_value, self.partitions.get(key_value, [])
+            elif IndexName == PENDING_INDEX_NAME and key_name == 'pending_shard':
+                country_code, candidates = key_value.partition('#')[0], self.pending.get(key_value, [])
+            else:
+                raise client_error('ValidationException', 'Query',
+                                   f"No key {key_name} on {IndexName or TableName}")
+
+            start = 0
+            if ExclusiveStartKey:
+                start = bisect.bisect_right(candidates, ExclusiveStartKey['location_name']['S'])
+            page, read_bytes, index = [], 0, start
+            while index < len(candidates) and read_bytes < PAGE_LIMIT_BYTES and (not Limit or len(page) < Limit):
+                key = (country_code, candidates[index])
+                item = self.items[key]
+                if IndexName:
+                    item = {name: item[name] for name in PENDING_INDEX_ATTRIBUTES if name in item}
+                    read_bytes += item_size(item)
+                else:
+                    read_bytes += self.sizes[key]
+                page.append(item)
+                index += 1
+            # Eventually consistent reads cost half a unit per 4 KB
+            self.read_units += math.ceil(read_bytes / 4096) * (1 if ConsistentRead else 0.5)
+
+            response = {'ScannedCount': len(page)}
+            if index < len(candidates):
+                last = page[-1]
+                response['LastEvaluatedKey'] = {name: last[name] for name in
+                                                ('country_code', 'location_name', 'pending_shard')
+                                                if IndexName or name != 'pending_shard'}
+            if FilterExpression:
+                condition = parse_condition(FilterExpression)
+                page = [item for item in page
+                        if evaluate_condition(condition, item, names, ExpressionAttributeValues)]
+            if ProjectionExpression:
+                fields = [names.get(field.strip(), field.strip()) for field in ProjectionExpression.split(',')]
+                page = [{field: item[field] for field in fields if field in item} for item in page]
+            else:
+                page = [dict(item) for item in page]
+            response.update({'Items': page, 'Count': len(page)})
+            return response
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeValues=None,
+                    ExpressionAttributeNames=None, ConditionExpression=None, ReturnValues='NONE'):
+        with self.sim.lock:
+            self.record('UpdateItem')
+            names = ExpressionAttributeNames or {}
+            values = ExpressionAttributeValues or {}
+            key = (Key['country_code']['S'], Key['location_name']['S'])
+            current = self.items.get(key, {})
+            if ConditionExpression and not evaluate_condition(
+                    parse_condition(ConditionExpression), current, names, values):
+                raise client_error('ConditionalCheckFailedException', 'UpdateItem',
+                                   'The conditional request failed', ConditionalCheckFailedException)
+
+            item = dict(current or Key)
+            for action, path, placeholder in parse_update(UpdateExpression):
+                name = names.get(path, path)
+                if action == 'SET':
+                    item[name] = values[placeholder]
+                elif action == 'ADD' and 'SS' in values[placeholder]:
+                    members = set(item.get(name, {}).get('SS', [])) | set(values[placeholder]['SS'])
+                    item[name] = {'SS': sorted(members)}
+                elif action == 'ADD':
+                    total = float(item.get(name, {}).get('N', '0')) + float(values[placeholder]['N'])
+                    item[name] = {'N': str(total)}
+                else:
+                    item.pop(name, None)
+            self.write_units += 1
+            old = self.store(item)
+            self.sim.table_changed(key, old, item)
+            if ReturnValues == 'ALL_NEW':
+                return {'Attributes': dict(item)}
+            if ReturnValues == 'ALL_OLD' and current:
+                return {'Attributes': dict(current)}
+            return {}
+
+    def put_item(self, TableName, Item):
+        with self.sim.lock:
+            self.record('PutItem')
+            self.write_units += 1
+            key = (Item['country_code']['S'], Item['location_name']['S'])
+            self.sim.table_changed(key, self.store(dict(Item)), Item)
+            return {}
+
+    def get_item(self, TableName, Key, ProjectionExpression=None, ExpressionAttributeNames=None,
+                 ConsistentRead=False):
+        with self.sim.lock:
+            self.record('GetItem')
+            self.read_units += 1 if ConsistentRead else 0.5
+            item = self.items.get((Key['country_code']['S'], Key['location_name']['S']))
+            return {'Item': dict(item)} if item else {}
+
+class FakeEC2(FakeClient):
+    """Instances with launch, tag, describe and terminate
+
+    Capacity, quota and interruptions are decided by the simulation;
+    instances pass through pending, running, shutting-down and terminated
+    on its clock.
+    """
+
+    service = 'ec2'
+
+    def __init__(self, sim):
+        super().__init__(sim)
+        self.instances = {}  # instance id -> instance, until terminated
+        self.terminated = {}
+        self.metadata_tags = set()  # instances launched with InstanceMetadataTags enabled
+        self.interruptions = {}  # instance id -> scheduled termination time
+        self.stop_on_interruption = set()  # persistent spot instances, stopped rather than terminated
+        self.ids = itertools.count(1)
+
+    def find(self, instance_id):
+        return self.instances.get(instance_id) or self.terminated.get(instance_id)
+
+    def create_instance(self, image_id, instance_type, subnet_id, tags, metadata_tags=False, spot=False):
+        instance_id = f"i-{next(self.ids):017x}"
+        instance = {
+            'InstanceId': instance_id,
+            'ImageId': image_id,
+            'InstanceType': instance_type,
+            'SubnetId': subnet_id,
+            'InstanceLifecycle': 'spot' if spot else 'normal',
+            'LaunchTime': datetime.utcfromtimestamp(self.sim.now),
+            'State': {'Code': 0, 'Name': 'pending'},
+            'Tags': list(tags)
+        }
+        if spot:
+            instance['SpotInstanceRequestId'] = f"sir-{instance_id[2:]}"
+        self.instances[instance_id] = instance
+        if metadata_tags:
+            self.metadata_tags.add(instance_id)
+        return instance
+
+    def set_state(self, instance_id, state):
+        instance = self.find(instance_id)
+        codes = {'pending': 0, 'running': 16, 'shutting-down': 32, 'terminated': 48, 'stopping': 64, 'stopped': 80}
+        instance['State'] = {'Code': codes[state], 'Name': state}
+        if state == 'terminated':
+            self.terminated[instance_id] = self.instances.pop(instance_id)
+        self.sim.publish({'source': 'ec2', 'type': 'EC2 Instance State-change Notification',
+                          'instance_id': instance_id, 'state': state})
+
+    def shut_down(self, instance_id):
+        """Start terminating an instance, whoever asked"""
+        instance = self.instances.get(instance_id)
+        if instance is None or instance['State']['Name'] == 'shutting-down':
+            return
+        self.set_state(instance_id, 'shutting-down')
+        self.sim.instance_stopping(instance)
+        self.sim.schedule(self.sim.shutdown_seconds, lambda: self.finish_termination(instance_id))
+
+    def finish_termination(self, instance_id):
+        instance = self.instances[instance_id]
+        self.set_state(instance_id, 'terminated')
+        self.sim.instance_terminated(instance)
+
+    def stop(self, instance_id):
+        """Start stopping an instance, whoever asked"""
+        instance = self.instances.get(instance_id)
+        if instance is None or instance['State']['Name'] not in ('pending', 'running'):
+            return
+        self.set_state(instance_id, 'stopping')
+        self.sim.instance_parked(instance)
+        self.sim.schedule(self.sim.shutdown_seconds, lambda: self.finish_stop(instance_id))
+
+    def finish_stop(self, instance_id):
+        instance = self.instances.get(instance_id)
+        if instance is not None and instance['State']['Name'] == 'stopping':
+            self.set_state(instance_id, 'stopped')
+
+    def run_instances(self, ImageId, InstanceType, MinCount, MaxCount, SubnetId=None, UserData='',
+                      TagSpecifications=(), InstanceMarketOptions=None, MetadataOptions=None, **launch_spec):
+        with self.sim.lock:
+            self.record('RunInstances')
+            if len(UserData.encode('utf-8')) > USER_DATA_LIMIT:
+                raise client_error('InvalidParameterValue', 'RunInstances',
+                                   f"User data is limited to {USER_DATA_LIMIT} bytes")
+            spot = (InstanceMarketOptions or {}).get('MarketType') == 'spot'
+            spot_options = (InstanceMarketOptions or {}).get('SpotOptions', {})
+            count = self.sim.launch_capacity(InstanceType, SubnetId, MinCount, MaxCount, spot)
+            tags = [tag for spec in TagSpecifications if spec['ResourceType'] == 'instance'
+                    for tag in spec['Tags']]
+            metadata_tags = (MetadataOptions or {}).get('InstanceMetadataTags') == 'enabled'
+            launched = [self.create_instance(ImageId, InstanceType, SubnetId, tags, metadata_tags, spot)
+                        for _ in range(count)]
+            for instance in launched:
+                if spot_options.get('InstanceInterruptionBehavior') == 'stop':
+                    self.stop_on_interruption.add(instance['InstanceId'])
+                self.sim.instance_launched(instance, UserData)
+            return {'ReservationId': f"r-{launched[0]['InstanceId'][2:]}",
+                    'Instances': copy.deepcopy(launched)}
+
+    def describe_instances(self, Filters=(), InstanceIds=None, MaxResults=None, NextToken=None):
+        with self.sim.lock:
+            self.record('DescribeInstances')
+            states = next((f['Values'] for f in Filters if f['Name'] == 'instance-state-name'), None)
+            candidates = list(self.instances.values())
+            if InstanceIds is not None or states is None or 'terminated' in states:
+                candidates += list(self.terminated.values())
+            if InstanceIds is not None:
+                candidates = [instance for instance in candidates if instance['InstanceId'] in InstanceIds]
+
+            def matches(instance, f):
+                if f['Name'] == 'instance-state-name':
+                    return instance['State']['Name'] in f['Values']
+                if f['Name'] == 'instance-id':
+                    return instance['InstanceId'] in f['Values']
+                if f['Name'].startswith('tag:'):
+                    tags = {tag['Key']: tag['Value'] for tag in instance['Tags']}
+                    return tags.get(f['Name'][4:]) in f['Values']
+                raise client_error('InvalidParameterValue', 'DescribeInstances',
+                                   f"Filter {f['Name']} is not simulated")
+
+            candidates = [instance for instance in candidates if all(matches(instance, f) for f in Filters)]
+            start = int(NextToken or 0)
+            end = start + (MaxResults or DESCRIBE_PAGE_SIZE)
+            page = candidates[start:end]
+            response = {'Reservations': [{'Instances': copy.deepcopy(page)}] if page else []}
+            if end < len(candidates):
+                response['NextToken'] = str(end)
+            return response
+
+    def get_paginator(self, operation_name):
+        if operation_name != 'describe_instances':
+            raise NotImplementedError(f"No simulated paginator for {operation_name}")
+        return FakePaginator(self.describe_instances)
+
+    def create_tags(self, Resources, Tags):
+        with self.sim.lock:
+            self.record('CreateTags')
+            for instance_id in Resources:
+                instance = self.find(instance_id)
+                if instance is None:
+                    raise client_error('InvalidInstanceID.NotFound', 'CreateTags',
+                                       f"The instance ID '{instance_id}' does not exist")
+                keys = {tag['Key'] for tag in Tags}
+                instance['Tags'] = [tag for tag in instance['Tags'] if tag['Key'] not in keys] + list(Tags)
+            return {}
+
+    def stop_instances(self, InstanceIds):
+        with self.sim.lock:
+            self.record('StopInstances')
+            changes = []
+            for instance_id in InstanceIds:
+                instance = self.instances.get(instance_id)
+                if instance is None:
+                    raise client_error('InvalidInstanceID.NotFound', 'StopInstances',
+                                       f"The instance ID '{instance_id}' does not exist")
+                previous = instance['State']['Name']
+                self.stop(instance_id)
+                changes.append({'InstanceId': instance_id, 'PreviousState': {'Name': previous},
+                                'CurrentState': dict(instance['State'])})
+            return {'StoppingInstances': changes}
+
+    def start_instances(self, InstanceIds):
+        with self.sim.lock:
+            self.record('StartInstances')
+            for instance_id in InstanceIds:
+                instance = self.instances.get(instance_id)
+                if instance is None or instance['State']['Name'] != 'stopped':
+                    raise client_error('IncorrectInstanceState', 'StartInstances',
+                                       f"The instance '{instance_id}' is not in a state from which it can be started")
+            changes = []
+            for instance_id in InstanceIds:
+                # EC2 moves LaunchTime to the latest start
+                self.instances[instance_id]['LaunchTime'] = datetime.utcfromtimestamp(self.sim.now)
+                self.set_state(instance_id, 'pending')
+                self.sim.instance_resumed(self.instances[instance_id])
+                changes.append({'InstanceId': instance_id, 'PreviousState': {'Name': 'stopped'},
+                                'CurrentState': {'Code': 0, 'Name': 'pending'}})
+            return {'StartingInstances': changes}
+
+    def cancel_spot_instance_requests(self, SpotInstanceRequestIds):
+        with self.sim.lock:
+            self.record('CancelSpotInstanceRequests')
+            return {'CancelledSpotInstanceRequests': [
+                {'SpotInstanceRequestId': request_id, 'State': 'cancelled'} for request_id in SpotInstanceRequestIds]}
+
+    def terminate_instances(self, InstanceIds):
+        with self.sim.lock:
+            self.record('TerminateInstances')
+            changes = []
+            for instance_id in InstanceIds:
+                instance = self.find(instance_id)
+                if instance is None:
+                    raise client_error('InvalidInstanceID.NotFound', 'TerminateInstances',
+                                       f"The instance ID '{instance_id}' does not exist")
+                previous = instance['State']['Name']
+                self.shut_down(instance_id)
+                changes.append({'InstanceId': instance_id, 'PreviousState': {'Name': previous},
+                                'CurrentState': dict(instance['State'])})
+            return {'TerminatingInstances': changes}
+
+class FakeS3(FakeClient):
+    """An in-memory object store, enough for code bundles, results and the page cache"""
+
+    service = 's3'
+
+    def __init__(self, sim):
+        super().__init__(sim)
+        self.exceptions.NoSuchKey = NoSuchKey
+        self.objects = {}  # (bucket, key) -> bytes
+
+    def head_object(self, Bucket, Key):
+        with self.sim.lock:
+            self.record('HeadObject')
+            if (Bucket, Key) not in self.objects:
+                raise client_error('404', 'HeadObject', 'Not Found')
+            return {'ContentLength': len(self.objects[(Bucket, Key)])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        with self.sim.lock:
+            self.record('PutObject')
+            self.objects[(Bucket, Key)] = Body if isinstance(Body, bytes) else Body.read()
+            return {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        with self.sim.lock:
+            self.record('GetObject')
+            if (Bucket, Key) not in self.objects:
+                raise client_error('NoSuchKey', 'GetObject', 'The specified key does not exist.', NoSuchKey)
+            return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket, Key):
+        with self.sim.lock:
+            self.record('DeleteObject')
+            self.objects.pop((Bucket, Key), None)
+            return {}
+
+class FakeLogs(FakeClient):
+    service = 'logs'
+
+    def __init__(self, sim):
+        super().__init__(sim)
+        self.exceptions.ResourceAlreadyExistsException = ResourceAlreadyExistsException
+        self.log_groups = set()
+
+    def create_log_group(self, logGroupName, **kwargs):
+        with self.sim.lock:
+            self.record('CreateLogGroup')
+            if logGroupName in self.log_groups:
+                raise client_error('ResourceAlreadyExistsException', 'CreateLogGroup',
+                                   'The specified log group already exists', ResourceAlreadyExistsException)
+            self.log_groups.add(logGroupName)
+            return {}
+
+class FakeCloudWatch(FakeClient):
+    service = 'cloudwatch'
+
+    def __init__(self, sim):
+        super().__init__(sim)
+        self.metric_data = []
+
+    def put_metric_data(self, Namespace, MetricData):
+        with self.sim.lock:
+            self.record('PutMetricData')
+            self.metric_data.extend(MetricData)
+            return {}
+
+class FakeServiceQuotas(FakeClient):
+    service = 'service-quotas'
+
+    def get_service_quota(self, ServiceCode, QuotaCode):
+        with self.sim.lock:
+            self.record('GetServiceQuota')
+            if self.sim.vcpu_quota is None:
+                raise client_error('NoSuchResourceException', 'GetServiceQuota', 'Quota not simulated')
+            return {'Quota': {'ServiceCode': ServiceCode, 'QuotaCode': QuotaCode,
+                              'Value': float(self.sim.vcpu_quota)}}
+
+class FakeMetadataService:
+    """Instance metadata for the fake instances, over HTTP on localhost
+
+    Every instance has its own path prefix, so a process started with
+    EC2_METADATA_URL=http://127.0.0.1:<port>/<instance-id> sees that
+    instance's id, type, tags and spot interruption notice. Requests
+    without a prefix are answered for default_instance_id.
+    """
+
+    def __init__(self, ec2, default_instance_id=None):
+        self.ec2 = ec2
+        self.default_instance_id = default_instance_id
+        self.server = None
+
+    def lookup(self, instance_id, path):
+        """Metadata value for an instance, or None where IMDS answers 404"""
+        with self.ec2.sim.lock:
+            instance = self.ec2.find(instance_id)
+            if instance is None:
+                return None
+            if path == 'instance-id':
+                return instance_id
+            if path == 'instance-type':
+                return instance['InstanceType']
+            if path.startswith('tags/instance/'):
+                if instance_id not in self.ec2.metadata_tags:
+                    return None
+                tags = {tag['Key']: tag['Value'] for tag in instance['Tags']}
+                return tags.get(path[len('tags/instance/'):])
+            if path == 'spot/instance-action' and instance_id in self.ec2.interruptions:
+                action_time = datetime.utcfromtimestamp(self.ec2.interruptions[instance_id])
+                return json.dumps({'action': 'terminate', 'time': action_time.strftime('%Y-%m-%dT%H:%M:%SZ')})
+            return None
+
+    def url(self, instance_id=None):
+        base = f"http://127.0.0.1:{self.server.server_port}"
+        return f"{base}/{instance_id}" if instance_id else base
+
+    def start(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                prefix, found, path = self.path.partition('/latest/meta-data/')
+                value = None
+                if found:
+                    value = service.lookup(prefix.strip('/') or service.default_instance_id, path)
+                if value is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = value.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+def parse_worker_args(user_data):
+    """simple_test.py arguments from a worker's user data, or None if it does not run one"""
+    for line in user_data.splitlines():
+        if line.startswith('python3 ') and 'simple_test.py' in line:
+            parser = argparse.ArgumentParser(add_help=False)
+            parser.add_argument('country_code')
+            parser.add_argument('location_name', nargs='?')
+            parser.add_argument('--drain', action='store_true')
+            parser.add_argument('--queue-mode', default='filter')
+            parser.add_argument('--sessions', type=int, default=None)
+            parser.add_argument('--warm-idle', type=int, default=0)
+            args, _ = parser.parse_known_args(shlex.split(line)[2:])
+            return args
+    return None
+
+class FakeWorker:
+    """simple_test.py on one instance, played out on the simulation clock
+
+    Arguments come from the instance's user data. Locations are read from
+    the Location tag through the metadata service, or claimed with the
+    worker's own claim_next_location in drain mode. Leases are kept by the
+    worker's LeaseHeartbeat and interruption notices are handled by its
+    InterruptionWatcher, both driven from the simulation clock instead of
+    their threads, and every call goes through the fake clients. Only the
+    scrape itself is replaced by a sampled duration. Each finished
+    location gets a timings span like the real worker's. When the
+    simulation checkpoints, the scrape saves its progress through its own
+    CheckpointStore and resumes from it. With --warm-idle the worker
+    waits for more work when it runs out and then stops its instance; a
+    resumed instance gets a new FakeWorker, as systemd would start a new
+    process.
+    """
+
+    def __init__(self, sim, instance, args, last_location=None):
+        self.sim = sim
+        self.instance_id = instance['InstanceId']
+        self.country_code = args.country_code
+        self.location_name = args.location_name
+        self.drain = args.drain
+        self.queue_mode = args.queue_mode
+        self.warm_idle = args.warm_idle
+        self.last_location = last_location
+        self.sessions = args.sessions or INSTANCE_VCPUS.get(instance['InstanceType'], 2)
+        self.alive = True
+        self.drained = False
+        self.heartbeat = LeaseHeartbeat(status_writer=sim.status_writer, clock=sim.time)
+        self.checkpoints = CheckpointStore(sim.dynamodb, clock=sim.time)
+        self.watcher = InterruptionWatcher(self.heartbeat)
+        self.watcher.on_interruption(self.stop_claiming)
+        self.watcher.on_interruption(self.advance_progress)
+        self.watcher.on_interruption(self.checkpoints.save_all)
+        self.progress = {}  # location name -> (checkpoint, when the scrape would have started from zero)
+        self.active_sessions = 0
+        self.instance_timings = {}  # Boot and bootstrap, for the first span
+
+    def after(self, delay, callback):
+        """Run callback after delay, unless the instance has gone by then"""
+        self.sim.schedule(delay, lambda: self.alive and callback())
+
+    def start(self):
+        """Bootstrap finished, start the job"""
+        self.sim.workers_started += 1
+        self.after(HEARTBEAT_INTERVAL, self.beat_leases)
+        if self.drain:
+            self.start_sessions()
+        elif self.location_name:
+            self.begin(self.location_name)
+        else:
+            self.read_assignment(self.sim.now + ASSIGNMENT_TIMEOUT)
+
+    def start_sessions(self):
+        self.drained = False
+        self.active_sessions = self.sessions
+        for _ in range(self.sessions):
+            chrome_start = self.sim.sample(self.sim.browser_start_seconds)
+            self.after(chrome_start, lambda chrome_start=chrome_start: self.next_location(
+                {'chrome_start': chrome_start}))
+
+    def read_assignment(self, deadline):
+        """get_assigned_location: poll the Location tag until the controller has set a new one"""
+        tag = self.sim.metadata.lookup(self.instance_id, 'tags/instance/Location')
+        if tag:
+            tag_country, location_name = tag.split('#', 1)
+            if tag_country != self.country_code:
+                self.terminate()
+                return
+            if location_name != self.last_location:
+                self.begin(location_name)
+                return
+        if self.sim.now >= deadline:
+            self.terminate()
+            return
+        self.after(5, lambda: self.read_assignment(deadline))
+
+    def set_state(self, state):
+        """set_worker_state"""
+        tags = [{'Key': 'WorkerState', 'Value': state}]
+        if state == 'idle':
+            tags.append({'Key': 'IdleSince', 'Value': str(int(self.sim.now))})
+        self.sim.ec2.create_tags(Resources=[self.instance_id], Tags=tags)
+
+    def wait_for_pending(self, deadline):
+        """wait_for_pending: a drained worker polls the queue until it times out"""
+        if find_inactive_locations(self.sim.dynamodb, self.country_code, self.queue_mode, limit=1,
+                                   clock=self.sim.time):
+            self.set_state('busy')
+            self.start_sessions()
+        elif self.sim.now >= deadline:
+            self.terminate()
+        else:
+            self.after(WARM_POLL_INTERVAL, lambda: self.wait_for_pending(deadline))
+
+    def next_location(self, timings=None):
+        """One browser session asks the shared queue for its next location"""
+        location_name = None
+        timings = timings or {}
+        if not self.drained:
+            location_name = claim_next_location(
+                self.sim.dynamodb, self.country_code, self.instance_id, self.queue_mode, timings,
+                clock=self.sim.time)
+            self.drained = location_name is None
+        if location_name is None:
+            self.active_sessions -= 1
+            if not self.active_sessions:
+                if self.warm_idle:
+                    self.set_state('idle')
+                    self.wait_for_pending(self.sim.now + self.warm_idle)
+                else:
+                    self.terminate()
+            return
+        self.begin(location_name, timings)
+
+    def begin(self, location_name, timings=None):
+        if self.drain:
+            owner = self.instance_id
+        else:
+            owner = lease_owner(self.sim.dynamodb, self.country_code, location_name) or self.instance_id
+        self.heartbeat.add(self.country_code, location_name, owner)
+        timings = dict(timings or {}, **self.instance_timings)
+        self.instance_timings = {}
+        if self.sim.checkpoint_interval:
+            duration = self.resume(location_name)
+        else:
+            duration = self.sim.sample(self.sim.scrape_seconds)
+        self.after(duration, lambda: self.finish(location_name, duration, timings))
+    
+    def resume(self, location_name):
+        """Load the location's checkpoint and return the scrape seconds still to go
+
+        A location's scrape time is sampled once, and the checkpoint
+        cursor counts the seconds of it already done.
+        """
+        key = (self.country_code, location_name)
+        if key not in self.sim.scrape_durations:
+            self.sim.scrape_durations[key] = self.sim.sample(self.sim.scrape_seconds)
+        checkpoint = self.checkpoints.load(*key)
+        self.progress[location_name] = (checkpoint, self.sim.now - checkpoint.cursor)
+        self.after(self.sim.checkpoint_interval, lambda: self.checkpoint_loop(location_name))
+        return max(0, self.sim.scrape_durations[key] - checkpoint.cursor)
+    
+    def save_progress(self, location_name):
+        checkpoint, started = self.progress[location_name]
+        checkpoint.advance(int(self.sim.now - started))
+        self.checkpoints.save(checkpoint)
+    
+    def checkpoint_loop(self, location_name):
+        if location_name in self.progress:
+            self.save_progress(location_name)
+            self.after(self.sim.checkpoint_interval, lambda: self.checkpoint_loop(location_name))
+    
+    def finish(self, location_name, duration, timings):
+        """update_location_status, written only while this worker still holds the lease"""
+        owner = self.heartbeat.owner(self.country_code, location_name)
+        self.heartbeat.remove(self.country_code, location_name)
+        if location_name in self.progress:
+            self.checkpoints.forget(self.progress.pop(location_name)[0])
+        self.sim.busy_seconds += duration
+        timings = {phase: round(seconds, 3) for phase, seconds in dict(timings, scrape=duration).items()}
+        key = (self.country_code, location_name)
+        if self.sim.rng.random() < self.sim.failure_rate:
+            self.sim.status_writer.write_with_retry(
+                key, 'STOPPED', {'error_message': 'Simulated scrape failure', 'timings': timings},
+                condition=held_by(owner))
+        else:
+            self.sim.status_writer.write_with_retry(
+                key, 'COMPLETE', {'finished_at': int(self.sim.now), 'timings': timings},
+                condition=held_by(owner))
+        self.last_location = location_name
+        self.sim.last_locations[self.instance_id] = location_name
+        if self.drain:
+            self.next_location()
+        elif self.warm_idle:
+            self.set_state('idle')
+            self.read_assignment(self.sim.now + self.warm_idle)
+        else:
+            self.terminate()
+
+    def beat_leases(self):
+        """LeaseHeartbeat.run, one interval at a time"""
+        self.heartbeat.beat_all()
+        self.after(HEARTBEAT_INTERVAL, self.beat_leases)
+
+    def check_interruption(self):
+        """InterruptionWatcher.run's check, read from the metadata service directly
+
+        Its HTTP handler takes the simulation lock, which the controller's
+        wait already holds while this runs.
+        """
+        notice = self.sim.metadata.lookup(self.instance_id, 'spot/instance-action')
+        if notice is None:
+            return
+        self.watcher.handle(json.loads(notice))
+        # Nothing in flight will finish before the instance goes
+        self.alive = False
+
+    def stop_claiming(self):
+        self.drained = True
+
+    def advance_progress(self):
+        """Bring each scrape's checkpoint up to now, before the watcher saves them"""
+        for checkpoint, started in self.progress.values():
+            checkpoint.advance(int(self.sim.now - started))
+
+    def terminate(self):
+        """terminate_instance, which stops a warm pool worker instead"""
+        self.alive = False
+        if self.warm_idle:
+            self.sim.ec2.stop_instances(InstanceIds=[self.instance_id])
+        else:
+            self.sim.ec2.terminate_instances(InstanceIds=[self.instance_id])
+
+class Simulation:
+    """Run the real controller against fake AWS services on a simulated clock
+
+    TaskRunner is constructed through aws_backend's client factory, so it
+    talks to the fakes above, and the simulation is its event source:
+    each wait between ticks runs the world forward instead of sleeping.
+    Workers boot with sampled latency (plus bootstrap on the stock image),
+    spot instances are interrupted at interruption_rate per instance-hour,
+    launches fail with capacity errors at capacity_error_rate or when a
+    placement's pool_capacity or the vCPU quota is used up, and scrapes
+    fail at failure_rate. Stopped instances resume in resume_seconds,
+    without bootstrap, and are neither billed nor counted as running.
+    With checkpoint_interval, workers checkpoint every so many seconds and
+    on interruption notice, and a requeued location only scrapes what is
+    left. The controller, its placement engine, autoscaler and warm pool,
+    and each worker's heartbeat, queue and checkpoints are given the
+    simulation's clock, so leases, backoff, caches and cooldowns all see
+    simulated time.
+
+    With event_mode the controller is woken by the same EC2 and table
+    events the SQS queue would deliver, event_delay seconds after they
+    happen; otherwise it polls. API calls take no simulated time.
+    """
+
+    def __init__(self, seed=0, boot_seconds=45, bootstrap_seconds=240, scrape_seconds=90,
+                 browser_start_seconds=3, duration_spread=0.5, failure_rate=0.01,
+                 boot_failure_rate=0.0, interruption_rate=0.05, capacity_error_rate=0.0,
+                 pool_capacity=None, vcpu_quota=512, shutdown_seconds=30, resume_seconds=20,
+                 checkpoint_interval=None, event_mode=False, event_delay=1, max_seconds=7 * 86400):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.boot_seconds = boot_seconds
+        self.bootstrap_seconds = bootstrap_seconds
+        self.scrape_seconds = scrape_seconds
+        self.browser_start_seconds = browser_start_seconds
+        self.duration_spread = duration_spread
+        self.failure_rate = failure_rate
+        self.boot_failure_rate = boot_failure_rate
+        self.interruption_rate = interruption_rate
+        self.capacity_error_rate = capacity_error_rate
+        self.pool_capacity = pool_capacity
+        self.vcpu_quota = vcpu_quota
+        self.shutdown_seconds = shutdown_seconds
+        self.resume_seconds = resume_seconds
+        self.checkpoint_interval = checkpoint_interval
+        self.event_mode = event_mode
+        self.event_delay = event_delay
+        self.max_seconds = max_seconds
+
+        self.lock = threading.RLock()
+        self.started_at = self.now = 1700000000.0
+        self.finished_at = None
+        self.queue = []  # (time, sequence, callback)
+        self.sequence = itertools.count()
+        self.pending_events = []
+        self.api_calls = Counter()
+        self.dynamodb = FakeDynamoDB(self)
+        self.ec2 = FakeEC2(self)
+        self.clients = {
+            'dynamodb': self.dynamodb,
+            'ec2': self.ec2,
+            's3': FakeS3(self),
+            'logs': FakeLogs(self),
+            'cloudwatch': FakeCloudWatch(self),
+            'service-quotas': FakeServiceQuotas(self)
+        }
+        self.controller = self.ec2.create_instance(
+            BASE_IMAGE_ID, 't3.micro', None, [{'Key': 'Purpose', 'Value': 'dental-scraper-controller'}])
+        self.ec2.set_state(self.controller['InstanceId'], 'running')
+        self.metadata = FakeMetadataService(self.ec2, self.controller['InstanceId'])
+        # Workers write straight through; pacing would only cost real time
+        self.status_writer = StatusWriter(self.dynamodb, writes_per_second=1e9, clock=self.time)
+        self.scrape_durations = {}  # (country_code, location_name) -> sampled scrape seconds, when checkpointing
+        self.workers = {}  # instance id -> FakeWorker
+        self.worker_args = {}  # instance id -> parsed user data arguments, for resumes
+        self.last_locations = {}  # instance id -> last finished location, what LAST_LOCATION_FILE holds
+        self.parked = set()  # stopping or stopped worker instances
+        self.runner = None
+        # The controller was already running when the simulation starts
+        self.pending_events.clear()
+
+        # Metrics
+        self.ticks = 0
+        self.launches = 0
+        self.resumes = 0
+        self.workers_started = 0
+        self.interruptions = 0
+        self.capacity_errors = 0
+        self.live_workers = 0  # Launched and not yet terminated, billed
+        self.occupied_workers = 0  # pending or running, what the controller counts against max_instances
+        self.instance_seconds = 0.0
+        self.occupied_seconds = 0.0
+        self.slot_seconds = 0.0
+        self.busy_seconds = 0.0
+        self.accounted_at = self.now
+
+    def time(self):
+        return self.now
+
+    def client(self, service):
+        """Client factory for aws_backend"""
+        if service not in self.clients:
+            raise ValueError(f"No simulated {service} client")
+        return self.clients[service]
+
+    def add_locations(self, country_code, count, prefix='location'):
+        """Load count INACTIVE locations for a country into the control table"""
+        for i in range(count):
+            location_name = f"{prefix}-{i:06d}"
+            self.dynamodb.store({
+                'country_code': {'S': country_code},
+                'location_name': {'S': location_name},
+                'status': {'S': 'INACTIVE'},
+                'pending_shard': {'S': pending_shard_key(country_code, location_name)},
+                'queued_at': {'N': str(int(self.now))},
+                'last_updated': {'S': datetime.utcfromtimestamp(self.now).isoformat()}
+            })
+
+    def sample(self, mean):
+        """Lognormal duration around mean, with duration_spread as the sigma of its log"""
+        if not mean or not self.duration_spread:
+            return mean
+        return self.rng.lognormvariate(math.log(mean) - self.duration_spread ** 2 / 2, self.duration_spread)
+
+    def schedule(self, delay, callback):
+        heapq.heappush(self.queue, (self.now + delay, next(self.sequence), callback))
+
+    def publish(self, event):
+        if self.event_mode:
+            self.pending_events.append(event)
+
+    def account(self, until):
+        """Integrate instance and slot usage up to until"""
+        elapsed = until - self.accounted_at
+        if elapsed <= 0:
+            return
+        slots = self.runner.CONFIG['max_instances'] if self.runner else 0
+        self.instance_seconds += elapsed * self.live_workers
+        self.occupied_seconds += elapsed * min(self.occupied_workers, slots)
+        self.slot_seconds += elapsed * slots
+        self.accounted_at = until
+
+    def advance(self, until):
+        """Run scheduled events up to until, stopping early to deliver events in event mode"""
+        if self.pending_events:
+            until = min(until, self.now + self.event_delay)
+        while self.queue and self.queue[0][0] <= until:
+            at, _, callback = heapq.heappop(self.queue)
+            self.account(at)
+            self.now = max(self.now, at)
+            callback()
+            if self.pending_events:
+                until = min(until, self.now + self.event_delay)
+        self.account(until)
+        self.now = max(self.now, until)
+
+    def wait(self, timeout):
+        """Event source for the controller: run the world forward instead of sleeping"""
+        with self.lock:
+            self.ticks += 1
+            self.advance(self.now + timeout)
+            events, self.pending_events = self.pending_events, []
+            if self.now - self.started_at >= self.max_seconds:
+                logger.warning(f"Simulation stopped after {self.max_seconds}s of simulated time")
+                self.runner.running = False
+            return events
+
+    def launch_capacity(self, instance_type, subnet_id, min_count, max_count, spot):
+        """How many of a RunInstances request start, or the ClientError EC2 would raise"""
+        if self.rng.random() < self.capacity_error_rate:
+            self.capacity_errors += 1
+            raise client_error('InsufficientInstanceCapacity', 'RunInstances',
+                               f"There is no Spot capacity available for {instance_type} in {subnet_id}")
+        count = max_count
+        if spot and self.vcpu_quota is not None:
+            vcpus = INSTANCE_VCPUS.get(instance_type, 2)
+            used = sum(INSTANCE_VCPUS.get(instance['InstanceType'], 2) for instance in self.ec2.instances.values()
+                       if instance['InstanceLifecycle'] == 'spot')
+            count = min(count, int((self.vcpu_quota - used) // vcpus))
+            if count < min_count:
+                raise client_error('MaxSpotInstanceCountExceeded', 'RunInstances',
+                                   f"Max spot instance count exceeded for {self.vcpu_quota} vCPUs")
+        if self.pool_capacity is not None:
+            in_pool = sum(1 for instance in self.ec2.instances.values()
+                          if (instance['InstanceType'], instance['SubnetId']) == (instance_type, subnet_id))
+            count = min(count, self.pool_capacity - in_pool)
+        if count < min_count:
+            self.capacity_errors += 1
+            raise client_error('InsufficientInstanceCapacity', 'RunInstances',
+                               f"There is no Spot capacity available for {instance_type} in {subnet_id}")
+        return count
+
+    def is_worker(self, instance):
+        return any(tag == {'Key': 'Purpose', 'Value': 'dental-scraper'} for tag in instance['Tags'])
+
+    def boot(self, instance_id):
+        instance = self.ec2.instances.get(instance_id)
+        if instance is not None and instance['State']['Name'] == 'pending':
+            self.ec2.set_state(instance_id, 'running')
+
+    def instance_launched(self, instance, user_data):
+        if not self.is_worker(instance):
+            return
+        self.launches += 1
+        self.live_workers += 1
+        self.occupied_workers += 1
+        instance_id = instance['InstanceId']
+        self.publish({'source': 'ec2', 'type': 'EC2 Instance State-change Notification',
+                      'instance_id': instance_id, 'state': 'pending'})
+        boot = self.sample(self.boot_seconds)
+        self.schedule(boot, lambda: self.boot(instance_id))
+
+        args = parse_worker_args(user_data)
+        if args is not None and self.rng.random() >= self.boot_failure_rate:
+            # A failed bootstrap leaves the instance up with nothing running
+            self.worker_args[instance_id] = args
+            worker = self.workers[instance_id] = FakeWorker(self, instance, args)
+            bootstrap = 0 if instance['ImageId'] != BASE_IMAGE_ID else self.sample(self.bootstrap_seconds)
+            worker.instance_timings = {'bootstrap': bootstrap}
+            worker.after(boot + bootstrap, worker.start)
+        self.schedule_interruption(instance)
+
+    def schedule_interruption(self, instance):
+        instance_id = instance['InstanceId']
+        if instance['InstanceLifecycle'] == 'spot' and self.interruption_rate:
+            self.schedule(self.rng.expovariate(self.interruption_rate / 3600),
+                          lambda: self.interrupt(instance_id))
+
+    def instance_parked(self, instance):
+        """A worker instance is stopping: its worker goes, and it stops counting and being billed"""
+        instance_id = instance['InstanceId']
+        worker = self.workers.pop(instance_id, None)
+        if worker is not None:
+            worker.alive = False
+        if self.is_worker(instance):
+            self.account(self.now)
+            self.parked.add(instance_id)
+            self.live_workers -= 1
+            self.occupied_workers -= 1
+
+    def instance_resumed(self, instance):
+        """A stopped worker was started: it boots without bootstrap and runs its worker again"""
+        instance_id = instance['InstanceId']
+        self.account(self.now)
+        self.parked.discard(instance_id)
+        self.resumes += 1
+        self.live_workers += 1
+        self.occupied_workers += 1
+        resume = self.sample(self.resume_seconds)
+        self.schedule(resume, lambda: self.boot(instance_id))
+        args = self.worker_args.get(instance_id)
+        if args is not None:
+            worker = self.workers[instance_id] = FakeWorker(self, instance, args,
+                                                            self.last_locations.get(instance_id))
+            worker.after(resume, worker.start)
+        self.schedule_interruption(instance)
+
+    def interrupt(self, instance_id):
+        """Give a spot instance its two minute notice, then reclaim it
+
+        Persistent spot instances that stop on interruption are stopped,
+        and stay stopped until the controller resumes or evicts them.
+        """
+        instance = self.ec2.instances.get(instance_id)
+        if instance is None or instance['State']['Name'] not in ('pending', 'running'):
+            return
+        self.interruptions += 1
+        self.ec2.interruptions[instance_id] = self.now + INTERRUPTION_NOTICE_SECONDS
+        self.publish({'source': 'ec2', 'type': 'EC2 Spot Instance Interruption Warning',
+                      'instance_id': instance_id, 'state': None})
+        worker = self.workers.get(instance_id)
+        if worker is not None:
+            worker.after(self.rng.uniform(0, INTERRUPTION_CHECK_INTERVAL), worker.check_interruption)
+        if instance_id in self.ec2.stop_on_interruption:
+            self.schedule(INTERRUPTION_NOTICE_SECONDS, lambda: self.ec2.stop(instance_id))
+        else:
+            self.schedule(INTERRUPTION_NOTICE_SECONDS, lambda: self.ec2.shut_down(instance_id))
+
+    def instance_stopping(self, instance):
+        worker = self.workers.pop(instance['InstanceId'], None)
+        if worker is not None:
+            worker.alive = False
+        if instance['InstanceId'] == self.controller['InstanceId']:
+            self.finished_at = self.now
+        if self.is_worker(instance) and instance['InstanceId'] not in self.parked:
+            self.account(self.now)
+            self.occupied_workers -= 1
+
+    def instance_terminated(self, instance):
+        if not self.is_worker(instance):
+            return
+        if instance['InstanceId'] in self.parked:
+            # Already stopped counting when it was stopped
+            self.parked.discard(instance['InstanceId'])
+            return
+        self.account(self.now)
+        self.live_workers -= 1
+
+    def table_changed(self, key, old, new):
+        """What the table pipe would forward: status transitions the scheduler cares about"""
+        status = new.get('status', {}).get('S')
+        if status in ('INACTIVE', 'COMPLETE', 'STOPPED'):
+            self.publish({'source': 'dynamodb', 'type': 'MODIFY' if old else 'INSERT',
+                          'country_code': key[0], 'location_name': key[1], 'status': status})
+
+    def run(self, country_codes, config=None, autoscale=False, warm_pool=False):
+        """Run a controller over country_codes until it terminates itself, and return the report
+
+        config overrides TaskRunner.CONFIG.
+        """
+        metadata_url = aws_backend.METADATA_URL
+        random.seed(self.seed)
+        self.metadata.start()
+        aws_backend.set_client_factory(self.client)
+        aws_backend.METADATA_URL = self.metadata.url()
+        started = time.time()
+        try:
+            runner = TaskRunner(clock=self.time)
+            runner.CONFIG['decision_log'] = None
+            if not self.event_mode:
+                # Polling without a queue backs off to max_poll_interval
+                runner.CONFIG['max_event_wait'] = runner.CONFIG['max_poll_interval']
+            runner.CONFIG.update(config or {})
+            runner.placement = PlacementEngine(runner.CONFIG['instance_types'], runner.CONFIG['subnet_ids'],
+                                               clock=self.time)
+            runner.event_source = self
+            if autoscale:
+                runner.enable_autoscaling()
+            if warm_pool:
+                runner.enable_warm_pool()
+            self.runner = runner
+            runner.run_countries(country_codes)
+        finally:
+            aws_backend.METADATA_URL = metadata_url
+            aws_backend.set_client_factory(None)
+            self.metadata.stop()
+        return self.report(country_codes, time.time() - started)
+
+    def report(self, country_codes, wall_seconds):
+        statuses = Counter(item['status']['S'] for key, item in self.dynamodb.items.items()
+                           if key[0] in country_codes)
+        locations = sum(statuses.values())
+        elapsed = (self.finished_at or self.now) - self.started_at
+        api_calls = sum(self.api_calls.values())
+        # Percentiles of each phase over the per-location spans
+        phases = {}
+        for key, item in self.dynamodb.items.items():
+            if key[0] in country_codes and 'timings' in item:
+                for phase, seconds in item['timings']['M'].items():
+                    phases.setdefault(phase, []).append(float(seconds['N']))
+        return {
+            'locations': locations,
+            'complete': statuses['COMPLETE'],
+            'stopped': statuses['STOPPED'],
+            'finished': self.finished_at is not None,
+            'drain_seconds': round(elapsed),
+            'locations_per_hour': round(statuses['COMPLETE'] * 3600 / elapsed, 1) if elapsed else 0.0,
+            'slot_utilization': round(self.occupied_seconds / self.slot_seconds, 3) if self.slot_seconds else 0.0,
+            'busy_ratio': round(self.busy_seconds / self.instance_seconds, 3) if self.instance_seconds else 0.0,
+            'instance_hours': round(self.instance_seconds / 3600, 2),
+            'api_calls': api_calls,
+            'api_calls_per_location': round(api_calls / locations, 2) if locations else 0.0,
+            'read_units': round(self.dynamodb.read_units, 1),
+            'write_units': self.dynamodb.write_units,
+            'launches': self.launches,
+            'resumes': self.resumes,
+            'interruptions': self.interruptions,
+            'capacity_errors': self.capacity_errors,
+            'ticks': self.ticks,
+            'wall_seconds': round(wall_seconds, 2),
+            'phases': {phase: summarize(samples) for phase, samples in sorted(phases.items())},
+            'calls_by_operation': dict(sorted(self.api_calls.items()))
+        }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the controller against simulated EC2, DynamoDB and workers",
+        epilog="Example: python3 simulator.py UK=1000 FR=200 --worker-mode drain --queue-mode index --events"
+    )
+    parser.add_argument('countries', nargs='+', metavar='COUNTRY=LOCATIONS',
+                        help="Countries to simulate and how many INACTIVE locations each has")
+    parser.add_argument('--max-instances', type=int, default=20)
+    parser.add_argument('--worker-mode', choices=['single', 'drain'], default='single')
+    parser.add_argument('--queue-mode', choices=['filter', 'index'], default='filter')
+    parser.add_argument('--image-id', default=None, help="Launch from a prebaked image, skipping bootstrap")
+    parser.add_argument('--autoscale', action='store_true')
+    parser.add_argument('--warm-pool', action='store_true', help="Stop and resume workers instead of terminating them")
+    parser.add_argument('--hourly-budget', type=float, default=1.0)
+    parser.add_argument('--events', action='store_true', help="Wake the controller on events instead of polling")
+    parser.add_argument('--boot-seconds', type=float, default=45)
+    parser.add_argument('--bootstrap-seconds', type=float, default=240)
+    parser.add_argument('--scrape-seconds', type=float, default=90)
+    parser.add_argument('--checkpoint-interval', type=float, default=None,
+                        help="Checkpoint scrapes this often so requeued locations resume (default: off)")
+    parser.add_argument('--failure-rate', type=float, default=0.01)
+    parser.add_argument('--interruption-rate', type=float, default=0.05,
+                        help="Spot interruptions per instance-hour")
+    parser.add_argument('--capacity-error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help="Show the controller's logs")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    sim = Simulation(seed=args.seed, boot_seconds=args.boot_seconds, bootstrap_seconds=args.bootstrap_seconds,
+                     scrape_seconds=args.scrape_seconds, failure_rate=args.failure_rate,
+                     interruption_rate=args.interruption_rate, capacity_error_rate=args.capacity_error_rate,
+                     checkpoint_interval=args.checkpoint_interval, event_mode=args.events)
+    country_codes = []
+    for setting in args.countries:
+        country_code, _, count = setting.partition('=')
+        country_codes.append(country_code.upper())
+        sim.add_locations(country_code.upper(), int(count or 100))
+    report = sim.run(country_codes, {
+        'max_instances': args.max_instances,
+        'worker_mode': args.worker_mode,
+        'queue_mode': args.queue_mode,
+        'image_id': args.image_id,
+        'hourly_budget': args.hourly_budget
+    }, autoscale=args.autoscale, warm_pool=args.warm_pool)
+    print(json.dumps(report, indent=2))
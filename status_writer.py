@@ -0,0 +1,293 @@
+import time
+import zlib
+import random
+import logging
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from async_core import RateLimiter
+from aws_backend import get_client
+from checkpoint import CHECKPOINT_ATTRIBUTES
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = 'dental_location_control'
+
+# Sparse GSI over INACTIVE locations; pending_shard only exists while a
+# location is INACTIVE, so querying the index reads only claimable work
+PENDING_INDEX_NAME = 'pending_shard-index'
+PENDING_SHARDS = 4
+
+RETRYABLE_ERRORS = ('ProvisionedThroughputExceededException', 'ThrottlingException',
+                    'RequestLimitExceeded', 'InternalServerError', 'ServiceUnavailable')
+
+def attribute_value(value):
+    """DynamoDB attribute value for a number, a string or a dict of numbers (a timing span)"""
+    if isinstance(value, dict):
+        return {'M': {name: {'N': str(number)} for name, number in value.items()}}
+    return {'N': str(value)} if isinstance(value, (int, float)) else {'S': str(value)}
+
+def location_shard(location_name, shards):
+    """Stable shard number for a location name"""
+    return zlib.crc32(location_name.encode('utf-8')) % shards
+
+def pending_shard_key(country_code, location_name):
+    """Partition key value for a location in the pending index"""
+    return f"{country_code}#{location_shard(location_name, PENDING_SHARDS)}"
+
+def held_by(owner):
+    """Write condition for a location whose lease this owner still holds
+
+    A lease that expired may have been requeued and claimed by another
+    worker, which leaves the row IN_PROGRESS under a new owner.
+    """
+    return ('#status = :in_progress AND #owner = :owner',
+            {':in_progress': {'S': 'IN_PROGRESS'}, ':owner': {'S': owner}},
+            {'#owner': 'owner'})
+
+class StatusWriter:
+    """Buffered, coalescing writer for location status transitions
+
+    update() only records the transition; a background thread flushes
+    every flush_interval seconds, and flush() or close() force it. Several
+    transitions for one location before a flush collapse into one write
+    with the last status and the union of attributes. Flushed writes run
+    in parallel on one shared client, paced by writes_per_second, and
+    throttling is retried with full-jitter exponential backoff.
+
+    Status updates are partial updates of existing items, which
+    BatchWriteItem cannot express (it replaces whole items), and
+    TransactWriteItems would double the write cost and fail as a unit, so
+    "batching" here means coalescing plus concurrent UpdateItem calls.
+    """
+
+    def __init__(self, dynamodb=None, flush_interval=1.0, max_workers=8, writes_per_second=50,
+                 max_retries=6, base_delay=0.1, max_delay=10, metrics=None, clock=time.time):
+        self.dynamodb = dynamodb or get_client('dynamodb')
+        self.metrics = metrics
+        self.clock = clock
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = RateLimiter(writes_per_second)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='status-writer')
+        self.pending = {}  # (country_code, location_name) -> (status, attributes)
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """Stop the background flush and write everything still pending"""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+        self.flush()
+        self.executor.shutdown(wait=True)
+
+    def update(self, country_code, location_name, status, error_message=None, condition=None, **attributes):
+        """Queue a status transition; extra attributes are written as numbers, strings or maps of numbers
+
+        condition is as for write_with_retry, e.g. held_by(owner); the last
+        transition's condition applies to the coalesced write.
+        """
+        if error_message:
+            attributes['error_message'] = error_message
+        key = (country_code, location_name)
+        with self.lock:
+            _, previous, _ = self.pending.get(key, (None, {}, None))
+            self.pending[key] = (status, dict(previous, **attributes), condition)
+
+    def write(self, country_code, location_name, status, error_message=None, **attributes):
+        """Write one transition now, bypassing the buffer"""
+        if error_message:
+            attributes['error_message'] = error_message
+        self.write_with_retry((country_code, location_name), status, attributes)
+
+    def flush(self):
+        """Write every pending transition and return how many were written"""
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            if not pending:
+                return 0
+            futures = [self.executor.submit(self.write_with_retry, key, status, attributes, condition)
+                       for key, (status, attributes, condition) in pending.items()]
+            written = 0
+            for (country_code, location_name), future in zip(pending, futures):
+                try:
+                    if future.result():
+                        written += 1
+                    else:
+                        logger.warning(f"Not updating {country_code}:{location_name}, its condition failed")
+                except Exception as e:
+                    logger.error(f"Failed to update {country_code}:{location_name}: {str(e)}")
+            return written
+
+    def build_update(self, country_code, location_name, status, attributes, remove=()):
+        """UpdateItem arguments for a transition, keeping the pending index in step"""
+        set_exprs = ["#status = :status", "last_updated = :timestamp"]
+        remove_exprs = []
+        expr_names = {'#status': 'status'}
+        expr_attrs = {
+            ':status': {'S': status},
+            ':timestamp': {'S': datetime.utcnow().isoformat()}
+        }
+        for i, (name, value) in enumerate(sorted(attributes.items())):
+            expr_names[f'#a{i}'] = name
+            expr_attrs[f':a{i}'] = attribute_value(value)
+            set_exprs.append(f"#a{i} = :a{i}")
+        for i, name in enumerate(remove):
+            expr_names[f'#r{i}'] = name
+            remove_exprs.append(f"#r{i}")
+
+        if status == 'INACTIVE':
+            set_exprs.append("pending_shard = :shard")
+            set_exprs.append("queued_at = :now")
+            expr_attrs[':shard'] = {'S': pending_shard_key(country_code, location_name)}
+            expr_attrs[':now'] = {'N': str(int(self.clock()))}
+        else:
+            remove_exprs.append("pending_shard")
+            if status in ('COMPLETE', 'STOPPED'):
+                # Finished locations no longer need a lease
+                remove_exprs.append("lease_expires")
+            if status == 'COMPLETE':
+                # A STOPPED location keeps its checkpoint so a rerun resumes it
+                remove_exprs.extend(CHECKPOINT_ATTRIBUTES)
+
+        update_expr = "SET " + ", ".join(set_exprs)
+        if remove_exprs:
+            update_expr += " REMOVE " + ", ".join(remove_exprs)
+        return {
+            'TableName': TABLE_NAME,
+            'Key': {
+                'country_code': {'S': country_code},
+                'location_name': {'S': location_name}
+            },
+            'UpdateExpression': update_expr,
+            'ExpressionAttributeNames': expr_names,
+            'ExpressionAttributeValues': expr_attrs
+        }
+
+    def write_with_retry(self, key, status, attributes, condition=None, remove=()):
+        """UpdateItem with full-jitter backoff on throttling
+
+        condition is an optional (expression, values) pair, or (expression,
+        values, names); a failed condition is returned as False rather than
+        retried. remove lists attributes to delete.
+        """
+        country_code, location_name = key
+        args = self.build_update(country_code, location_name, status, attributes, remove)
+        if condition:
+            args['ConditionExpression'] = condition[0]
+            args['ExpressionAttributeValues'].update(condition[1])
+            if len(condition) > 2:
+                args['ExpressionAttributeNames'].update(condition[2])
+
+        started = time.monotonic()
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                self.dynamodb.update_item(**args)
+                logger.info(f"Updated location {country_code}:{location_name} status to {status}")
+                if self.metrics:
+                    # Includes pacing and retries, which is what a worker waits for
+                    self.metrics.observe('status_write', time.monotonic() - started)
+                return True
+            except self.dynamodb.exceptions.ConditionalCheckFailedException:
+                return False
+            except self.dynamodb.exceptions.ClientError as e:
+                if e.response['Error']['Code'] not in RETRYABLE_ERRORS or attempt == self.max_retries:
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                logger.warning(f"Throttled updating {country_code}:{location_name}, "
+                               f"retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    def reset_country(self, country_code, from_status='STOPPED', to_status='INACTIVE', dry_run=False):
+        """Move every location of a country in from_status to to_status
+
+        Used for retry passes, e.g. STOPPED back to INACTIVE. Each update is
+        conditional on the location still being in from_status, so
+        locations a worker picks up meanwhile are left alone. Attempt
+        counts, backoff and errors are cleared for locations going back to
+        INACTIVE. Returns the number of locations moved.
+        """
+        query_args = {
+            'TableName': TABLE_NAME,
+            'KeyConditionExpression': 'country_code = :cc',
+            'FilterExpression': '#status = :from',
+            'ProjectionExpression': 'location_name',
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': {':cc': {'S': country_code}, ':from': {'S': from_status}}
+        }
+        attributes = {'attempts': 0} if to_status == 'INACTIVE' else {}
+        remove = ('error_message', 'retry_after', 'owner', 'lease_expires') if to_status == 'INACTIVE' else ()
+        condition = ('#status = :from', {':from': {'S': from_status}})
+
+        futures = []
+        while True:
+            response = self.dynamodb.query(**query_args)
+            for item in response.get('Items', []):
+                key = (country_code, item['location_name']['S'])
+                if dry_run:
+                    futures.append(None)
+                    continue
+                futures.append(self.executor.submit(self.write_with_retry, key, to_status,
+                                                    dict(attributes), condition, remove))
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key:
+                break
+            query_args['ExclusiveStartKey'] = last_key
+
+        if dry_run:
+            logger.info(f"Would move {len(futures)} {country_code} locations from {from_status} to {to_status}")
+            return len(futures)
+
+        moved = 0
+        for future in futures:
+            try:
+                moved += 1 if future.result() else 0
+            except Exception as e:
+                logger.error(f"Failed to reset location: {str(e)}")
+        logger.info(f"Moved {moved}/{len(futures)} {country_code} locations from {from_status} to {to_status}")
+        return moved
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Bulk status changes on the control table, e.g. a retry pass over STOPPED locations",
+        epilog="Example: python3 status_writer.py UK --from STOPPED --to INACTIVE"
+    )
+    parser.add_argument('country_codes', nargs='+', help="Countries to reset")
+    parser.add_argument('--from', dest='from_status', default='STOPPED',
+                        choices=['INACTIVE', 'IN_PROGRESS', 'COMPLETE', 'STOPPED'])
+    parser.add_argument('--to', dest='to_status', default='INACTIVE',
+                        choices=['INACTIVE', 'IN_PROGRESS', 'COMPLETE', 'STOPPED'])
+    parser.add_argument('--rate', type=float, default=50, help="Writes per second")
+    parser.add_argument('--dry-run', action='store_true', help="Only count the locations that would move")
+    args = parser.parse_args()
+
+    writer = StatusWriter(writes_per_second=args.rate)
+    try:
+        for country_code in args.country_codes:
+            writer.reset_country(country_code.upper(), args.from_status, args.to_status, args.dry_run)
+    finally:
+        writer.close()
@@ -1,12 +1,30 @@
-import boto3
 import time
 import logging
 import json
 import os
 import signal
 import sys
+import uuid
+import socket
+import asyncio
+import argparse
 import requests
-from datetime import datetime
+from datetime import datetime, timezone
+
+from image_builder import BASE_IMAGE_ID, get_bootstrap_script, find_latest_image
+from code_bundle import WORKER_FILES, upload_bundle, get_fetch_script, source_fingerprint
+from log_tailer import LogTailer
+from controller_events import SqsEventSource, AdaptivePoller
+from async_core import AsyncCore, throttle_client
+from scheduler import allocate_slots, parse_country_settings
+from autoscaler import Autoscaler, get_spot_vcpu_quota, INSTANCE_VCPUS
+from placement import PlacementEngine, NoCapacityError, classify_launch_error
+from status_writer import (StatusWriter, PENDING_INDEX_NAME, PENDING_SHARDS,
+                           location_shard, pending_shard_key)
+from warm_pool import WarmPool, WARM_POOL_TAG, WORKER_STATE_TAG, instance_tags
+from local_executor import LocalExecutor, parse_host
+from metrics import Metrics, count_api_calls
+from aws_backend import get_client, metadata_url
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,17 +34,73 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class TaskRunner:
-    def __init__(self):
-        self.ec2 = boto3.client('ec2', region_name='eu-west-2')
-        self.dynamodb = boto3.client('dynamodb', region_name='eu-west-2')
-        self.logs = boto3.client('logs', region_name='eu-west-2')
+    def __init__(self, clock=time.time):
+        self.clock = clock  # Wall clock for leases, backoff and caches
+        self.ec2 = get_client('ec2')
+        self.dynamodb = get_client('dynamodb')
+        self.logs = get_client('logs')
+        self.s3 = get_client('s3')
+        self.service_quotas = get_client('service-quotas')
         self.running = True
         self.CONFIG = {
             'security_group_id': 'sg-0baac2c985b88fd23',
-            'subnet_id': 'subnet-0d00b3a1ba2dd811b',
+            'subnet_ids': ['subnet-0d00b3a1ba2dd811b'],  # Worker subnets, one per AZ to spread spot requests
+            'instance_types': ['t3.medium', 't3a.medium', 't2.medium'],  # Interchangeable worker types, preferred first
             'log_group': '/aws/ec2/selenium-scraper',
-            'max_instances': 2  # Maximum number of concurrent instances
+            'max_instances': 2,  # Maximum number of concurrent instances, adjusted by the autoscaler
+            'spot_max_price': '0.04',  # Spot price ceiling per instance hour
+            'queue_mode': 'filter',  # 'filter' scans the country, 'index' reads the pending GSI
+            'stats_interval': 300,  # Seconds between full stats scans in index mode
+            'controller_shard': 0,  # This controller's shard of the country
+            'controller_shards': 1,  # Number of controllers sharing the country
+            'lease_seconds': 1800,  # Claim lease, long enough to cover instance boot
+            'max_attempts': 3,  # Expired leases before a location is STOPPED
+            'retry_backoff': 300,  # Seconds before a requeued location is retried, doubled per attempt
+            'describe_cache_seconds': 10,  # How long the running worker view is reused
+            'worker_mode': 'single',  # 'single' launches a worker per location, 'drain' workers claim until empty
+            'worker_sessions': None,  # Browser sessions per drain worker, None sizes to the instance
+            'drain_start_seconds': 300,  # Drain workers launched or resumed this recently count as still booting
+            'image_id': None,  # Prebaked image from image_builder.py, None bootstraps the stock AMI
+            'warm_pool': False,  # Stop finished workers and resume them instead of launching new ones
+            'warm_idle_seconds': 120,  # How long a warm worker waits for more work before stopping
+            'warm_pool_timeout': 1800,  # Stopped warm workers idle for longer than this are terminated
+            'local_worker_cpus': 1,  # CPUs a local worker reserves per browser session
+            'local_worker_memory_gb': 1.0,  # Memory a local worker reserves per browser session
+            'min_poll_interval': 2,  # Seconds between ticks while launching or reaping
+            'max_poll_interval': 30,  # Idle tick interval without an event source
+            'max_event_wait': 300,  # Idle tick interval when events wake the loop
+            'max_concurrency': 32,  # AWS calls in flight at once from the control loop
+            'api_rates': {'ec2': 20, 'dynamodb': 100, 'logs': 5, 's3': 50},  # Calls per second per service
+            'country_priorities': {},  # Fair-share weight per country, default 1
+            'country_quotas': {},  # Maximum running instances per country, default no limit
+            'hourly_budget': 1.0,  # Autoscaler spend ceiling in dollars per hour at spot_max_price
+            'autoscale_ceiling': 100,  # Autoscaler never goes above this many instances
+            'decision_log': 'autoscaler-decisions.jsonl',  # Autoscaler decisions, for replay
+            'metrics_interval': 60  # Seconds between metric exports to CloudWatch
         }
+        self.event_source = None
+        self.autoscaler = None
+        self.warm_pool = None
+        self.executor = None  # None launches EC2 instances, or a LocalExecutor
+        self.vcpu_quota_cache = (0, None)
+        self.placement = PlacementEngine(self.CONFIG['instance_types'], self.CONFIG['subnet_ids'], clock=clock)
+        self.metrics = Metrics(get_client('cloudwatch'), dimensions={'Role': 'controller'},
+                               interval=self.CONFIG['metrics_interval'])
+        self.status_writer = StatusWriter(self.dynamodb, metrics=self.metrics, clock=clock)
+        self.controller_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.stats_cache = {}
+        self.instance_cache = (0, None)
+        self.bundle_hash = None
+        self.bundle_fingerprint = None
+        self.user_data_cache = {}
+        self.log_group_ready = False
+        
+        # Keep concurrent calls under each service's API rate limits
+        for service in ('ec2', 'dynamodb', 'logs', 's3'):
+            throttle_client(getattr(self, service), self.CONFIG['api_rates'][service])
+        for client in (self.ec2, self.dynamodb, self.logs, self.s3, self.service_quotas):
+            count_api_calls(client, self.metrics)
+        self.core = AsyncCore(self.CONFIG['max_concurrency'])
         
         # Set up signal handlers for graceful shutdown
         signal.signal(signal.SIGINT, self.handle_shutdown)
@@ -37,67 +111,248 @@ class TaskRunner:
         logger.info("Received shutdown signal. Cleaning up...")
         self.running = False
 
-    def get_running_instances(self):
-        """Get currently running scraper instances"""
-        response = self.ec2.describe_instances(
+    def get_running_instances(self, refresh=False):
+        """Get currently running scraper instances
+
+        Pages through describe_instances and reuses the result for
+        describe_cache_seconds so one control loop tick makes one call.
+        """
+        fetched_at, instances = self.instance_cache
+        if (not refresh and instances is not None
+                and self.clock() - fetched_at < self.CONFIG['describe_cache_seconds']):
+            return instances
+
+        instances = []
+        paginator = self.ec2.get_paginator('describe_instances')
+        for page in paginator.paginate(
             Filters=[
                 {'Name': 'instance-state-name', 'Values': ['pending', 'running']},
                 {'Name': 'tag:Purpose', 'Values': ['dental-scraper']}
             ]
-        )
-        
-        instances = []
-        for reservation in response['Reservations']:
-            for instance in reservation['Instances']:
-                instances.append(instance)
+        ):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    instances.append(instance)
         
+        self.instance_cache = (self.clock(), instances)
         return instances
 
-    def get_inactive_locations(self, country_code):
-        """Get INACTIVE locations for a specific country"""
-        response = self.dynamodb.query(
-            TableName='dental_location_control',
-            KeyConditionExpression='country_code = :cc',
-            FilterExpression='#status = :status',
-            ExpressionAttributeNames={'#status': 'status'},
-            ExpressionAttributeValues={
-                ':cc': {'S': country_code},
-                ':status': {'S': 'INACTIVE'}
-            }
-        )
-        return response.get('Items', [])
+    def get_workers(self, refresh=False):
+        """Running workers from whichever executor runs them, described like EC2 instances"""
+        if self.executor:
+            return self.executor.running_instances()
+        return self.get_running_instances(refresh)
 
-    def get_location_stats(self, country_code):
-        """Get statistics for locations in a country"""
-        response = self.dynamodb.query(
-            TableName='dental_location_control',
-            KeyConditionExpression='country_code = :cc',
-            ExpressionAttributeValues={
-                ':cc': {'S': country_code}
-            }
-        )
-        
+    def get_free_slots(self, running_instances):
+        """Workers that can still be started: up to max_instances on EC2, as many as the hosts fit locally"""
+        if self.executor:
+            return self.executor.free_slots()
+        return self.CONFIG['max_instances'] - len(running_instances)
+
+    def invalidate_instance_cache(self):
+        """Force the next get_running_instances call to hit EC2"""
+        self.instance_cache = (0, None)
+        if self.warm_pool:
+            self.warm_pool.invalidate()
+
+    def get_running_workers(self):
+        """Get running scraper instances keyed by their Location tag
+
+        Instances from a batch launch that have not been tagged with a
+        location yet are left out.
+        """
+        workers = {}
+        for instance in self.get_workers():
+            tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+            if 'Location' in tags:
+                workers[tags['Location']] = instance
+        return workers
+
+    def count_workers_by_country(self, instances):
+        """Count running scraper instances per country from their Country or Location tag"""
+        counts = {}
+        for instance in instances:
+            tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+            country_code = tags.get('Country') or tags.get('Location', '').partition('#')[0]
+            if country_code:
+                counts[country_code] = counts.get(country_code, 0) + 1
+        return counts
+
+    def worker_session_count(self, instance_type=None):
+        """Locations a drain worker scrapes at once, the most any instance type gives without one"""
+        if self.CONFIG['worker_sessions']:
+            return self.CONFIG['worker_sessions']
+        if self.executor:
+            return 1
+        if instance_type is None:
+            return max(INSTANCE_VCPUS.get(name, 2) for name in self.CONFIG['instance_types'])
+        return INSTANCE_VCPUS.get(instance_type, 2)
+    
+    def starting_drain_claims(self, country_code, instances):
+        """Locations a country's still booting drain workers will claim as soon as they start
+
+        Until then those locations still look INACTIVE, so launching a
+        worker for each of them as well would over-launch. A worker counts
+        as booting for drain_start_seconds after its launch or resume.
+        """
+        now = self.clock()
+        claims = 0
+        for instance in instances:
+            tags = instance_tags(instance)
+            if tags.get('Country') != country_code or 'Location' in tags:
+                continue
+            launch_time = instance.get('LaunchTime')
+            if launch_time is None:
+                continue
+            if launch_time.tzinfo is None:
+                launch_time = launch_time.replace(tzinfo=timezone.utc)
+            if now - launch_time.timestamp() < self.CONFIG['drain_start_seconds']:
+                claims += self.worker_session_count(instance.get('InstanceType'))
+        return claims
+    
+    def owns_location(self, location_name):
+        """Check whether a location falls in this controller's shard"""
+        return (location_shard(location_name, self.CONFIG['controller_shards'])
+                == self.CONFIG['controller_shard'])
+
+    def is_claimable(self, item, now):
+        """Check whether an INACTIVE location has finished any retry backoff"""
+        return int(item.get('retry_after', {}).get('N', '0')) <= now
+
+    def scan_country(self, country_code):
+        """Scan all locations for a country once, returning stats, INACTIVE work and expired leases
+
+        Follows LastEvaluatedKey so partitions larger than 1 MB are read in
+        full, and projects only the attributes the control loop needs. Stats
+        cover the whole country; the work lists only this controller's shard.
+        """
         stats = {
             'total': 0,
             'inactive': 0,
             'in_progress': 0,
             'complete': 0,
-            'stopped': 0
+            'stopped': 0,
+            'timed': 0,  # COMPLETE locations with a known duration
+            'duration_total': 0  # Seconds from claim to completion, summed over timed locations
         }
-        
-        for item in response.get('Items', []):
-            stats['total'] += 1
-            status = item.get('status', {}).get('S', '').upper()
-            if status == 'INACTIVE':
-                stats['inactive'] += 1
-            elif status == 'IN_PROGRESS':
-                stats['in_progress'] += 1
-            elif status == 'COMPLETE':
-                stats['complete'] += 1
-            elif status == 'STOPPED':
-                stats['stopped'] += 1
-        
-        return stats
+        inactive_locations = []
+        expired_locations = []
+        now = int(self.clock())
+
+        query_args = {
+            'TableName': 'dental_location_control',
+            'KeyConditionExpression': 'country_code = :cc',
+            'ProjectionExpression': 'location_name, #status, lease_expires, attempts, retry_after, '
+                                    'started_at, finished_at',
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': {
+                ':cc': {'S': country_code}
+            }
+        }
+
+        while True:
+            response = self.dynamodb.query(**query_args)
+
+            for item in response.get('Items', []):
+                stats['total'] += 1
+                status = item.get('status', {}).get('S', '').upper()
+                owned = self.owns_location(item['location_name']['S'])
+                if status == 'INACTIVE':
+                    stats['inactive'] += 1
+                    if owned and self.is_claimable(item, now):
+                        inactive_locations.append(item)
+                elif status == 'IN_PROGRESS':
+                    stats['in_progress'] += 1
+                    lease_expires = item.get('lease_expires', {}).get('N')
+                    if owned and lease_expires and int(lease_expires) < now:
+                        expired_locations.append(item)
+                elif status == 'COMPLETE':
+                    stats['complete'] += 1
+                    if 'started_at' in item and 'finished_at' in item:
+                        stats['timed'] += 1
+                        stats['duration_total'] += int(item['finished_at']['N']) - int(item['started_at']['N'])
+                elif status == 'STOPPED':
+                    stats['stopped'] += 1
+
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key:
+                break
+            query_args['ExclusiveStartKey'] = last_key
+
+        return stats, inactive_locations, expired_locations
+
+    def get_inactive_locations(self, country_code):
+        """Get INACTIVE locations for a specific country"""
+        return self.scan_country(country_code)[1]
+
+    def get_location_stats(self, country_code):
+        """Get statistics for locations in a country"""
+        return self.scan_country(country_code)[0]
+
+    def get_pending_locations(self, country_code, limit=None):
+        """Get INACTIVE locations for a country from the sparse pending index
+
+        Reads cost scales with the backlog rather than the table size since
+        only INACTIVE locations carry the pending_shard attribute. When the
+        controller count divides PENDING_SHARDS each controller only queries
+        the pending shards that map onto its own shard.
+        """
+        controller_shards = self.CONFIG['controller_shards']
+        if PENDING_SHARDS % controller_shards == 0:
+            shards = [shard for shard in range(PENDING_SHARDS)
+                      if shard % controller_shards == self.CONFIG['controller_shard']]
+        else:
+            shards = range(PENDING_SHARDS)
+
+        locations = []
+        now = int(self.clock())
+        for shard in shards:
+            query_args = {
+                'TableName': 'dental_location_control',
+                'IndexName': PENDING_INDEX_NAME,
+                'KeyConditionExpression': 'pending_shard = :shard',
+                'ExpressionAttributeValues': {
+                    ':shard': {'S': f"{country_code}#{shard}"}
+                }
+            }
+            if limit:
+                query_args['Limit'] = limit
+
+            while True:
+                response = self.dynamodb.query(**query_args)
+                locations.extend(item for item in response.get('Items', [])
+                                 if self.owns_location(item['location_name']['S'])
+                                 and self.is_claimable(item, now))
+                if limit and len(locations) >= limit:
+                    return locations[:limit]
+
+                last_key = response.get('LastEvaluatedKey')
+                if not last_key:
+                    break
+                query_args['ExclusiveStartKey'] = last_key
+
+        return locations
+
+    def get_country_work(self, country_code, limit):
+        """Get stats, up to limit INACTIVE locations and expired leases for one control loop tick
+
+        In filter mode this is a single full scan. In index mode the work
+        list comes from the pending index and the full stats scan only runs
+        every stats_interval seconds, or when the backlog looks empty so the
+        completion check always sees exact numbers. Expired leases are only
+        found by the full scan.
+        """
+        if self.CONFIG['queue_mode'] != 'index':
+            return self.scan_country(country_code)
+
+        inactive_locations = self.get_pending_locations(country_code, limit=max(limit, 1))
+        expired_locations = []
+        scanned_at, stats = self.stats_cache.get(country_code, (0, None))
+        if (stats is None or not inactive_locations
+                or self.clock() - scanned_at >= self.CONFIG['stats_interval']):
+            stats, _, expired_locations = self.scan_country(country_code)
+            self.stats_cache[country_code] = (self.clock(), stats)
+        return stats, inactive_locations, expired_locations
 
     def get_cloudwatch_config(self):
         """Get CloudWatch agent configuration"""
@@ -130,46 +385,92 @@ class TaskRunner:
         }
         return json.dumps(config)
 
-    def get_user_data(self, country_code, location_name):
-        """Get user data script with proper escaping"""
+    def get_bundle_hash(self):
+        """Upload the worker code bundle and return its hash
+
+        The bundle is only built and uploaded again when a worker file's
+        modification time or size changes, so launches reuse the hash and
+        the rendered user data that is cached under it.
+        """
+        fingerprint = source_fingerprint(WORKER_FILES)
+        if self.bundle_hash is None or fingerprint != self.bundle_fingerprint:
+            self.bundle_hash = upload_bundle(self.s3, WORKER_FILES)
+            self.bundle_fingerprint = fingerprint
+            self.user_data_cache = {}
+        return self.bundle_hash
+
+    def get_user_data(self, country_code, location_name=None, drain=False):
+        """Get user data script with proper escaping
+
+        Without a location_name the worker reads its location from the
+        Location tag, which is how batch launches assign work. With drain
+        the worker claims locations itself until the queue is empty. With a
+        prebaked image_id the installs are skipped and the script only
+        configures logging and runs the job.
+
+        The worker code is not inlined; user data carries the bundle hash
+        and fetches and verifies the bundle from S3. Rendered scripts are
+        cached per country, code hash and worker arguments.
+        """
         try:
-            with open('simple_test.py', 'r') as f:
-                test_code = f.read()
+            bundle_hash = self.get_bundle_hash()
+            cache_key = (country_code, bundle_hash, location_name, drain)
+            if cache_key in self.user_data_cache:
+                return self.user_data_cache[cache_key]
             
             cloudwatch_config = self.get_cloudwatch_config()
+            fetch_script = get_fetch_script(bundle_hash, '/home/ubuntu')
+            if self.CONFIG['image_id']:
+                # Everything is already installed in the prebaked image
+                bootstrap = ''
+            else:
+                bootstrap = "# Wait for instance to fully initialize\nsleep 10\n\n" + get_bootstrap_script('worker') + "\n"
+            if drain:
+                worker_args = f' --drain --queue-mode {self.CONFIG["queue_mode"]}'
+                if self.CONFIG['worker_sessions']:
+                    worker_args += f' --sessions {self.CONFIG["worker_sessions"]}'
+            elif location_name:
+                worker_args = f' "{location_name}"'
+            else:
+                worker_args = ''
+            if self.CONFIG['warm_pool']:
+                worker_args += f' --warm-idle {self.CONFIG["warm_idle_seconds"]}'
+                # User data only runs on first boot; a resumed worker starts from systemd
+                resume_service = f"""# Run the worker again whenever the instance is resumed from the warm pool
+cat > /etc/systemd/system/dental-worker.service << 'EOF'
+[Unit]
+Description=Dental scraper worker
+Wants=network-online.target
+After=network-online.target
+
+[Service]
+Type=simple
+WorkingDirectory=/home/ubuntu
+Environment=AWS_DEFAULT_REGION=eu-west-2
+ExecStart=/usr/bin/python3 /home/ubuntu/simple_test.py "{country_code}"{worker_args}
+StandardOutput=append:/var/log/user-data.log
+StandardError=append:/var/log/user-data.log
+
+[Install]
+WantedBy=multi-user.target
+EOF
+systemctl enable dental-worker.service
+
+"""
+            else:
+                resume_service = ''
             
-            return f'''#!/bin/bash
+            user_data = f'''#!/bin/bash
 # Enable immediate output logging
 exec 1> >(tee -a /var/log/user-data.log) 2>&1
 set -x  # Enable command tracing
 
-# Wait for instance to fully initialize
-sleep 10
-
-# Install required packages
-apt-get update
-apt-get install -y wget unzip python3-pip curl
+# The worker reports boot-to-user-data and bootstrap times from these
+export USER_DATA_STARTED=$(date +%s.%N)
 
-# Install system dependencies for Chrome
-apt-get install -y fonts-liberation libasound2 libatk-bridge2.0-0 libatk1.0-0 libatspi2.0-0 \\
-    libcairo2 libcups2 libdbus-1-3 libdrm2 libgbm1 libgdk-pixbuf2.0-0 libgtk-3-0 libnspr4 \\
-    libnss3 libpango-1.0-0 libx11-6 libxcb1 libxcomposite1 libxdamage1 libxext6 libxfixes3 \\
-    libxrandr2 xdg-utils libu2f-udev libvulkan1 libxkbcommon0 libxss1
-
-# Install AWS CLI
-echo "[$(date '+%Y-%m-%d %H:%M:%S')] Installing AWS CLI..."
-curl "https://awscli.amazonaws.com/awscli-exe-linux-x86_64.zip" -o "awscliv2.zip"
-unzip awscliv2.zip
-./aws/install
-
-# Set region
+{bootstrap}# Set region
 export AWS_DEFAULT_REGION=eu-west-2
 
-# Install CloudWatch agent
-echo "[$(date '+%Y-%m-%d %H:%M:%S')] Installing CloudWatch agent..."
-wget https://s3.amazonaws.com/amazoncloudwatch-agent/ubuntu/amd64/latest/amazon-cloudwatch-agent.deb
-dpkg -i -E ./amazon-cloudwatch-agent.deb
-
 # Configure CloudWatch agent
 echo "[$(date '+%Y-%m-%d %H:%M:%S')] Configuring CloudWatch agent..."
 mkdir -p /opt/aws/amazon-cloudwatch-agent/bin/
@@ -181,25 +482,17 @@ EOF
 /opt/aws/amazon-cloudwatch-agent/bin/amazon-cloudwatch-agent-ctl -a fetch-config -m ec2 -s -c file:/opt/aws/amazon-cloudwatch-agent/bin/config.json
 systemctl start amazon-cloudwatch-agent
 
-# Install Chrome
-echo "[$(date '+%Y-%m-%d %H:%M:%S')] Installing Chrome..."
-wget https://dl.google.com/linux/direct/google-chrome-stable_current_amd64.deb
-dpkg -i google-chrome-stable_current_amd64.deb
-apt-get -f install -y
-
-# Install Python dependencies
-pip3 install selenium==4.15.2 boto3 requests
-
-# Create and run test script
-echo "[$(date '+%Y-%m-%d %H:%M:%S')] Creating test script..."
-cat > /home/ubuntu/simple_test.py << 'EOF'
-{test_code}
-EOF
-
-# Run the test
+# Fetch the test script
+echo "[$(date '+%Y-%m-%d %H:%M:%S')] Fetching code bundle..."
+{fetch_script}
+{resume_service}# Run the test
 echo "[$(date '+%Y-%m-%d %H:%M:%S')] Running test..."
-python3 /home/ubuntu/simple_test.py "{country_code}" "{location_name}"
+export BOOTSTRAP_FINISHED=$(date +%s.%N)
+cd /home/ubuntu
+python3 /home/ubuntu/simple_test.py "{country_code}"{worker_args}
 '''
+            self.user_data_cache[cache_key] = user_data
+            return user_data
         except Exception as e:
             logger.error(f"Failed to generate user data: {str(e)}")
             raise
@@ -207,17 +500,67 @@ python3 /home/ubuntu/simple_test.py "{country_code}" "{location_name}"
     def update_location_status(self, country_code, location_name, status, error_message=None):
         """Update location status in DynamoDB"""
         try:
-            update_expr = "SET #status = :status, last_updated = :timestamp"
-            expr_attrs = {
-                ':status': {'S': status},
-                ':timestamp': {'S': datetime.utcnow().isoformat()}
-            }
-            expr_names = {'#status': 'status'}
-            
-            if error_message:
-                update_expr += ", error_message = :error"
-                expr_attrs[':error'] = {'S': error_message}
-            
+            self.status_writer.write(country_code, location_name, status, error_message)
+        except Exception as e:
+            logger.error(f"Failed to update DynamoDB: {str(e)}")
+
+    def claim_location(self, country_code, location_name):
+        """Atomically claim an INACTIVE location for this controller
+
+        The conditional update only succeeds while the location is still
+        INACTIVE, so controllers sharing a country never launch the same
+        location twice. Returns False if another controller got there first.
+        The old item's queued_at gives the location's queue wait.
+        """
+        try:
+            response = self.dynamodb.update_item(
+                TableName='dental_location_control',
+                Key={
+                    'country_code': {'S': country_code},
+                    'location_name': {'S': location_name}
+                },
+                UpdateExpression="SET #status = :in_progress, last_updated = :timestamp, "
+                                 "#owner = :owner, lease_expires = :expires, started_at = :now "
+                                 "REMOVE pending_shard",
+                ConditionExpression='#status = :inactive AND '
+                                    '(attribute_not_exists(retry_after) OR retry_after <= :now)',
+                ExpressionAttributeNames={'#status': 'status', '#owner': 'owner'},
+                ExpressionAttributeValues={
+                    ':in_progress': {'S': 'IN_PROGRESS'},
+                    ':inactive': {'S': 'INACTIVE'},
+                    ':timestamp': {'S': datetime.utcnow().isoformat()},
+                    ':owner': {'S': self.controller_id},
+                    ':now': {'N': str(int(self.clock()))},
+                    ':expires': {'N': str(int(self.clock()) + self.CONFIG['lease_seconds'])}
+                },
+                ReturnValues='ALL_OLD'
+            )
+            logger.info(f"Claimed location {country_code}:{location_name}")
+            queued_at = response.get('Attributes', {}).get('queued_at')
+            if queued_at:
+                self.metrics.observe('queue_wait', max(0, self.clock() - float(queued_at['N'])))
+            return True
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            logger.info(f"Location {country_code}:{location_name} already claimed, skipping")
+            return False
+
+    def release_location(self, country_code, location_name, error_message=None):
+        """Return a location claimed by this controller to INACTIVE"""
+        set_expr = "SET #status = :inactive, last_updated = :timestamp, pending_shard = :shard, queued_at = :now"
+        expr_attrs = {
+            ':inactive': {'S': 'INACTIVE'},
+            ':now': {'N': str(int(self.clock()))},
+            ':in_progress': {'S': 'IN_PROGRESS'},
+            ':timestamp': {'S': datetime.utcnow().isoformat()},
+            ':shard': {'S': pending_shard_key(country_code, location_name)},
+            ':owner': {'S': self.controller_id}
+        }
+        if error_message:
+            set_expr += ", error_message = :error"
+            expr_attrs[':error'] = {'S': error_message}
+        update_expr = set_expr + " REMOVE #owner, lease_expires"
+
+        try:
             self.dynamodb.update_item(
                 TableName='dental_location_control',
                 Key={
@@ -225,66 +568,338 @@ python3 /home/ubuntu/simple_test.py "{country_code}" "{location_name}"
                     'location_name': {'S': location_name}
                 },
                 UpdateExpression=update_expr,
-                ExpressionAttributeNames=expr_names,
+                ConditionExpression='#status = :in_progress AND #owner = :owner',
+                ExpressionAttributeNames={'#status': 'status', '#owner': 'owner'},
                 ExpressionAttributeValues=expr_attrs
             )
-            logger.info(f"Updated location {country_code}:{location_name} status to {status}")
+            logger.info(f"Released location {country_code}:{location_name}")
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            logger.warning(f"Location {country_code}:{location_name} is no longer ours, not releasing")
         except Exception as e:
             logger.error(f"Failed to update DynamoDB: {str(e)}")
 
+    def requeue_expired_lease(self, country_code, item):
+        """Requeue a location whose lease expired, or STOP it after max_attempts
+
+        The worker stopped heartbeating (spot reclaim, failed bootstrap,
+        crashed browser), so any instance still tagged with the location is
+        terminated and the location goes back to INACTIVE with an
+        exponential retry_after backoff.
+        """
+        location_name = item['location_name']['S']
+        attempts = int(item.get('attempts', {}).get('N', '0')) + 1
+        now = int(self.clock())
+        expr_attrs = {
+            ':in_progress': {'S': 'IN_PROGRESS'},
+            ':seen_expires': item['lease_expires'],
+            ':timestamp': {'S': datetime.utcnow().isoformat()},
+            ':attempts': {'N': str(attempts)},
+            ':error': {'S': f"Lease expired (attempt {attempts} of {self.CONFIG['max_attempts']})"}
+        }
+
+        if attempts >= self.CONFIG['max_attempts']:
+            status = 'STOPPED'
+            update_expr = ("SET #status = :stopped, last_updated = :timestamp, attempts = :attempts, "
+                           "error_message = :error REMOVE #owner, lease_expires, retry_after")
+            expr_attrs[':stopped'] = {'S': status}
+        else:
+            status = 'INACTIVE'
+            retry_after = now + self.CONFIG['retry_backoff'] * 2 ** (attempts - 1)
+            update_expr = ("SET #status = :inactive, last_updated = :timestamp, attempts = :attempts, "
+                           "error_message = :error, retry_after = :retry_after, pending_shard = :shard, "
+                           "queued_at = :retry_after REMOVE #owner, lease_expires")
+            expr_attrs[':inactive'] = {'S': status}
+            expr_attrs[':retry_after'] = {'N': str(retry_after)}
+            expr_attrs[':shard'] = {'S': pending_shard_key(country_code, location_name)}
+
+        try:
+            # Only requeue if no heartbeat has renewed the lease since we looked
+            self.dynamodb.update_item(
+                TableName='dental_location_control',
+                Key={
+                    'country_code': {'S': country_code},
+                    'location_name': {'S': location_name}
+                },
+                UpdateExpression=update_expr,
+                ConditionExpression='#status = :in_progress AND lease_expires = :seen_expires',
+                ExpressionAttributeNames={'#status': 'status', '#owner': 'owner'},
+                ExpressionAttributeValues=expr_attrs
+            )
+        except self.dynamodb.exceptions.ConditionalCheckFailedException:
+            logger.info(f"Lease on {country_code}:{location_name} was renewed, not requeueing")
+            return None
+
+        logger.warning(f"Lease expired on {country_code}:{location_name}, "
+                       f"moved to {status} after {attempts} attempt(s)")
+        self.terminate_location_instances(country_code, location_name)
+        return status
+    
+    def terminate_location_instances(self, country_code, location_name):
+        """Terminate any worker still running for a location
+
+        Only workers launched for the location, which carry its Location
+        tag, are terminated. A drain worker that owned the location is
+        shared with its other sessions and their leases, so it is left
+        running: the requeue removed it as the location's owner, and its
+        heartbeat and status writes are conditional on ownership, so it
+        cannot extend, release or finish the location once requeued or
+        claimed by another worker.
+        """
+        location_tag = f'{country_code}#{location_name}'
+        instance = self.get_running_workers().get(location_tag)
+        if instance:
+            logger.info(f"Terminating stale instance {instance['InstanceId']} for {location_tag}")
+            self.terminate_workers([instance['InstanceId']])
+
+    async def reap_expired_leases(self, country_code, expired_locations):
+        """Requeue or stop every location whose lease has expired, concurrently"""
+        if self.autoscaler:
+            # A worker that stops heartbeating was most likely interrupted
+            self.autoscaler.record_interruptions(len(expired_locations))
+        results = await self.core.map(
+            lambda item: self.requeue_expired_lease(country_code, item), expired_locations)
+        for item, result in zip(expired_locations, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to reap {country_code}:{item['location_name']['S']}: {str(result)}",
+                             exc_info=result)
+
     def ensure_log_group_exists(self):
-        """Ensure CloudWatch log group exists"""
+        """Ensure CloudWatch log group exists, once per controller"""
+        if self.log_group_ready:
+            return
         try:
             self.logs.create_log_group(logGroupName=self.CONFIG['log_group'])
             logger.info(f"Created log group: {self.CONFIG['log_group']}")
         except self.logs.exceptions.ResourceAlreadyExistsException:
             logger.info(f"Log group already exists: {self.CONFIG['log_group']}")
+        self.log_group_ready = True
 
     def launch_instance(self, country_code, location_name):
-        """Launch EC2 instance with Chrome"""
+        """Launch EC2 instance with Chrome
+
+        Returns None without launching if another controller claimed the
+        location first.
+        """
+        launched = asyncio.run(self.launch_instances(country_code, [location_name]))
+        return launched.get(location_name)
+
+    def assign_instance(self, country_code, location_name, instance_id):
+        """Tag a batch or warm instance with its location, or give the location back if that fails"""
+        tags = [
+            {'Key': 'Name', 'Value': f'dental-scraper-{location_name}'},
+            {'Key': 'Location', 'Value': f'{country_code}#{location_name}'}
+        ]
+        if self.warm_pool:
+            tags.append({'Key': WORKER_STATE_TAG, 'Value': 'busy'})
         try:
-            # First update status to IN_PROGRESS
-            self.update_location_status(country_code, location_name, 'IN_PROGRESS')
-            
-            # Ensure log group exists
-            self.ensure_log_group_exists()
-            
-            # Launch spot instance
-            response = self.ec2.run_instances(
-                ImageId='ami-003c3655bc8e97ae1',  # Ubuntu 22.04 LTS
-                InstanceType='t3.medium',
-                MinCount=1,
-                MaxCount=1,
-                SecurityGroupIds=[self.CONFIG['security_group_id']],
-                SubnetId=self.CONFIG['subnet_id'],
-                IamInstanceProfile={'Name': 'venue-scraper-profile'},
-                InstanceMarketOptions={
-                    'MarketType': 'spot',
-                    'SpotOptions': {
-                        'MaxPrice': '0.04',
-                        'SpotInstanceType': 'one-time'
-                    }
-                },
-                UserData=self.get_user_data(country_code, location_name),
-                TagSpecifications=[{
-                    'ResourceType': 'instance',
-                    'Tags': [
-                        {'Key': 'Name', 'Value': f'dental-scraper-{location_name}'},
-                        {'Key': 'Purpose', 'Value': 'dental-scraper'},
-                        {'Key': 'Location', 'Value': f'{country_code}#{location_name}'}
-                    ]
-                }]
-            )
-            
-            instance_id = response['Instances'][0]['InstanceId']
-            logger.info(f"Launched instance {instance_id}")
-            return instance_id
-            
+            self.ec2.create_tags(Resources=[instance_id], Tags=tags)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to tag {instance_id} for {location_name}: {str(e)}")
+            self.terminate_workers([instance_id])
+            self.release_location(country_code, location_name, str(e))
+            return False
+
+    async def assign_warm_workers(self, country_code, location_names, warm_workers):
+        """Hand claimed locations to warm workers, idle ones first, resuming stopped ones
+
+        Returns (launched, unassigned): location name to instance id for the
+        locations a warm worker took, and claimed locations still without one.
+        """
+        assignments = list(zip(location_names, (instance['InstanceId'] for instance in warm_workers)))
+        results = await self.core.map(lambda pair: self.assign_instance(country_code, *pair), assignments)
+        states = {instance['InstanceId']: instance['State']['Name'] for instance in warm_workers}
+        tagged = [pair for pair, result in zip(assignments, results) if result is True]
+        resumed = set(await self.core.run(self.warm_pool.resume,
+                                          [instance_id for _, instance_id in tagged
+                                           if states[instance_id] == 'stopped']))
+        self.invalidate_instance_cache()
+        launched = {location_name: instance_id for location_name, instance_id in tagged
+                    if states[instance_id] != 'stopped' or instance_id in resumed}
+        # Tagging failures already released their location
+        unassigned = [location_name for location_name, _ in tagged if location_name not in launched]
+        unassigned += location_names[len(assignments):]
+        if launched:
+            logger.info(f"Assigned {len(launched)} {country_code} location(s) to warm workers")
+        return launched, unassigned
+
+    async def launch_instances(self, country_code, location_names, warm_workers=()):
+        """Launch one spot instance per location with a single RunInstances call
+
+        Every instance in a batch shares the same launch spec and user data,
+        so locations are assigned afterwards by tagging each instance with
+        its Location; workers read the tag from instance metadata. Claims,
+        tags and releases for the batch are issued concurrently. Claims
+        that end up without an instance are released. warm_workers are
+        given locations before anything is launched. With a local executor
+        each location gets a local worker instead. Returns a dict of
+        location name to instance or worker id.
+        """
+        # First claim the locations, moving them to IN_PROGRESS
+        results = await self.core.map(
+            lambda name: self.claim_location(country_code, name), location_names)
+        claimed = []
+        for location_name, result in zip(location_names, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to claim {country_code}:{location_name}: {str(result)}")
+            elif result:
+                claimed.append(location_name)
+        if not claimed:
+            return {}
+        
+        if self.executor:
+            launched = await self.core.run(self.executor.start_location_workers, country_code, claimed)
+            await self.core.map(
+                lambda name: self.release_location(country_code, name, "No room for a local worker"),
+                [name for name in claimed if name not in launched])
+            return launched
+        
+        warm_launched = {}
+        if warm_workers:
+            warm_launched, claimed = await self.assign_warm_workers(country_code, claimed, warm_workers)
+            if not claimed:
+                return warm_launched
+        
+        try:
+            user_data = await self.core.run(self.get_user_data, country_code)
+            instance_ids = await self.core.run(
+                self.run_worker_instances, len(claimed), user_data,
+                extra_tags=[{'Key': 'Country', 'Value': country_code}])
         except Exception as e:
-            # If launch fails, set status back to INACTIVE
-            self.update_location_status(country_code, location_name, 'INACTIVE', str(e))
-            logger.error(f"Failed to launch instance: {str(e)}")
+            # If launch fails, hand the locations back to the queue; the caller logs why
+            await self.core.map(
+                lambda name: self.release_location(country_code, name, str(e)), claimed)
             raise
+        
+        logger.info(f"Launched {len(instance_ids)}/{len(claimed)} instances")
+        if self.autoscaler:
+            self.autoscaler.record_launches(len(instance_ids))
+        
+        assignments = list(zip(claimed, instance_ids))
+        results = await self.core.map(
+            lambda pair: self.assign_instance(country_code, *pair), assignments)
+        launched = {location_name: instance_id
+                    for (location_name, instance_id), result in zip(assignments, results)
+                    if result is True}
+        
+        # Capacity may have been short of the full batch
+        await self.core.map(
+            lambda name: self.release_location(country_code, name, "Spot capacity unavailable for batch"),
+            claimed[len(instance_ids):])
+        
+        return dict(warm_launched, **launched)
+
+    def launch_drain_workers(self, country_code, count):
+        """Launch count workers that claim and scrape locations until the queue is empty
+
+        In warm pool mode the most recently stopped workers are resumed
+        first and only the shortfall is launched.
+        """
+        if self.executor:
+            return self.executor.start_drain_workers(country_code, count, self.CONFIG['queue_mode'],
+                                                     self.CONFIG['worker_sessions'] or 1)
+        resumed = []
+        if self.warm_pool:
+            stopped = self.warm_pool.stopped_instances(country_code)[-count:]
+            resumed = self.warm_pool.resume([instance['InstanceId'] for instance in stopped])
+            self.invalidate_instance_cache()
+            if resumed:
+                logger.info(f"Resumed {len(resumed)} warm drain workers for {country_code}")
+            count -= len(resumed)
+            if count <= 0:
+                return resumed
+        instance_ids = self.run_worker_instances(
+            count, self.get_user_data(country_code, drain=True),
+            extra_tags=[
+                {'Key': 'Name', 'Value': f'dental-scraper-{country_code}-worker'},
+                {'Key': 'Country', 'Value': country_code}
+            ]
+        )
+        logger.info(f"Launched {len(instance_ids)}/{count} drain workers for {country_code}")
+        if self.autoscaler:
+            self.autoscaler.record_launches(len(instance_ids))
+        return resumed + instance_ids
+
+    def run_worker_instances(self, count, user_data, extra_tags=None):
+        """Request up to count spot workers sharing one launch spec
+
+        Each placement (instance type and subnet) the placement engine
+        offers gets one multi-count RunInstances call for the instances
+        still missing. Capacity, price and quota errors cool the placement
+        down and move on to the next one. Returns the IDs of the instances
+        EC2 actually started, which may be fewer than count; raises
+        NoCapacityError if no placement started any.
+        """
+        # Ensure log group exists
+        self.ensure_log_group_exists()
+        
+        instance_ids = []
+        batch_id = uuid.uuid4().hex[:12]
+        spot_options = {'MaxPrice': self.CONFIG['spot_max_price'], 'SpotInstanceType': 'one-time'}
+        pool_tags = []
+        if self.warm_pool:
+            # Only persistent spot instances can be stopped, and an
+            # interruption then stops them rather than terminating them
+            spot_options.update(SpotInstanceType='persistent', InstanceInterruptionBehavior='stop')
+            pool_tags = [{'Key': WARM_POOL_TAG, 'Value': 'true'}, {'Key': WORKER_STATE_TAG, 'Value': 'busy'}]
+        try:
+            for placement in self.placement.candidates():
+                wanted = count - len(instance_ids)
+                if wanted <= 0:
+                    break
+                instance_type, subnet_id = placement
+                try:
+                    # Launch spot instances
+                    with self.metrics.timer('launch_api'):
+                        response = self.ec2.run_instances(
+                            ImageId=self.CONFIG['image_id'] or BASE_IMAGE_ID,
+                            InstanceType=instance_type,
+                            MinCount=1,
+                            MaxCount=wanted,
+                            SecurityGroupIds=[self.CONFIG['security_group_id']],
+                            SubnetId=subnet_id,
+                            IamInstanceProfile={'Name': 'venue-scraper-profile'},
+                            InstanceMarketOptions={
+                                'MarketType': 'spot',
+                                'SpotOptions': spot_options
+                            },
+                            # Workers read their Location tag from instance metadata
+                            MetadataOptions={'InstanceMetadataTags': 'enabled'},
+                            UserData=user_data,
+                            TagSpecifications=[{
+                                'ResourceType': 'instance',
+                                'Tags': [
+                                    {'Key': 'Purpose', 'Value': 'dental-scraper'},
+                                    {'Key': 'Controller', 'Value': self.controller_id},
+                                    {'Key': 'LaunchBatch', 'Value': batch_id}
+                                ] + pool_tags + (extra_tags or [])
+                            }]
+                        )
+                except self.ec2.exceptions.ClientError as e:
+                    kind = classify_launch_error(e)
+                    if kind is None:
+                        if not instance_ids:
+                            raise
+                        # Keep what already launched rather than orphaning it
+                        logger.error(f"Failed to launch {instance_type} in {subnet_id}: {str(e)}")
+                        break
+                    self.placement.record_failure(placement, kind)
+                    if kind == 'quota':
+                        break
+                    continue
+                
+                launched = [instance['InstanceId'] for instance in response['Instances']]
+                instance_ids.extend(launched)
+                self.placement.record_success(placement)
+                if len(launched) < wanted:
+                    # A short batch means this pool is close to exhausted
+                    self.placement.record_failure(placement, 'capacity')
+        finally:
+            self.invalidate_instance_cache()
+        
+        if not instance_ids:
+            raise NoCapacityError(f"No spot capacity for {count} workers in any placement")
+        return instance_ids
 
     def wait_for_instance(self, instance_id):
         logger.info("Waiting for instance to be running...")
@@ -294,142 +909,448 @@ python3 /home/ubuntu/simple_test.py "{country_code}" "{location_name}"
         response = self.ec2.describe_instances(InstanceIds=[instance_id])
         return response['Reservations'][0]['Instances'][0]['PublicIpAddress']
 
-    def tail_cloudwatch_logs(self, instance_id):
-        """Stream CloudWatch logs for the instance"""
-        try:
-            seen_events = set()
-            while True:
-                # Get logs from all streams for this instance
-                response = self.logs.describe_log_streams(
-                    logGroupName=self.CONFIG['log_group'],
-                    logStreamNamePrefix=instance_id
-                )
-                
-                for stream in response.get('logStreams', []):
-                    stream_name = stream['logStreamName']
-                    
-                    # Get log events
-                    log_response = self.logs.get_log_events(
-                        logGroupName=self.CONFIG['log_group'],
-                        logStreamName=stream_name,
-                        startFromHead=True
-                    )
-                    
-                    for event in log_response['events']:
-                        event_id = f"{stream_name}:{event['timestamp']}"
-                        if event_id not in seen_events:
-                            print(f"[{stream_name}] {event['message']}")
-                            seen_events.add(event_id)
-                
-                time.sleep(5)
-                
-        except KeyboardInterrupt:
-            logger.info("Stopped tailing logs")
+    def tail_cloudwatch_logs(self, *instance_ids):
+        """Stream CloudWatch logs for one or more instances"""
+        LogTailer(self.logs, self.CONFIG['log_group'], instance_ids).run()
 
     def terminate_self(self):
         """Terminate this controller instance"""
         try:
             # Get instance ID from metadata
-            instance_id = requests.get(
-                'http://169.254.169.254/latest/meta-data/instance-id',
-                timeout=2
-            ).text
+            instance_id = requests.get(metadata_url('instance-id'), timeout=2).text
             
             logger.info(f"All work complete. Terminating controller instance {instance_id}")
+            self.metrics.flush()
             self.ec2.terminate_instances(InstanceIds=[instance_id])
         except Exception as e:
             logger.error(f"Failed to terminate controller: {str(e)}", exc_info=True)
             sys.exit(1)
 
-    def run_country(self, country_code):
-        """Process all locations for a country"""
+    def enable_autoscaling(self):
+        """Let the autoscaler size max_instances, starting from the configured value"""
+        self.autoscaler = Autoscaler(
+            min_instances=self.CONFIG['max_instances'],
+            max_instances=self.CONFIG['autoscale_ceiling'],
+            hourly_budget=self.CONFIG['hourly_budget'],
+            spot_max_price=float(self.CONFIG['spot_max_price']),
+            decision_log=self.CONFIG['decision_log'],
+            clock=self.clock
+        )
+
+    def enable_warm_pool(self):
+        """Keep finished workers stopped for reuse instead of terminating them"""
+        self.CONFIG['warm_pool'] = True
+        self.warm_pool = WarmPool(self.ec2, idle_timeout=self.CONFIG['warm_pool_timeout'],
+                                  cache_seconds=self.CONFIG['describe_cache_seconds'], clock=self.clock)
+        self.user_data_cache = {}
+
+    def enable_local_executor(self, hosts, runtime='process'):
+        """Run workers as processes or containers on hosts instead of EC2 instances
+
+        Each worker reserves local_worker_cpus and local_worker_memory_gb
+        per browser session; drain workers run worker_sessions sessions.
+        """
+        sessions = (self.CONFIG['worker_sessions'] or 1) if self.CONFIG['worker_mode'] == 'drain' else 1
+        self.executor = LocalExecutor(hosts, runtime,
+                                      worker_cpus=self.CONFIG['local_worker_cpus'] * sessions,
+                                      worker_memory_gb=self.CONFIG['local_worker_memory_gb'] * sessions)
+        logger.info(f"Running {runtime} workers on {', '.join(map(repr, hosts))}")
+
+    def get_warm_workers(self, country_code):
+        """A country's warm workers as (idle, stopped)
+
+        Idle workers are running and waiting for work, so they can take a
+        location without a free slot. Stopped ones need a slot to resume.
+        """
+        idle = [instance for instance in self.get_running_instances()
+                if instance_tags(instance).get('Country') == country_code
+                and instance_tags(instance).get(WORKER_STATE_TAG) == 'idle']
+        return idle, self.warm_pool.stopped_instances(country_code)
+
+    def trim_warm_pool(self, country_code, backlog, finished):
+        """Evict stopped workers the backlog no longer needs or that idled too long
+
+        Once the country is finished, workers still idling are evicted too.
+        """
+        idle, stopped = self.get_warm_workers(country_code)
+        evicted = self.warm_pool.plan_evictions(stopped, backlog)
+        if finished:
+            evicted += idle
+        if evicted:
+            logger.info(f"Evicting {len(evicted)} warm {country_code} worker(s), backlog {backlog}")
+            self.terminate_workers([instance['InstanceId'] for instance in evicted])
+
+    def terminate_workers(self, instance_ids):
+        """Terminate workers, cancelling their persistent spot requests in warm pool mode"""
+        if self.executor:
+            self.executor.terminate_instances(instance_ids)
+        elif self.warm_pool:
+            self.warm_pool.evict(instance_ids)
+        else:
+            self.ec2.terminate_instances(InstanceIds=instance_ids)
+        self.invalidate_instance_cache()
+
+    def get_vcpu_quota(self):
+        """Spot vCPU quota, re-read at most hourly"""
+        fetched_at, quota = self.vcpu_quota_cache
+        if quota is None or self.clock() - fetched_at >= 3600:
+            quota = get_spot_vcpu_quota(self.service_quotas)
+            self.vcpu_quota_cache = (self.clock(), quota)
+        return quota
+
+    def autoscale(self, work):
+        """Feed this tick's stats to the autoscaler and apply its max_instances"""
+        stats = [country_work[0] for country_work in work.values()
+                 if not isinstance(country_work, Exception)]
+        timed = sum(country_stats['timed'] for country_stats in stats)
+        observation = {
+            'remaining': sum(country_stats['total'] - country_stats['complete'] - country_stats['stopped']
+                             for country_stats in stats),
+            'mean_duration': (sum(country_stats['duration_total'] for country_stats in stats) / timed
+                              if timed else None),
+            'worker_mode': self.CONFIG['worker_mode'],
+            'sessions': self.CONFIG['worker_sessions'],
+            'vcpu_quota': self.get_vcpu_quota()
+        }
+        self.CONFIG['max_instances'] = self.autoscaler.update(observation)
+
+    def wait_for_events(self, timeout):
+        """Sleep until the next tick, or until an event says something changed
+
+        EC2 events invalidate the cached instance view, so the tick they
+        trigger sees fresh instances. Table events only wake the loop: the
+        work list is read fresh every tick, while workers change statuses
+        far too often to rescan the country on each one, so the stats keep
+        their stats_interval and are rescanned early only when the backlog
+        looks empty.
+        """
+        if self.event_source is None:
+            time.sleep(timeout)
+            return []
+        
+        events = self.event_source.wait(timeout)
+        if events:
+            sources = {event['source'] for event in events}
+            logger.info(f"Woken by {len(events)} event(s) from {', '.join(sorted(sources))}")
+            if 'ec2' in sources:
+                self.invalidate_instance_cache()
+            if self.autoscaler:
+                self.autoscaler.record_interruptions(sum(
+                    1 for event in events if event['type'] == 'EC2 Spot Instance Interruption Warning'))
+        return events
+
+    async def run_tick(self, country_codes):
+        """Run one pass of the control loop over every unfinished country
+
+        Free slots under max_instances are shared between the countries
+        with allocate_slots, weighted by country_priorities and capped by
+        country_quotas. Returns {country_code: (stats, active, done)}, with
+        an exception in place of the tuple for a country whose tick failed.
+        """
+        # Read every country and the running instances at the same time;
+        # drain workers claim a location per session
+        limit = self.CONFIG['max_instances']
+        if self.CONFIG['worker_mode'] == 'drain':
+            limit *= self.worker_session_count()
+        results = await asyncio.gather(
+            self.core.run(self.get_workers),
+            *(self.core.run(self.get_country_work, country_code, limit)
+              for country_code in country_codes),
+            return_exceptions=True
+        )
+        running_instances = results[0]
+        if isinstance(running_instances, Exception):
+            raise running_instances
+        work = dict(zip(country_codes, results[1:]))
+        if self.autoscaler:
+            await self.core.run(self.autoscale, work)
+        
+        free_slots = self.get_free_slots(running_instances)
+        running_counts = self.count_workers_by_country(running_instances)
+        demand = {country_code: len(country_work[1]) for country_code, country_work in work.items()
+                  if not isinstance(country_work, Exception)}
+        slots = allocate_slots(free_slots, demand, running_counts,
+                               self.CONFIG['country_priorities'], self.CONFIG['country_quotas'])
+        logger.info(f"Running instances: {len(running_instances)}, Available slots: {free_slots}")
+        if len(country_codes) > 1:
+            logger.info("Slot allocation: " + ", ".join(
+                f"{country_code}={slots[country_code]}" for country_code in sorted(slots)))
+        
+        ticked = [country_code for country_code in country_codes if country_code in slots]
+        outcomes = await asyncio.gather(
+            *(self.tick_country(country_code, work[country_code], slots[country_code])
+              for country_code in ticked),
+            return_exceptions=True
+        )
+        outcomes = dict(zip(ticked, outcomes))
+        for country_code in country_codes:
+            if country_code not in outcomes:
+                outcomes[country_code] = work[country_code]
+        return outcomes
+
+    async def tick_country(self, country_code, work, available_slots):
+        """Reap, check completion and launch for one country
+
+        Returns (stats, active, done). active is True when the tick launched
+        or requeued something, so the next tick should follow soon; done is
+        True once every location is finished and none of the country's
+        workers are left.
+        """
+        active = False
+        stats, inactive_locations, expired_locations = work
+        
+        # Requeue locations whose workers stopped heartbeating
+        if expired_locations:
+            await self.reap_expired_leases(country_code, expired_locations)
+            active = True
+        
+        logger.info(f"Country {country_code} progress: "
+                f"{stats['complete']}/{stats['total']} complete, "
+                f"{stats['in_progress']} in progress, "
+                f"{stats['stopped']} stopped")
+        
+        # Check if all locations are finished, either COMPLETE or STOPPED
+        # after running out of attempts. Scans are paginated and exact, so
+        # one check is enough once no workers are left.
+        finished = stats['complete'] + stats['stopped'] == stats['total']
+        if self.warm_pool:
+            # Keep the warm pool no larger than the backlog could use
+            await self.core.run(self.trim_warm_pool, country_code, stats['inactive'], finished)
+        if finished:
+            running_instances = await self.core.run(self.get_workers, refresh=True)
+            remaining = self.count_workers_by_country(running_instances).get(country_code, 0)
+            if not remaining:
+                logger.info(f"All locations in {country_code} have been processed!")
+                return stats, active, True
+            logger.info(f"Waiting for {remaining} {country_code} instances to terminate")
+            return stats, active, False
+        
+        # Idle warm workers already hold a slot; stopped ones take one to resume,
+        # most recently stopped first. Drain workers are resumed by
+        # launch_drain_workers and idle ones claim work themselves.
+        warm_workers, idle_count = [], 0
+        if self.warm_pool and inactive_locations:
+            idle_workers, stopped_workers = await self.core.run(self.get_warm_workers, country_code)
+            warm_workers = stopped_workers[::-1][:max(available_slots, 0)]
+            if self.CONFIG['worker_mode'] != 'drain':
+                warm_workers = idle_workers + warm_workers
+                idle_count = len(idle_workers)
+        capacity = max(available_slots, 0) + idle_count
+        
+        if (capacity > 0 and inactive_locations and not warm_workers and not self.executor
+                and not self.placement.available()):
+            # Claiming now would only release the locations again
+            retry_at = datetime.utcfromtimestamp(self.placement.next_available_at())
+            logger.info(f"No spot placements available for {country_code} until {retry_at:%H:%M:%S} UTC")
+        elif capacity > 0 and inactive_locations:
+            logger.info(f"Found {len(inactive_locations)} inactive locations in {country_code}, "
+                        f"{available_slots} slots")
+            
+            if self.CONFIG['worker_mode'] == 'drain':
+                # Drain workers claim their own locations, a session's worth
+                # each, so leave the ones workers still booting are about to take
+                starting = self.starting_drain_claims(country_code, await self.core.run(self.get_workers))
+                sessions = self.worker_session_count()
+                count = min(available_slots, -(-(len(inactive_locations) - starting) // sessions))
+                if count <= 0:
+                    logger.info(f"Booting {country_code} drain workers will claim the remaining "
+                                f"{len(inactive_locations)} locations")
+                else:
+                    try:
+                        if await self.core.run(self.launch_drain_workers, country_code, count):
+                            active = True
+                    except NoCapacityError as e:
+                        logger.warning(f"Failed to launch drain workers: {str(e)}")
+                    except Exception as e:
+                        logger.error(f"Failed to launch drain workers: {str(e)}", exc_info=True)
+            else:
+                # Launch new instances up to the limit in one batch
+                location_names = [location['location_name']['S']
+                                  for location in inactive_locations[:capacity]]
+                try:
+                    launched = await self.launch_instances(country_code, location_names, warm_workers)
+                    for location_name, instance_id in launched.items():
+                        logger.info(f"Launched instance {instance_id} for {location_name}")
+                    active = active or bool(launched)
+                except NoCapacityError as e:
+                    logger.warning(f"Failed to launch instances for {len(location_names)} locations: {str(e)}")
+                except Exception as e:
+                    logger.error(f"Failed to launch instances for {len(location_names)} locations: "
+                                 f"{str(e)}", exc_info=True)
+        
+        return stats, active, False
+
+    async def run_countries_async(self, country_codes):
+        """Control loop for one or more countries on the asyncio core
+
+        Each tick's latency and the AWS calls it made are recorded as the
+        tick_latency and tick_api_calls metrics.
+        """
+        max_interval = self.CONFIG['max_event_wait'] if self.event_source else self.CONFIG['max_poll_interval']
+        poller = AdaptivePoller(self.CONFIG['min_poll_interval'], max_interval)
+        pending = list(country_codes)
+        if not self.executor:
+            await self.core.run(self.ensure_log_group_exists)
+        while self.running:
+            try:
+                active = False
+                tick_started = time.monotonic()
+                calls_before = self.metrics.totals.get('api_calls', 0)
+                outcomes = await self.run_tick(pending)
+                self.metrics.observe('tick_latency', time.monotonic() - tick_started)
+                self.metrics.observe('tick_api_calls', self.metrics.totals.get('api_calls', 0) - calls_before,
+                                     unit='Count')
+                for country_code, result in outcomes.items():
+                    if isinstance(result, Exception):
+                        logger.error(f"Error in control loop for {country_code}: {str(result)}",
+                                     exc_info=result)
+                        continue
+                    stats, country_active, done = result
+                    active = active or country_active
+                    if done:
+                        pending.remove(country_code)
+                        logger.info(f"Finished processing country: {country_code}")
+                if not pending:
+                    # A local executor's host may be a dev box or on-prem, so it keeps running
+                    if not self.executor:
+                        await self.core.run(self.terminate_self)
+                    break
+                delay = poller.next_delay(active)
+            except Exception as e:
+                logger.error(f"Error in control loop: {str(e)}", exc_info=True)
+                if not self.running:
+                    break
+                delay = poller.next_delay(False)
+            
+            # Wait before next check, waking early on instance or table events
+            await self.core.run(self.wait_for_events, delay)
+
+    def run_countries(self, country_codes):
+        """Process all locations for one or more countries from this process"""
         try:
-            logger.info(f"Starting dental practice scraper for country: {country_code}")
+            logger.info(f"Starting dental practice scraper for: {', '.join(country_codes)}")
             logger.info("Testing AWS permissions...")
             
             # Test DynamoDB access
             try:
-                stats = self.get_location_stats(country_code)
-                logger.info(f"Successfully accessed DynamoDB. Found {stats['total']} locations")
+                for country_code in country_codes:
+                    stats = self.get_location_stats(country_code)
+                    logger.info(f"Successfully accessed DynamoDB. Found {stats['total']} locations "
+                                f"in {country_code}")
             except Exception as e:
                 logger.error(f"Failed to access DynamoDB: {str(e)}", exc_info=True)
                 return
             
             # Test EC2 access
             try:
-                instances = self.get_running_instances()
-                logger.info(f"Successfully accessed EC2. Found {len(instances)} running instances")
+                instances = self.get_workers()
+                if not self.executor:
+                    logger.info(f"Successfully accessed EC2. Found {len(instances)} running instances")
             except Exception as e:
                 logger.error(f"Failed to access EC2: {str(e)}", exc_info=True)
                 return
             
-            consecutive_complete_checks = 0
-            while self.running:
-                try:
-                    # Get current stats
-                    stats = self.get_location_stats(country_code)
-                    logger.info(f"Country {country_code} progress: "
-                            f"{stats['complete']}/{stats['total']} complete, "
-                            f"{stats['in_progress']} in progress, "
-                            f"{stats['stopped']} stopped")
-                    
-                    # Check if all locations are complete
-                    if stats['complete'] == stats['total']:
-                        # Wait for a few cycles to ensure everything is really done
-                        consecutive_complete_checks += 1
-                        if consecutive_complete_checks >= 3:  # Wait for 3 consecutive checks
-                            logger.info(f"All locations in {country_code} have been processed!")
-                            # Double check no instances are running
-                            running_instances = self.get_running_instances()
-                            if not running_instances:
-                                self.terminate_self()
-                                break
-                            else:
-                                logger.info(f"Waiting for {len(running_instances)} instances to terminate")
-                                consecutive_complete_checks = 0  # Reset counter
-                    else:
-                        consecutive_complete_checks = 0  # Reset counter if not all complete
-                    
-                    # Get current running instances
-                    running_instances = self.get_running_instances()
-                    available_slots = self.CONFIG['max_instances'] - len(running_instances)
-                    logger.info(f"Running instances: {len(running_instances)}, Available slots: {available_slots}")
-                    
-                    if available_slots > 0:
-                        # Get INACTIVE locations
-                        inactive_locations = self.get_inactive_locations(country_code)
-                        if inactive_locations:
-                            logger.info(f"Found {len(inactive_locations)} inactive locations")
-                            
-                            # Launch new instances up to the limit
-                            for location in inactive_locations[:available_slots]:
-                                location_name = location['location_name']['S']
-                                try:
-                                    instance_id = self.launch_instance(country_code, location_name)
-                                    logger.info(f"Launched instance {instance_id} for {location_name}")
-                                except Exception as e:
-                                    logger.error(f"Failed to launch instance for {location_name}: {str(e)}", exc_info=True)
-                    
-                    # Wait before next check
-                    time.sleep(30)
-                    
-                except Exception as e:
-                    logger.error(f"Error in control loop: {str(e)}", exc_info=True)
-                    if not self.running:
-                        break
-                    time.sleep(30)
+            self.metrics.start()
+            asyncio.run(self.run_countries_async(country_codes))
             
         except Exception as e:
-            logger.error(f"Fatal error in run_country: {str(e)}", exc_info=True)
+            logger.error(f"Fatal error in run_countries: {str(e)}", exc_info=True)
+        finally:
+            self.core.shutdown()
+            self.metrics.close()
         
-        logger.info(f"Finished processing country: {country_code}")
+        logger.info(f"Finished processing: {', '.join(country_codes)}")
+
+    def run_country(self, country_code):
+        """Process all locations for a country"""
+        self.run_countries([country_code])
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python3 task_runner_ec2.py <country_code>")
-        print("Example: python3 task_runner_ec2.py UK")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Launch scraper instances for every location in a country",
+        epilog="Example: python3 task_runner_ec2.py UK FR --priority UK=2 --quota FR=10"
+    )
+    parser.add_argument('country_codes', nargs='+', help="Countries to process, e.g. UK")
+    parser.add_argument('--priority', action='append', default=[], metavar='COUNTRY=WEIGHT',
+                        help="Fair-share weight for a country's slots (default 1)")
+    parser.add_argument('--quota', action='append', default=[], metavar='COUNTRY=MAX',
+                        help="Maximum running instances for a country")
+    parser.add_argument('--queue-mode', choices=['filter', 'index'], default='filter',
+                        help="Read INACTIVE work by filtering the country or from the pending index")
+    parser.add_argument('--shard', type=int, default=0,
+                        help="This controller's shard when several controllers share a country")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="Number of controllers sharing the country")
+    parser.add_argument('--worker-mode', choices=['single', 'drain'], default='single',
+                        help="Launch one worker per location, or workers that drain the queue")
+    parser.add_argument('--worker-sessions', type=int, default=None,
+                        help="Browser sessions per drain worker (default: sized to the instance)")
+    parser.add_argument('--image-id', default=None,
+                        help="Prebaked worker AMI, or 'latest' for the newest image_builder.py build")
+    parser.add_argument('--event-queue', default=None,
+                        help="SQS queue URL from controller_events.py to wake on instance/table events")
+    parser.add_argument('--subnets', default=None,
+                        help="Comma separated worker subnets, ideally one per availability zone")
+    parser.add_argument('--instance-types', default=None,
+                        help="Comma separated worker instance types in order of preference")
+    parser.add_argument('--warm-pool', action='store_true',
+                        help="Stop finished workers and resume them for new work instead of launching")
+    parser.add_argument('--warm-idle', type=int, default=None,
+                        help="Seconds a warm worker waits for more work before stopping (default 120)")
+    parser.add_argument('--executor', choices=['ec2', 'local'], default='ec2',
+                        help="Launch spot instances, or run workers on this machine and --local-host boxes")
+    parser.add_argument('--local-host', action='append', default=[], metavar='HOST[:CPUS:MEMORY_GB]',
+                        help="Host for local workers, 'localhost' or an ssh target with its size "
+                             "(default: localhost)")
+    parser.add_argument('--local-runtime', choices=['process', 'docker'], default='process',
+                        help="Run local workers as processes or as containers from the Dockerfile's image")
+    parser.add_argument('--autoscale', action='store_true',
+                        help="Size max_instances from backlog, duration, interruptions, budget and quota")
+    parser.add_argument('--hourly-budget', type=float, default=None,
+                        help="Autoscaler spend ceiling in dollars per hour (default 1.0)")
+    args = parser.parse_args()
+    if not 0 <= args.shard < args.shards:
+        parser.error("--shard must be between 0 and --shards - 1")
+    if args.executor == 'local' and (args.warm_pool or args.autoscale):
+        parser.error("--warm-pool and --autoscale only apply to EC2 workers")
+    try:
+        priorities = parse_country_settings(args.priority, float)
+        quotas = parse_country_settings(args.quota)
+        local_hosts = [parse_host(spec) for spec in args.local_host or ['localhost']]
+    except ValueError as e:
+        parser.error(str(e))
     
-    country_code = sys.argv[1].upper()
     runner = TaskRunner()
-    runner.run_country(country_code)
+    runner.CONFIG['queue_mode'] = args.queue_mode
+    runner.CONFIG['controller_shard'] = args.shard
+    runner.CONFIG['controller_shards'] = args.shards
+    runner.CONFIG['worker_mode'] = args.worker_mode
+    runner.CONFIG['worker_sessions'] = args.worker_sessions
+    runner.CONFIG['country_priorities'] = priorities
+    runner.CONFIG['country_quotas'] = quotas
+    if args.image_id == 'latest':
+        runner.CONFIG['image_id'] = find_latest_image(runner.ec2)
+        if runner.CONFIG['image_id'] is None:
+            logger.warning("No prebaked image found, bootstrapping the stock AMI")
+    else:
+        runner.CONFIG['image_id'] = args.image_id
+    if args.event_queue:
+        runner.event_source = SqsEventSource(args.event_queue)
+    if args.hourly_budget is not None:
+        runner.CONFIG['hourly_budget'] = args.hourly_budget
+    if args.subnets or args.instance_types:
+        if args.subnets:
+            runner.CONFIG['subnet_ids'] = args.subnets.split(',')
+        if args.instance_types:
+            runner.CONFIG['instance_types'] = args.instance_types.split(',')
+        runner.placement = PlacementEngine(runner.CONFIG['instance_types'], runner.CONFIG['subnet_ids'],
+                                           clock=runner.clock)
+    if args.warm_idle is not None:
+        runner.CONFIG['warm_idle_seconds'] = args.warm_idle
+    if args.warm_pool:
+        runner.enable_warm_pool()
+    if args.autoscale:
+        runner.enable_autoscaling()
+    if args.executor == 'local':
+        runner.enable_local_executor(local_hosts, args.local_runtime)
+    runner.run_countries([country_code.upper() for country_code in args.country_codes])
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import aws_backend
+from controller_events import LocalEventSource
+from simulator import Simulation
+from task_runner_ec2 import TaskRunner
+
+@pytest.fixture
+def sim():
+    """A simulated world with no random failures, installed as the AWS client factory"""
+    sim = Simulation(failure_rate=0, interruption_rate=0, duration_spread=0)
+    aws_backend.set_client_factory(sim.client)
+    yield sim
+    aws_backend.set_client_factory(None)
+
+@pytest.fixture
+def runner(sim):
+    """A controller on the simulation's clock, with five INACTIVE UK locations"""
+    sim.add_locations('UK', 5)
+    runner = TaskRunner(clock=sim.time)
+    runner.CONFIG['decision_log'] = None
+    runner.event_source = LocalEventSource()
+    sim.runner = runner
+    yield runner
+    runner.status_writer.close()
+    runner.core.shutdown()
@@ -0,0 +1,73 @@
+import json
+
+from autoscaler import Autoscaler, replay
+
+def observation(remaining=1000, **extra):
+    return dict({'remaining': remaining, 'interruption_rate': 0.0, 'new_interruptions': 0}, **extra)
+
+def test_limit_grows_multiplicatively():
+    autoscaler = Autoscaler()
+    limits = []
+    for _ in range(5):
+        autoscaler.limit, reason, _ = autoscaler.decide(observation())
+        limits.append(autoscaler.limit)
+    assert limits == [2, 3, 5, 8, 12]
+    assert reason == 'grow'
+
+def test_backlog_caps_the_limit():
+    autoscaler = Autoscaler()
+    autoscaler.limit = 8
+    assert autoscaler.decide(observation(remaining=10))[:2] == (10, 'capped by backlog')
+
+def test_drain_backlog_needs_min_worker_seconds_per_worker():
+    autoscaler = Autoscaler(min_worker_seconds=600)
+    autoscaler.limit = 20
+    # 100 locations of 60s over 2 sessions is 3000s of work, five workers' worth
+    caps = autoscaler.caps(observation(remaining=100, worker_mode='drain', mean_duration=60, sessions=2))
+    assert caps['backlog'] == 5
+
+def test_budget_and_quota_are_hard_caps():
+    autoscaler = Autoscaler(hourly_budget=1.0, spot_max_price=0.04, min_instances=10)
+    autoscaler.limit = 30
+    assert autoscaler.decide(observation())[:2] == (25, 'capped by budget')
+    # t3.medium has 2 vCPUs, and the minimum does not override the quota
+    assert autoscaler.decide(observation(vcpu_quota=8))[:2] == (4, 'capped by quota')
+
+def test_interruptions_cut_then_hold_the_limit():
+    autoscaler = Autoscaler()
+    autoscaler.limit = 10
+    limit, reason, _ = autoscaler.decide(observation(interruption_rate=0.5, new_interruptions=3))
+    assert (limit, reason) == (5, 'interruptions')
+    autoscaler.limit = limit
+    assert autoscaler.decide(observation(interruption_rate=0.5))[:2] == (5, 'holding for interruption rate')
+
+def test_interruption_rate_uses_the_sliding_window():
+    autoscaler = Autoscaler(window_seconds=3600, clock=lambda: 0)
+    autoscaler.record_launches(10, now=100)
+    autoscaler.record_interruptions(5, now=200)
+    assert autoscaler.interruption_rate(now=300) == 0.5
+    assert autoscaler.interruption_rate(now=3750) == 0.0
+
+def test_update_decides_once_per_interval():
+    now = [1000]
+    autoscaler = Autoscaler(interval=60, clock=lambda: now[0])
+    assert autoscaler.update(observation()) == 2
+    now[0] += 30
+    assert autoscaler.update(observation()) == 2
+    now[0] += 30
+    assert autoscaler.update(observation()) == 3
+
+def test_logged_decisions_replay_unchanged(tmp_path, capsys):
+    decision_log = tmp_path / 'decisions.jsonl'
+    now = [1000]
+    autoscaler = Autoscaler(decision_log=str(decision_log), clock=lambda: now[0])
+    for remaining in (100, 100, 4, 0):
+        autoscaler.update(observation(remaining=remaining))
+        now[0] += 60
+    records = [json.loads(line) for line in decision_log.read_text().splitlines()]
+    assert [record['limit'] for record in records] == [2, 3, 4, 0]
+
+    replay(str(decision_log), Autoscaler())
+    assert capsys.readouterr().out.strip().endswith('0/4 decisions differ')
+    replay(str(decision_log), Autoscaler(hourly_budget=0.08))
+    assert '2/4 decisions differ' in capsys.readouterr().out
@@ -0,0 +1,85 @@
+import pytest
+
+from checkpoint import CheckpointStore
+
+class RecordingSink:
+    """Result sink that records which locations were closed"""
+
+    def __init__(self):
+        self.closed = []
+
+    def close_location(self, country_code, location_name):
+        self.closed.append((country_code, location_name))
+
+@pytest.fixture
+def store(sim):
+    sim.add_locations('UK', 2)
+    sim.dynamodb.items[('UK', 'location-000000')]['status'] = {'S': 'IN_PROGRESS'}
+    return CheckpointStore(sim.dynamodb, interval=60, clock=sim.time)
+
+def item(sim, location_name):
+    return sim.dynamodb.items[('UK', location_name)]
+
+def test_a_new_location_starts_at_the_first_page(store):
+    checkpoint = store.load('UK', 'location-000000')
+    assert checkpoint.cursor == 0
+    assert not checkpoint.seen('item-1')
+
+def test_save_and_load_resume_mid_page(sim, store):
+    checkpoint = store.load('UK', 'location-000000')
+    checkpoint.emit('item-1')
+    checkpoint.advance(1)
+    checkpoint.emit('item-2')
+    assert store.save(checkpoint)
+    assert item(sim, 'location-000000')['checkpoint_cursor'] == {'N': '1'}
+    assert item(sim, 'location-000000')['checkpoint_items'] == {'SS': ['item-2']}
+
+    resumed = CheckpointStore(sim.dynamodb, clock=sim.time).load('UK', 'location-000000')
+    assert resumed.cursor == 1
+    assert resumed.seen('item-2')
+
+def test_saved_ids_stay_bounded_by_one_page(sim, store):
+    checkpoint = store.load('UK', 'location-000000')
+    for page in range(500):
+        for i in range(10):
+            checkpoint.emit(f'item-{page}-{i}')
+        checkpoint.advance(page + 1)
+        store.save(checkpoint)
+        assert 'checkpoint_items' not in item(sim, 'location-000000')
+    checkpoint.emit('item-500-0')
+    store.save(checkpoint)
+    assert item(sim, 'location-000000')['checkpoint_items'] == {'SS': ['item-500-0']}
+    assert checkpoint.seen('item-0-0')
+
+def test_save_skips_a_location_no_longer_in_progress(sim, store):
+    checkpoint = store.load('UK', 'location-000001')
+    checkpoint.advance(3)
+    assert not store.save(checkpoint)
+    assert 'checkpoint_cursor' not in item(sim, 'location-000001')
+
+def test_save_closes_the_result_object_first(sim):
+    sim.add_locations('UK', 1)
+    sim.dynamodb.items[('UK', 'location-000000')]['status'] = {'S': 'IN_PROGRESS'}
+    sink = RecordingSink()
+    store = CheckpointStore(sim.dynamodb, result_sink=sink, clock=sim.time)
+    assert store.save(store.load('UK', 'location-000000'))
+    assert sink.closed == [('UK', 'location-000000')]
+
+def test_maybe_save_waits_for_the_interval(sim, store):
+    checkpoint = store.load('UK', 'location-000000')
+    checkpoint.advance(1)
+    assert not store.maybe_save(checkpoint)
+    sim.now += 60
+    assert store.maybe_save(checkpoint)
+    assert item(sim, 'location-000000')['checkpoint_cursor'] == {'N': '1'}
+
+def test_save_all_covers_tracked_checkpoints_until_forgotten(sim, store):
+    checkpoint = store.load('UK', 'location-000000')
+    checkpoint.advance(2)
+    store.save_all()
+    assert item(sim, 'location-000000')['checkpoint_cursor'] == {'N': '2'}
+
+    store.forget(checkpoint)
+    checkpoint.advance(4)
+    store.save_all()
+    assert item(sim, 'location-000000')['checkpoint_cursor'] == {'N': '2'}
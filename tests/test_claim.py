@@ -0,0 +1,66 @@
+import pytest
+
+from simple_test import claim_next_location
+
+def item(sim, location_name):
+    return sim.dynamodb.items[('UK', location_name)]
+
+def test_claim_takes_an_inactive_location_once(sim, runner):
+    assert runner.claim_location('UK', 'location-000000')
+    claimed = item(sim, 'location-000000')
+    assert claimed['status'] == {'S': 'IN_PROGRESS'}
+    assert claimed['owner'] == {'S': runner.controller_id}
+    assert claimed['lease_expires'] == {'N': str(int(sim.now) + runner.CONFIG['lease_seconds'])}
+    assert 'pending_shard' not in claimed
+    assert not runner.claim_location('UK', 'location-000000')
+
+def test_claim_waits_for_retry_after(sim, runner):
+    item(sim, 'location-000001')['retry_after'] = {'N': str(int(sim.now) + 300)}
+    assert not runner.claim_location('UK', 'location-000001')
+    sim.now += 300
+    assert runner.claim_location('UK', 'location-000001')
+
+def test_a_location_a_worker_claimed_is_not_claimed_again(sim, runner):
+    assert claim_next_location(sim.dynamodb, 'UK', 'worker-a', clock=sim.time)
+    claimed = next(name for (_, name), row in sim.dynamodb.items.items()
+                   if row['status']['S'] == 'IN_PROGRESS')
+    assert not runner.claim_location('UK', claimed)
+    assert item(sim, claimed)['owner'] == {'S': 'worker-a'}
+
+def test_release_puts_the_location_back_in_the_queue(sim, runner):
+    assert runner.claim_location('UK', 'location-000002')
+    runner.release_location('UK', 'location-000002')
+    released = item(sim, 'location-000002')
+    assert released['status'] == {'S': 'INACTIVE'}
+    assert 'pending_shard' in released
+    assert runner.claim_location('UK', 'location-000002')
+
+@pytest.mark.parametrize('queue_mode', ['filter', 'index'])
+def test_workers_drain_every_location_exactly_once(sim, queue_mode):
+    sim.add_locations('UK', 25)
+    claimed = []
+    while True:
+        location_name = claim_next_location(sim.dynamodb, 'UK', f'worker-{len(claimed) % 3}',
+                                            queue_mode, clock=sim.time)
+        if location_name is None:
+            break
+        claimed.append(location_name)
+    assert sorted(claimed) == sorted(name for _, name in sim.dynamodb.items)
+    assert all(row['status'] == {'S': 'IN_PROGRESS'} for row in sim.dynamodb.items.values())
+
+def test_worker_claim_skips_locations_backing_off(sim):
+    sim.add_locations('UK', 1)
+    item(sim, 'location-000000')['retry_after'] = {'N': str(int(sim.now) + 60)}
+    assert claim_next_location(sim.dynamodb, 'UK', 'worker-a', clock=sim.time) is None
+    sim.now += 60
+    assert claim_next_location(sim.dynamodb, 'UK', 'worker-a', clock=sim.time) == 'location-000000'
+
+def test_worker_claim_records_the_queue_wait(sim):
+    sim.add_locations('UK', 1)
+    sim.now += 45
+    timings = {}
+    claim_next_location(sim.dynamodb, 'UK', 'worker-a', timings=timings, clock=sim.time)
+    assert timings == {'queue_wait': 45}
+    claimed = item(sim, 'location-000000')
+    assert claimed['started_at'] == {'N': str(int(sim.now))}
+    assert 'pending_shard' not in claimed
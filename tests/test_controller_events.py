@@ -0,0 +1,56 @@
+import json
+import time
+import threading
+
+from controller_events import AdaptivePoller, LocalEventSource, parse_event
+
+def test_poller_doubles_while_idle_up_to_max():
+    poller = AdaptivePoller(min_interval=2, max_interval=10, jitter=0)
+    assert [poller.next_delay(False) for _ in range(4)] == [4, 8, 10, 10]
+
+def test_poller_resets_when_a_tick_does_something():
+    poller = AdaptivePoller(min_interval=2, max_interval=10, jitter=0)
+    poller.next_delay(False)
+    poller.next_delay(False)
+    assert poller.next_delay(True) == 2
+
+def test_poller_jitter_stays_within_bounds():
+    poller = AdaptivePoller(min_interval=10, max_interval=10, jitter=0.2)
+    delays = [poller.next_delay(True) for _ in range(100)]
+    assert all(8 <= delay <= 12 for delay in delays)
+    assert len(set(delays)) > 1
+
+def test_local_source_returns_every_ready_event():
+    source = LocalEventSource()
+    source.publish({'source': 'ec2'})
+    source.publish({'source': 'dynamodb'})
+    assert source.wait(1) == [{'source': 'ec2'}, {'source': 'dynamodb'}]
+    assert source.wait(0) == []
+
+def test_local_source_wakes_on_publish():
+    source = LocalEventSource()
+    threading.Timer(0.05, source.publish, [{'source': 'ec2'}]).start()
+    started = time.monotonic()
+    assert source.wait(5) == [{'source': 'ec2'}]
+    assert time.monotonic() - started < 1
+
+def test_parse_ec2_state_change():
+    event = parse_event(json.dumps({
+        'source': 'aws.ec2',
+        'detail-type': 'EC2 Instance State-change Notification',
+        'detail': {'instance-id': 'i-1', 'state': 'terminated'}
+    }))
+    assert event == {'source': 'ec2', 'type': 'EC2 Instance State-change Notification',
+                     'instance_id': 'i-1', 'state': 'terminated'}
+
+def test_parse_table_change():
+    event = parse_event(json.dumps({
+        'eventSource': 'aws:dynamodb',
+        'eventName': 'MODIFY',
+        'dynamodb': {
+            'Keys': {'country_code': {'S': 'UK'}, 'location_name': {'S': 'london'}},
+            'NewImage': {'status': {'S': 'COMPLETE'}}
+        }
+    }))
+    assert event == {'source': 'dynamodb', 'type': 'MODIFY', 'country_code': 'UK',
+                     'location_name': 'london', 'status': 'COMPLETE'}
@@ -0,0 +1,100 @@
+import pytest
+import requests
+
+from fetcher import EngineDetector, PageFetcher, needs_browser, visible_text_length
+from page_cache import LocalCacheBackend
+
+ARTICLE = '<html><body><p>' + 'Opening hours and prices. ' * 20 + '</p></body></html>'
+SCRIPT_SHELL = '<html><body><div id="app"></div><script src="/app.js"></script></body></html>'
+
+def response(body, status=200, content_type='text/html; charset=utf-8', **headers):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body.encode('utf-8')
+    response.headers.update(dict(headers, **{'Content-Type': content_type}))
+    response.url = 'https://example.com/'
+    return response
+
+class Site:
+    """HTTP session serving one response per URL"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests.append(url)
+        return self.pages[url]
+
+class Driver:
+    page_source = '<html>rendered</html>'
+
+    def __init__(self):
+        self.visited = []
+
+    def get(self, url):
+        self.visited.append(url)
+
+def test_visible_text_ignores_scripts_and_tags():
+    assert visible_text_length('<p>a  b</p><script>var x = 1;</script><style>p {}</style>') == 3
+
+@pytest.mark.parametrize('page, reason', [
+    (response(ARTICLE), None),
+    (response(SCRIPT_SHELL), 'page is rendered by scripts'),
+    (response('<p>Please enable JavaScript</p>' + ARTICLE), '"enable javascript" in page'),
+    (response(ARTICLE, status=503), 'status 503'),
+    (response('{"a": 1}', content_type='application/json'), None),
+])
+def test_needs_browser(page, reason):
+    assert needs_browser(page) == reason
+
+def test_domain_moves_to_the_browser_after_min_samples_and_back_after_a_probe():
+    detector = EngineDetector(min_samples=2, recheck_every=3)
+    url = 'https://Example.com/page'
+    detector.record(url, 'browser')
+    assert detector.engine_for(url) == 'http'
+    detector.record(url, 'browser')
+    assert [detector.engine_for(url) for _ in range(3)] == ['browser', 'browser', 'http']
+    detector.record(url, 'http')
+    assert detector.engine_for('https://example.com/other') == 'http'
+
+def test_engine_choices_merge_through_the_backend(tmp_path):
+    backend = LocalCacheBackend(str(tmp_path))
+    first, second = EngineDetector(backend), EngineDetector(backend)
+    first.record('https://a.com/', 'browser')
+    second.record('https://a.com/', 'browser')
+    second.record('https://b.com/', 'http')
+    first.save()
+    second.save()
+    loaded = EngineDetector(backend).load()
+    assert loaded.domains['a.com'] == {'http': 0, 'browser': 2, 'last': 'browser'}
+    assert loaded.engine_for('https://a.com/x') == 'browser'
+    assert loaded.engine_for('https://b.com/x') == 'http'
+
+def test_static_pages_never_start_chrome():
+    site = Site({'https://example.com/': response(ARTICLE, ETag='"v1"')})
+    fetcher = PageFetcher(session=site)
+    html, engine, etag, _ = fetcher.fetch('https://example.com/', get_driver=pytest.fail)
+    assert (html, engine, etag) == (ARTICLE, 'http', '"v1"')
+    assert fetcher.stats() == {'http': 1, 'browser': 0}
+
+def test_script_rendered_pages_fall_back_to_chrome_and_are_learned():
+    site = Site({'https://example.com/': response(SCRIPT_SHELL)})
+    driver = Driver()
+    fetcher = PageFetcher(EngineDetector(min_samples=1), session=site)
+    assert fetcher.fetch('https://example.com/', lambda: driver)[:2] == ('<html>rendered</html>', 'browser')
+    fetcher.fetch('https://example.com/', lambda: driver)
+    # The second page went straight to Chrome
+    assert site.requests == ['https://example.com/']
+    assert driver.visited == ['https://example.com/', 'https://example.com/']
+    assert fetcher.stats() == {'http': 0, 'browser': 2}
+
+def test_http_mode_refuses_pages_that_need_a_browser():
+    fetcher = PageFetcher(mode='http', session=Site({'https://example.com/': response(SCRIPT_SHELL)}))
+    with pytest.raises(ValueError):
+        fetcher.fetch('https://example.com/', get_driver=pytest.fail)
+
+def test_http_errors_fail_rather_than_scrape_the_error_page():
+    fetcher = PageFetcher(session=Site({'https://example.com/': response(ARTICLE, status=404)}))
+    with pytest.raises(requests.HTTPError):
+        fetcher.fetch('https://example.com/', get_driver=pytest.fail)
@@ -0,0 +1,155 @@
+import pytest
+
+from simple_test import (CLAIM_BACKOFF, CLAIM_ROUNDS, LeaseHeartbeat, claim_next_location, lease_owner,
+                         update_location_status)
+from status_writer import PENDING_SHARDS, StatusWriter, held_by
+
+@pytest.fixture
+def writer(sim):
+    writer = StatusWriter(sim.dynamodb, writes_per_second=1e9, clock=sim.time)
+    yield writer
+    writer.close()
+
+def heartbeat(sim, writer):
+    return LeaseHeartbeat(lease_seconds=600, status_writer=writer, clock=sim.time)
+
+def item(sim, location_name):
+    return sim.dynamodb.items[('UK', location_name)]
+
+def claim(sim, owner):
+    return claim_next_location(sim.dynamodb, 'UK', owner, clock=sim.time)
+
+def expire_and_reclaim(sim, runner, location_name, owner):
+    """The controller requeues an expired lease and another worker claims the location"""
+    sim.now += 700
+    runner.requeue_expired_lease('UK', item(sim, location_name))
+    sim.now += runner.CONFIG['retry_backoff']
+    for _ in range(5):
+        if claim(sim, owner) == location_name:
+            return
+    raise AssertionError(f"{owner} did not reclaim {location_name}")
+
+def test_beat_extends_the_owners_lease(sim, runner, writer):
+    location_name = claim(sim, 'worker-a')
+    lease = heartbeat(sim, writer)
+    lease.add('UK', location_name, 'worker-a')
+    sim.now += 60
+    lease.beat_all()
+    assert item(sim, location_name)['lease_expires'] == {'N': str(int(sim.now) + 600)}
+
+def test_requeued_location_is_claimable_after_backoff(sim, runner):
+    location_name = claim(sim, 'worker-a')
+    sim.now += 700
+    assert runner.requeue_expired_lease('UK', item(sim, location_name)) == 'INACTIVE'
+    requeued = item(sim, location_name)
+    assert 'owner' not in requeued and requeued['attempts'] == {'N': '1'}
+    assert lease_owner(sim.dynamodb, 'UK', location_name) is None
+
+def test_requeue_backoff_doubles_until_max_attempts_stops_the_location(sim, runner):
+    location_name = claim(sim, 'worker-a')
+    backoff = runner.CONFIG['retry_backoff']
+    for attempt in range(1, runner.CONFIG['max_attempts']):
+        sim.now += 700
+        assert runner.requeue_expired_lease('UK', item(sim, location_name)) == 'INACTIVE'
+        retry_after = int(item(sim, location_name)['retry_after']['N'])
+        assert retry_after == int(sim.now) + backoff * 2 ** (attempt - 1)
+        sim.now = retry_after
+        assert runner.claim_location('UK', location_name)
+    sim.now += 700
+    assert runner.requeue_expired_lease('UK', item(sim, location_name)) == 'STOPPED'
+    stopped = item(sim, location_name)
+    assert 'pending_shard' not in stopped and 'lease_expires' not in stopped
+
+def test_renewed_lease_is_not_requeued(sim, runner, writer):
+    location_name = claim(sim, 'worker-a')
+    seen = dict(item(sim, location_name))
+    lease = heartbeat(sim, writer)
+    lease.add('UK', location_name, 'worker-a')
+    sim.now += 60
+    lease.beat_all()
+    assert runner.requeue_expired_lease('UK', seen) is None
+    assert item(sim, location_name)['status'] == {'S': 'IN_PROGRESS'}
+
+def test_stale_worker_cannot_extend_a_new_claim(sim, runner, writer):
+    location_name = claim(sim, 'worker-a')
+    stale = heartbeat(sim, writer)
+    stale.add('UK', location_name, 'worker-a')
+    expire_and_reclaim(sim, runner, location_name, 'worker-b')
+    lease_expires = item(sim, location_name)['lease_expires']
+    sim.now += 60
+    stale.beat_all()
+    assert item(sim, location_name)['lease_expires'] == lease_expires
+    assert not stale.locations
+
+def test_stale_worker_cannot_release_a_new_claim(sim, runner, writer):
+    location_name = claim(sim, 'worker-a')
+    stale = heartbeat(sim, writer)
+    with stale.lock:
+        # Added without beating, as if the lease was lost between beats
+        stale.locations[('UK', location_name)] = 'worker-a'
+    expire_and_reclaim(sim, runner, location_name, 'worker-b')
+    stale.release_all('Spot interruption')
+    reclaimed = item(sim, location_name)
+    assert reclaimed['status'] == {'S': 'IN_PROGRESS'}
+    assert reclaimed['owner'] == {'S': 'worker-b'}
+
+def test_release_hands_the_location_back(sim, writer):
+    sim.add_locations('UK', 1)
+    location_name = claim(sim, 'worker-a')
+    lease = heartbeat(sim, writer)
+    lease.add('UK', location_name, 'worker-a')
+    lease.release_all('Spot interruption')
+    released = item(sim, location_name)
+    assert released['status'] == {'S': 'INACTIVE'}
+    assert 'owner' not in released and 'pending_shard' in released
+    assert claim(sim, 'worker-b') == location_name
+
+def test_stale_worker_cannot_finish_a_new_claim(sim, runner, writer):
+    location_name = claim(sim, 'worker-a')
+    expire_and_reclaim(sim, runner, location_name, 'worker-b')
+    writer.update('UK', location_name, 'COMPLETE', condition=held_by('worker-a'))
+    assert writer.flush() == 0
+    assert item(sim, location_name)['status'] == {'S': 'IN_PROGRESS'}
+    writer.update('UK', location_name, 'COMPLETE', condition=held_by('worker-b'))
+    assert writer.flush() == 1
+    assert item(sim, location_name)['status'] == {'S': 'COMPLETE'}
+
+def test_lease_owner_of_an_assigned_location(sim, runner):
+    assert runner.claim_location('UK', 'location-000003')
+    assert lease_owner(sim.dynamodb, 'UK', 'location-000003') == runner.controller_id
+    assert lease_owner(sim.dynamodb, 'UK', 'location-000004') is None
+
+class StaleIndex:
+    """DynamoDB whose pending index keeps listing a location after it was claimed"""
+
+    def __init__(self, dynamodb):
+        self.dynamodb = dynamodb
+        self.exceptions = dynamodb.exceptions
+        self.queries = 0
+
+    def query(self, **kwargs):
+        self.queries += 1
+        return {'Items': [{'location_name': {'S': 'location-000000'}}]}
+
+    def update_item(self, **kwargs):
+        return self.dynamodb.update_item(**kwargs)
+
+def test_claim_gives_up_when_every_candidate_is_taken(sim, monkeypatch):
+    sim.add_locations('UK', 1)
+    assert claim(sim, 'worker-a') == 'location-000000'
+    sleeps = []
+    monkeypatch.setattr('simple_test.time.sleep', sleeps.append)
+    stale = StaleIndex(sim.dynamodb)
+    assert claim_next_location(stale, 'UK', 'worker-b', 'index', clock=sim.time) is None
+    assert stale.queries == CLAIM_ROUNDS * PENDING_SHARDS
+    assert len(sleeps) == CLAIM_ROUNDS - 1
+    assert all(0 <= delay <= CLAIM_BACKOFF * 2 ** i for i, delay in enumerate(sleeps))
+
+def test_finished_at_comes_from_the_clock(sim, writer, monkeypatch):
+    sim.add_locations('UK', 1)
+    claim(sim, 'worker-a')
+    monkeypatch.setattr('simple_test._status_writer', writer)
+    sim.now += 90
+    update_location_status('UK', 'location-000000', 'COMPLETE', owner='worker-a', clock=sim.time)
+    writer.flush()
+    assert item(sim, 'location-000000')['finished_at'] == {'N': str(int(sim.now))}
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from local_executor import CONTAINER_ENV, LocalExecutor, WorkerHost, host_slots, pack_workers, parse_host
+
+# Stands in for simple_test.py: runs until terminated, or exits with its first argument
+WORKER_SCRIPT = '''import sys, time
+if sys.argv[1].isdigit():
+    sys.exit(int(sys.argv[1]))
+time.sleep(60)
+'''
+
+def names(hosts):
+    return [host.name for host in hosts]
+
+@pytest.fixture
+def executor(tmp_path):
+    (tmp_path / 'simple_test.py').write_text(WORKER_SCRIPT)
+    executor = LocalExecutor([WorkerHost('localhost', 2, 4)], worker_dir=str(tmp_path),
+                             log_dir=str(tmp_path / 'logs'))
+    yield executor
+    executor.terminate_instances(list(executor.workers))
+
+def test_parse_host():
+    host = parse_host('user@box:32:64')
+    assert (host.name, host.cpus, host.memory_gb, host.remote) == ('user@box', 32, 64.0, True)
+    local = parse_host('localhost')
+    assert not local.remote and local.cpus >= 1 and local.memory_gb >= 1
+    for spec in ('user@box', 'localhost:8'):
+        with pytest.raises(ValueError):
+            parse_host(spec)
+
+def test_host_slots_take_the_scarcer_resource():
+    host = WorkerHost('box', 8, 6)
+    assert host_slots(host, 0, 0, 1, 1.0) == 6
+    assert host_slots(host, 7, 0, 1, 1.0) == 1
+    assert host_slots(host, 8, 0, 1, 1.0) == 0
+
+def test_workers_fill_this_machine_before_remote_hosts():
+    local, remote = WorkerHost('localhost', 2, 4), WorkerHost('user@box', 8, 16)
+    assert names(pack_workers([remote, local], {}, 4, 1, 1.0)) == ['localhost', 'localhost',
+                                                                  'user@box', 'user@box']
+
+def test_workers_go_to_the_fullest_host_that_fits():
+    small, big = WorkerHost('user@small', 4, 8), WorkerHost('user@big', 16, 32)
+    used = {'user@small': (2, 2.0)}
+    assert names(pack_workers([big, small], used, 3, 1, 1.0)) == ['user@small', 'user@small', 'user@big']
+
+def test_packing_stops_when_every_host_is_full():
+    assert len(pack_workers([WorkerHost('user@box', 4, 2)], {}, 5, 1, 1.0)) == 2
+
+def test_worker_commands(tmp_path, monkeypatch):
+    for name in CONTAINER_ENV:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'eu-west-2')
+    local, remote = WorkerHost('localhost', 4, 8), WorkerHost('user@box', 4, 8)
+    docker = LocalExecutor([local], runtime='docker', worker_cpus=2, worker_memory_gb=1.5,
+                           log_dir=str(tmp_path))
+    assert docker.worker_command(local, 'local-1', ['UK', 'loc']) == [
+        'docker', 'run', '--rm', '--name', 'local-1', '--cpus', '2', '--memory', '1536m',
+        '-e', 'AWS_DEFAULT_REGION', 'dental-scraper-worker', 'UK', 'loc', '--worker-id', 'local-1']
+    command = docker.worker_command(remote, 'local-1', ['UK', 'loc'])
+    assert command[:4] == ['ssh', '-o', 'BatchMode=yes', 'user@box']
+    assert 'AWS_DEFAULT_REGION' not in command[4]
+
+    process = LocalExecutor([remote], worker_dir='/opt/worker', log_dir=str(tmp_path))
+    assert process.worker_command(remote, 'local-1', ['UK', 'loc'])[-1] == \
+        'python3 /opt/worker/simple_test.py UK loc --worker-id local-1'
+
+def test_workers_are_described_like_instances_and_use_host_slots(executor):
+    placed = executor.start_location_workers('UK', ['a', 'b', 'c'])
+    assert list(placed) == ['a', 'b']
+    assert executor.free_slots() == 0
+    instances = {instance['InstanceId']: instance for instance in executor.running_instances()}
+    tags = {tag['Key']: tag['Value'] for tag in instances[placed['a']]['Tags']}
+    assert tags == {'Purpose': 'dental-scraper', 'Country': 'UK', 'Name': 'dental-scraper-a',
+                    'Location': 'UK#a'}
+
+    executor.terminate_instances([placed['a']])
+    assert executor.free_slots() == 1
+    assert [instance['InstanceId'] for instance in executor.running_instances()] == [placed['b']]
+
+def test_exited_workers_are_reaped(executor, tmp_path):
+    worker_ids = executor.start_workers('UK', [['0']], [{}])
+    executor.workers[worker_ids[0]]['process'].wait(timeout=10)
+    assert executor.running_instances() == []
+    assert executor.free_slots() == 2
+    assert os.path.exists(tmp_path / 'logs' / f'{worker_ids[0]}.log')
@@ -0,0 +1,60 @@
+from log_tailer import LogTailer
+
+class ScriptedLogs:
+    """CloudWatch Logs client returning one scripted response per filter_log_events call"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def filter_log_events(self, **kwargs):
+        self.calls.append(kwargs)
+        return self.responses.pop(0) if self.responses else {'events': []}
+
+def event(event_id, timestamp, stream='i-1/user-data'):
+    return {'eventId': event_id, 'timestamp': timestamp, 'logStreamName': stream, 'message': event_id}
+
+def tailer(logs, lookback_ms=1000):
+    tailer = LogTailer(logs, 'group', ['i-1'], lookback_ms=lookback_ms)
+    tailer.cursor = 0
+    return tailer
+
+def test_poll_returns_new_events_in_timestamp_order_once():
+    logs = ScriptedLogs([
+        {'events': [event('b', 20), event('a', 10)]},
+        {'events': [event('a', 10), event('c', 30)]}
+    ])
+    tail = tailer(logs)
+    assert [e['eventId'] for e in tail.poll()] == ['a', 'b']
+    assert [e['eventId'] for e in tail.poll()] == ['c']
+    assert tail.cursor == 30
+
+def test_pages_are_followed():
+    logs = ScriptedLogs([
+        {'events': [event('a', 10)], 'nextToken': 'next'},
+        {'events': [event('b', 20)]}
+    ])
+    assert [e['eventId'] for e in tailer(logs).poll()] == ['a', 'b']
+    assert logs.calls[1]['nextToken'] == 'next'
+
+def test_old_events_are_forgotten_whatever_order_they_arrived_in():
+    # A newer event arriving first must not keep older ones remembered
+    logs = ScriptedLogs([
+        {'events': [event('new', 5000), event('old-1', 100), event('old-2', 200)]},
+        {'events': [event('newer', 7000)]}
+    ])
+    tail = tailer(logs)
+    tail.poll()
+    assert tail.seen == {'new'}
+    tail.poll()
+    assert tail.seen == {'newer'}
+    assert len(tail.expiry) == 1
+
+def test_memory_stays_bounded_over_a_long_tail():
+    responses = [{'events': [event(f'{poll}-{i}', poll * 1000 + (9 - i) * 100, f'i-1/stream-{i % 2}')
+                             for i in range(10)]} for poll in range(100)]
+    tail = tailer(ScriptedLogs(responses), lookback_ms=2000)
+    for _ in responses:
+        tail.poll()
+    assert len(tail.seen) <= 30
+    assert len(tail.expiry) == len(tail.seen)
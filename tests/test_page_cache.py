@@ -0,0 +1,126 @@
+import os
+
+import pytest
+
+from page_cache import LocalCacheBackend, PageCache, S3CacheBackend, cache_key, load_page
+
+class Response:
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+class Origin:
+    """HTTP session answering conditional GETs with 304 while the ETag matches"""
+
+    def __init__(self, etag='"v1"'):
+        self.etag = etag
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append(headers)
+        return Response(304 if headers.get('If-None-Match') == self.etag else 200)
+
+    def head(self, url, headers=None, **kwargs):
+        return Response(headers={'ETag': self.etag})
+
+class Driver:
+    def __init__(self, html):
+        self.page_source = html
+        self.visited = []
+
+    def get(self, url):
+        self.visited.append(url)
+
+@pytest.fixture
+def now():
+    return [1000.0]
+
+@pytest.fixture
+def origin():
+    return Origin()
+
+@pytest.fixture
+def cache(tmp_path, origin, now):
+    return PageCache(LocalCacheBackend(str(tmp_path)), ttl=100, max_age=1000, session=origin,
+                     clock=lambda: now[0])
+
+def test_cache_key_varies_only_with_headers_that_matter():
+    url = 'https://example.com/'
+    assert cache_key(url, {'User-Agent': 'a'}) == cache_key(url, {'user-agent': 'a', 'Cookie': 'x'})
+    assert cache_key(url, {'User-Agent': 'a'}) != cache_key(url, {'User-Agent': 'b'})
+
+def test_fresh_entries_are_served_without_asking_the_origin(cache, origin):
+    cache.store('https://example.com/', '<html>hi</html>', etag='"v1"')
+    assert cache.lookup('https://example.com/') == '<html>hi</html>'
+    assert origin.requests == []
+    assert cache.stats() == {'hits': 1, 'revalidated': 0, 'misses': 0}
+
+def test_stale_entries_are_revalidated(cache, origin, now):
+    cache.store('https://example.com/', '<html>hi</html>', etag='"v1"')
+    now[0] += 150
+    assert cache.lookup('https://example.com/') == '<html>hi</html>'
+    assert origin.requests == [{'If-None-Match': '"v1"'}]
+    # The 304 refreshed the entry, so it is fresh again
+    assert cache.lookup('https://example.com/') == '<html>hi</html>'
+    assert cache.stats() == {'hits': 1, 'revalidated': 1, 'misses': 0}
+
+def test_a_changed_page_is_a_miss(cache, origin, now):
+    cache.store('https://example.com/', '<html>hi</html>', etag='"v1"')
+    origin.etag = '"v2"'
+    now[0] += 150
+    assert cache.lookup('https://example.com/') is None
+
+def test_stale_entries_without_validators_are_misses(cache, origin, now):
+    cache.store('https://example.com/', '<html>hi</html>')
+    now[0] += 150
+    assert cache.lookup('https://example.com/') is None
+    assert origin.requests == []
+
+def test_entries_past_max_age_are_dropped(tmp_path, cache, now):
+    cache.store('https://example.com/', '<html>hi</html>', etag='"v1"')
+    now[0] += 1000
+    assert cache.lookup('https://example.com/') is None
+    assert os.listdir(tmp_path / 'meta') == []
+
+def test_identical_bodies_are_stored_once(tmp_path, cache):
+    cache.store('https://example.com/a', '<html>same</html>')
+    cache.store('https://example.com/b', '<html>same</html>')
+    assert len(os.listdir(tmp_path / 'meta')) == 2
+    assert len(os.listdir(tmp_path / 'bodies')) == 1
+
+def test_local_backend_evicts_least_recently_used(tmp_path):
+    backend = LocalCacheBackend(str(tmp_path))
+    cache = PageCache(backend, session=Origin())
+    for i, name in enumerate('ab'):
+        cache.store(f'https://example.com/{name}', name * 1000)
+        for kind in ('meta', 'bodies'):
+            for entry in os.listdir(tmp_path / kind):
+                if os.path.getmtime(tmp_path / kind / entry) > i:
+                    os.utime(tmp_path / kind / entry, (i, i))
+    backend.max_bytes = backend.total_bytes
+
+    cache.store('https://example.com/c', 'c' * 1000)
+    assert backend.total_bytes <= backend.max_bytes
+    assert cache.lookup('https://example.com/a') is None
+    assert cache.lookup('https://example.com/c') == 'c' * 1000
+    # The evicted entry's body went with it
+    assert len(os.listdir(tmp_path / 'bodies')) == len(os.listdir(tmp_path / 'meta'))
+
+def test_s3_backend_round_trip(sim):
+    backend = S3CacheBackend(sim.client('s3'), 'cache', 'pages')
+    assert backend.get('meta', 'x.json') is None
+    assert not backend.exists('meta', 'x.json')
+    backend.put('meta', 'x.json', b'{}')
+    assert backend.exists('meta', 'x.json')
+    assert backend.get('meta', 'x.json') == b'{}'
+    backend.delete('meta', 'x.json')
+    assert backend.get('meta', 'x.json') is None
+
+def test_load_page_renders_once_then_serves_from_the_cache(cache):
+    driver = Driver('<html>rendered</html>')
+    assert load_page(lambda: driver, 'https://example.com/', cache) == ('<html>rendered</html>', 'browser')
+    assert load_page(lambda: driver, 'https://example.com/', cache) == ('<html>rendered</html>', 'cache')
+    assert driver.visited == ['https://example.com/']
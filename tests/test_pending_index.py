@@ -0,0 +1,93 @@
+import pytest
+
+from migrate_pending_index import PendingIndexMigration, missing_projection
+from status_writer import PENDING_INDEX_NAME, pending_shard_key
+
+class TableAdmin:
+    """describe_table/update_table over one table's index list, recording each update"""
+
+    def __init__(self, indexes=(), billing_mode='PAY_PER_REQUEST'):
+        self.indexes = list(indexes)
+        self.billing_mode = billing_mode
+        self.updates = []
+
+    def describe_table(self, TableName):
+        return {'Table': {
+            'GlobalSecondaryIndexes': list(self.indexes),
+            'BillingModeSummary': {'BillingMode': self.billing_mode},
+            'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+        }}
+
+    def update_table(self, TableName, GlobalSecondaryIndexUpdates, AttributeDefinitions=None):
+        self.updates.append(GlobalSecondaryIndexUpdates[0])
+        for update in GlobalSecondaryIndexUpdates:
+            if 'Create' in update:
+                self.indexes.append(dict(update['Create'], IndexStatus='CREATING'))
+            else:
+                self.indexes = [index for index in self.indexes
+                                if index['IndexName'] != update['Delete']['IndexName']]
+
+def pending_index(projection):
+    return {'IndexName': PENDING_INDEX_NAME, 'IndexStatus': 'ACTIVE', 'Projection': projection}
+
+@pytest.fixture
+def migration(sim):
+    return PendingIndexMigration()
+
+def item(sim, location_name):
+    return sim.dynamodb.items[('UK', location_name)]
+
+def test_missing_projection():
+    assert missing_projection({'Projection': {'ProjectionType': 'ALL'}}) == []
+    assert missing_projection({'Projection': {'ProjectionType': 'KEYS_ONLY'}}) == ['retry_after']
+    assert missing_projection({'Projection': {'ProjectionType': 'INCLUDE',
+                                              'NonKeyAttributes': ['retry_after']}}) == []
+
+def test_create_index_adds_the_sparse_index(migration):
+    migration.dynamodb = TableAdmin()
+    migration.create_index()
+    created = migration.dynamodb.updates[0]['Create']
+    assert created['IndexName'] == PENDING_INDEX_NAME
+    assert created['KeySchema'][0] == {'AttributeName': 'pending_shard', 'KeyType': 'HASH'}
+    assert created['Projection']['NonKeyAttributes'] == ['retry_after']
+    assert 'ProvisionedThroughput' not in created
+
+def test_create_index_copies_provisioned_throughput(migration):
+    migration.dynamodb = TableAdmin(billing_mode='PROVISIONED')
+    migration.create_index()
+    created = migration.dynamodb.updates[0]['Create']
+    assert created['ProvisionedThroughput'] == {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+
+def test_create_index_leaves_a_complete_index_alone(migration):
+    migration.dynamodb = TableAdmin([pending_index({'ProjectionType': 'ALL'})])
+    migration.create_index()
+    assert migration.dynamodb.updates == []
+
+def test_an_index_without_retry_after_needs_recreate(migration):
+    migration.dynamodb = TableAdmin([pending_index({'ProjectionType': 'KEYS_ONLY'})])
+    with pytest.raises(RuntimeError):
+        migration.create_index()
+    assert migration.dynamodb.updates == []
+
+    migration.recreate = True
+    migration.create_index()
+    assert [list(update) for update in migration.dynamodb.updates] == [['Delete'], ['Create']]
+
+def test_backfill_indexes_inactive_rows_only(sim, migration):
+    sim.add_locations('UK', 3)
+    del item(sim, 'location-000000')['pending_shard']
+    item(sim, 'location-000001')['status'] = {'S': 'IN_PROGRESS'}
+
+    counts = migration.backfill(['UK'])
+    assert counts == {'scanned': 3, 'added': 1, 'removed': 1, 'skipped': 0}
+    assert item(sim, 'location-000000')['pending_shard'] == {'S': pending_shard_key('UK', 'location-000000')}
+    assert 'pending_shard' not in item(sim, 'location-000001')
+    assert migration.backfill(['UK'])['added'] == 0
+
+def test_backfill_dry_run_writes_nothing(sim):
+    sim.add_locations('UK', 2)
+    del item(sim, 'location-000000')['pending_shard']
+    counts = PendingIndexMigration(dry_run=True).backfill(['UK'])
+    assert counts['added'] == 1
+    assert 'pending_shard' not in item(sim, 'location-000000')
+    assert sim.api_calls['dynamodb.UpdateItem'] == 0
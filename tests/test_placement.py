@@ -0,0 +1,63 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from placement import PlacementEngine, classify_launch_error
+
+def launch_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'RunInstances')
+
+@pytest.mark.parametrize('code, kind', [
+    ('InsufficientInstanceCapacity', 'capacity'),
+    ('SpotCapacityNotAvailable', 'capacity'),
+    ('InsufficientFreeAddressesInSubnet', 'subnet'),
+    ('SpotMaxPriceTooLow', 'price'),
+    ('MaxSpotInstanceCountExceeded', 'quota'),
+    ('VcpuLimitExceeded', 'quota'),
+    ('UnauthorizedOperation', None)
+])
+def test_classify_launch_error(code, kind):
+    assert classify_launch_error(launch_error(code)) == kind
+
+def test_classify_non_client_error():
+    assert classify_launch_error(ValueError('bad')) is None
+
+def engine():
+    return PlacementEngine(['t3.medium', 't3a.medium'], ['subnet-a', 'subnet-b'],
+                           capacity_cooldown=100, price_cooldown=200, quota_cooldown=300, clock=lambda: 1000)
+
+def test_capacity_error_cools_down_one_placement():
+    placement = engine()
+    placement.record_failure(('t3.medium', 'subnet-a'), 'capacity')
+    assert ('t3.medium', 'subnet-a') not in placement.candidates()
+    assert len(placement.candidates()) == 3
+    assert len(placement.candidates(now=1100)) == 4
+
+def test_subnet_error_cools_down_every_type_in_the_subnet():
+    placement = engine()
+    placement.record_failure(('t3.medium', 'subnet-a'), 'subnet')
+    assert placement.candidates() == [('t3.medium', 'subnet-b'), ('t3a.medium', 'subnet-b')]
+
+def test_price_error_cools_down_the_type_everywhere():
+    placement = engine()
+    placement.record_failure(('t3.medium', 'subnet-a'), 'price')
+    assert placement.candidates() == [('t3a.medium', 'subnet-a'), ('t3a.medium', 'subnet-b')]
+
+def test_quota_error_stops_all_launches_until_it_expires():
+    placement = engine()
+    placement.record_failure(('t3.medium', 'subnet-a'), 'quota')
+    assert not placement.available()
+    assert placement.next_available_at() == 1300
+
+def test_cooldown_doubles_and_resets_on_success():
+    placement = engine()
+    for _ in range(2):
+        placement.record_failure(('t3.medium', 'subnet-a'), 'capacity')
+    assert placement.blocked_until[('t3.medium', 'subnet-a')] == 1200
+    placement.record_success(('t3.medium', 'subnet-a'), now=1300)
+    placement.record_failure(('t3.medium', 'subnet-a'), 'capacity')
+    assert placement.blocked_until[('t3.medium', 'subnet-a')] == 1100
+
+def test_last_successful_placement_is_tried_first():
+    placement = engine()
+    placement.record_success(('t3a.medium', 'subnet-b'))
+    assert placement.candidates()[0] == ('t3a.medium', 'subnet-b')
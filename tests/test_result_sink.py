@@ -0,0 +1,117 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from result_sink import (MIN_PART_SIZE, LocalBackend, ResultSink, S3Backend, S3ObjectWriter,
+                         backend_from_url)
+
+class MultipartS3:
+    """S3 client recording multipart uploads and put_object calls"""
+
+    def __init__(self):
+        self.calls = []
+        self.parts = []
+
+    def create_multipart_upload(self, **kwargs):
+        self.calls.append('create')
+        return {'UploadId': 'upload-1'}
+
+    def upload_part(self, PartNumber, Body, **kwargs):
+        self.calls.append('part')
+        self.parts.append(len(Body))
+        return {'ETag': f'etag-{PartNumber}'}
+
+    def complete_multipart_upload(self, MultipartUpload, **kwargs):
+        self.calls.append('complete')
+        self.completed = MultipartUpload['Parts']
+
+    def abort_multipart_upload(self, **kwargs):
+        self.calls.append('abort')
+
+    def put_object(self, **kwargs):
+        self.calls.append('put')
+
+def objects(root):
+    return sorted(os.path.relpath(os.path.join(path, name), root)
+                  for path, _, names in os.walk(root) for name in names)
+
+def read_records(root, key):
+    with gzip.open(os.path.join(root, key)) as f:
+        return [json.loads(line) for line in f]
+
+@pytest.fixture
+def sink(tmp_path):
+    sink = ResultSink(LocalBackend(str(tmp_path)), worker_id='w1')
+    yield sink
+    sink.close()
+
+def test_records_are_visible_once_the_location_closes(tmp_path, sink):
+    sink.write('UK', 'loc 1', {'item_id': 'a'})
+    sink.write('UK', 'loc 1', {'item_id': 'b'})
+    assert objects(tmp_path) == ['country=UK/location=loc%201/w1-000001.ndjson.gz.partial']
+
+    key = sink.close_location('UK', 'loc 1')
+    assert key == 'country=UK/location=loc%201/w1-000001.ndjson.gz'
+    assert objects(tmp_path) == [key]
+    assert read_records(tmp_path, key) == [{'item_id': 'a'}, {'item_id': 'b'}]
+    assert sink.close_location('UK', 'loc 1') is None
+
+def test_a_full_object_rolls_over(tmp_path):
+    sink = ResultSink(LocalBackend(str(tmp_path)), worker_id='w1', max_object_bytes=40)
+    for i in range(4):
+        sink.write('UK', 'loc', {'item_id': f'item-{i}', 'padding': 'x' * 10})
+    sink.close()
+    keys = objects(tmp_path)
+    assert len(keys) == 4
+    assert [read_records(tmp_path, key)[0]['item_id'] for key in keys] == [f'item-{i}' for i in range(4)]
+
+def test_abort_drops_the_open_object(tmp_path, sink):
+    sink.write('UK', 'loc', {'item_id': 'a'})
+    sink.abort_location('UK', 'loc')
+    assert objects(tmp_path) == []
+    sink.write('UK', 'loc', {'item_id': 'b'})
+    key = sink.close_location('UK', 'loc')
+    assert read_records(tmp_path, key) == [{'item_id': 'b'}]
+
+def test_close_makes_every_location_durable(tmp_path, sink):
+    sink.write('UK', 'a', {'item_id': 1})
+    sink.write('IE', 'b', {'item_id': 2})
+    sink.close()
+    assert [key.split('/')[0] for key in objects(tmp_path)] == ['country=IE', 'country=UK']
+
+def test_small_objects_are_one_put(sim):
+    backend = S3Backend(sim.client('s3'), 'bucket', '/results/')
+    sink = ResultSink(backend, worker_id='w1')
+    sink.write('UK', 'loc', {'item_id': 'a'})
+    key = sink.close_location('UK', 'loc')
+    body = sim.client('s3').objects[('bucket', f'results/{key}')]
+    assert json.loads(gzip.decompress(body)) == {'item_id': 'a'}
+    assert backend.describe(key) == f's3://bucket/results/{key}'
+
+def test_large_objects_upload_in_parts():
+    s3 = MultipartS3()
+    writer = S3ObjectWriter(s3, 'bucket', 'key', part_size=1)
+    assert writer.part_size == MIN_PART_SIZE
+    writer.write(b'x' * MIN_PART_SIZE)
+    writer.write(b'y' * 10)
+    writer.close()
+    assert s3.calls == ['create', 'part', 'part', 'complete']
+    assert s3.parts == [MIN_PART_SIZE, 10]
+    assert [part['PartNumber'] for part in s3.completed] == [1, 2]
+
+def test_abort_cancels_a_multipart_upload():
+    s3 = MultipartS3()
+    writer = S3ObjectWriter(s3, 'bucket', 'key', part_size=MIN_PART_SIZE)
+    writer.write(b'x' * MIN_PART_SIZE)
+    writer.abort()
+    assert s3.calls == ['create', 'part', 'abort']
+
+def test_backend_from_url(tmp_path):
+    assert isinstance(backend_from_url(f'file://{tmp_path}'), LocalBackend)
+    assert isinstance(backend_from_url(str(tmp_path)), LocalBackend)
+    backend = backend_from_url('s3://bucket/prefix', s3=MultipartS3())
+    assert (backend.bucket, backend.prefix) == ('bucket', 'prefix')
+    with pytest.raises(ValueError):
+        backend_from_url('gs://bucket/prefix')
@@ -0,0 +1,22 @@
+from scheduler import allocate_slots
+
+def test_equal_priorities_share_evenly():
+    assert allocate_slots(4, {'UK': 10, 'FR': 10}, {}) == {'UK': 2, 'FR': 2}
+
+def test_slots_even_out_running_instances():
+    assert allocate_slots(4, {'UK': 10, 'FR': 10}, {'UK': 3}) == {'UK': 0, 'FR': 4}
+
+def test_priority_weights_the_share():
+    slots = allocate_slots(6, {'UK': 10, 'FR': 10}, {}, priorities={'UK': 2})
+    assert slots == {'UK': 4, 'FR': 2}
+
+def test_demand_caps_a_country_and_frees_slots_for_others():
+    assert allocate_slots(6, {'UK': 1, 'FR': 10}, {}) == {'UK': 1, 'FR': 5}
+
+def test_quota_counts_running_instances():
+    slots = allocate_slots(6, {'UK': 10, 'FR': 10}, {'UK': 2}, quotas={'UK': 3})
+    assert slots == {'UK': 1, 'FR': 5}
+
+def test_no_free_slots():
+    assert allocate_slots(0, {'UK': 10}, {}) == {'UK': 0}
+    assert allocate_slots(-2, {'UK': 10}, {}) == {'UK': 0}
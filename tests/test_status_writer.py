@@ -0,0 +1,54 @@
+import pytest
+
+from status_writer import StatusWriter, pending_shard_key
+
+@pytest.fixture
+def writer(sim):
+    sim.add_locations('UK', 3)
+    writer = StatusWriter(sim.dynamodb, writes_per_second=1e9, clock=sim.time)
+    yield writer
+    writer.close()
+
+def item(sim, location_name):
+    return sim.dynamodb.items[('UK', location_name)]
+
+def test_transitions_for_one_location_coalesce_into_one_write(sim, writer):
+    writer.update('UK', 'location-000000', 'IN_PROGRESS', started_at=100)
+    writer.update('UK', 'location-000000', 'COMPLETE', finished_at=200)
+    assert writer.flush() == 1
+    assert sim.api_calls['dynamodb.UpdateItem'] == 1
+    written = item(sim, 'location-000000')
+    assert written['status'] == {'S': 'COMPLETE'}
+    assert written['started_at'] == {'N': '100'}
+    assert written['finished_at'] == {'N': '200'}
+
+def test_later_attributes_win(sim, writer):
+    writer.update('UK', 'location-000000', 'STOPPED', 'first error')
+    writer.update('UK', 'location-000000', 'STOPPED', 'second error')
+    writer.flush()
+    assert item(sim, 'location-000000')['error_message'] == {'S': 'second error'}
+
+def test_each_location_is_written_once(sim, writer):
+    for location_name in ('location-000000', 'location-000001', 'location-000000'):
+        writer.update('UK', location_name, 'COMPLETE')
+    assert writer.flush() == 2
+    assert sim.api_calls['dynamodb.UpdateItem'] == 2
+    assert writer.flush() == 0
+
+def test_requeue_puts_the_location_back_in_the_pending_index(sim, writer):
+    writer.update('UK', 'location-000002', 'IN_PROGRESS')
+    writer.flush()
+    assert 'pending_shard' not in item(sim, 'location-000002')
+    sim.now += 60
+    writer.update('UK', 'location-000002', 'INACTIVE')
+    writer.flush()
+    requeued = item(sim, 'location-000002')
+    assert requeued['pending_shard'] == {'S': pending_shard_key('UK', 'location-000002')}
+    assert requeued['queued_at'] == {'N': str(int(sim.now))}
+
+def test_close_flushes_what_is_pending(sim):
+    sim.add_locations('UK', 1)
+    writer = StatusWriter(sim.dynamodb, writes_per_second=1e9, clock=sim.time)
+    writer.update('UK', 'location-000000', 'COMPLETE')
+    writer.close()
+    assert item(sim, 'location-000000')['status'] == {'S': 'COMPLETE'}
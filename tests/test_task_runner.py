@@ -0,0 +1,49 @@
+import asyncio
+
+def item(sim, location_name):
+    return sim.dynamodb.items[('UK', location_name)]
+
+def statuses(sim):
+    return sorted(item['status']['S'] for item in sim.dynamodb.items.values())
+
+def test_tick_launches_a_worker_per_free_slot(sim, runner):
+    outcomes = asyncio.run(runner.run_tick(['UK']))
+    stats, active, done = outcomes['UK']
+    assert active and not done
+    assert stats['total'] == 5
+    assert statuses(sim).count('IN_PROGRESS') == runner.CONFIG['max_instances']
+    workers = [instance for instance in sim.ec2.instances.values() if sim.is_worker(instance)]
+    assert len(workers) == runner.CONFIG['max_instances']
+
+def test_tick_with_no_free_slots_launches_nothing(sim, runner):
+    asyncio.run(runner.run_tick(['UK']))
+    launches = sim.launches
+    _, active, _ = asyncio.run(runner.run_tick(['UK']))['UK']
+    assert not active
+    assert sim.launches == launches
+
+def test_instance_event_refreshes_the_next_tick(sim, runner):
+    asyncio.run(runner.run_tick(['UK']))
+    runner.get_running_instances()
+    instance_id = next(instance['InstanceId'] for instance in sim.ec2.instances.values()
+                       if sim.is_worker(instance))
+    sim.ec2.terminate_instances(InstanceIds=[instance_id])
+    runner.event_source.publish({'source': 'ec2', 'type': 'EC2 Instance State-change Notification',
+                                 'instance_id': instance_id, 'state': 'shutting-down'})
+    events = runner.wait_for_events(5)
+    assert [event['instance_id'] for event in events] == [instance_id]
+    # Without the event the cached view would still count the old worker
+    _, active, _ = asyncio.run(runner.run_tick(['UK']))['UK']
+    assert active
+    assert sim.launches == runner.CONFIG['max_instances'] + 1
+
+def test_table_event_keeps_the_instance_view(sim, runner):
+    asyncio.run(runner.run_tick(['UK']))
+    cached = runner.instance_cache
+    runner.event_source.publish({'source': 'dynamodb', 'type': 'MODIFY', 'country_code': 'UK',
+                                 'location_name': 'location-000000', 'status': 'COMPLETE'})
+    assert len(runner.wait_for_events(5)) == 1
+    assert runner.instance_cache is cached
+
+def test_wait_without_events_times_out(runner):
+    assert runner.wait_for_events(0.01) == []
@@ -0,0 +1,116 @@
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tags a warm pool worker carries besides Purpose and Country
+WARM_POOL_TAG = 'WarmPool'
+WORKER_STATE_TAG = 'WorkerState'  # 'busy' while it has work, 'idle' while it waits for more
+IDLE_SINCE_TAG = 'IdleSince'  # Epoch seconds when the worker last ran out of work
+
+def instance_tags(instance):
+    return {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+
+def plan_evictions(stopped, keep, now, idle_timeout, idle_since):
+    """Stopped warm workers to terminate
+
+    Anything idle for idle_timeout goes, and of the rest only the keep
+    most recently idle stay, so the pool shrinks with the backlog.
+    idle_since gives the time an instance went idle.
+    """
+    by_age = sorted(stopped, key=idle_since)
+    expired = [instance for instance in by_age if now - idle_since(instance) >= idle_timeout]
+    fresh = [instance for instance in by_age if now - idle_since(instance) < idle_timeout]
+    return expired + fresh[:max(0, len(fresh) - keep)]
+
+class WarmPool:
+    """Stopped workers kept for reuse instead of launching new ones
+
+    Warm pool workers are persistent spot instances that stop rather than
+    terminate when their work runs out, after idling for a while in case
+    more turns up. Starting a stopped worker takes seconds, where a launch
+    plus bootstrap takes minutes, so the controller resumes these before
+    calling RunInstances. A persistent spot request would replace an
+    instance that is simply terminated, so eviction cancels the request first.
+    """
+
+    def __init__(self, ec2, idle_timeout=1800, cache_seconds=10, clock=time.time):
+        self.ec2 = ec2
+        self.idle_timeout = idle_timeout
+        self.cache_seconds = cache_seconds
+        self.cache = {}  # country code -> (fetched at, stopped instances)
+        self.first_seen = {}  # instance id -> when it was first seen stopped without an IdleSince tag
+        self.clock = clock
+
+    def invalidate(self):
+        self.cache = {}
+
+    def idle_since(self, instance):
+        """When a warm worker ran out of work
+
+        A worker stopped by a spot interruption never tagged itself idle,
+        so it counts from when the pool first saw it stopped.
+        """
+        try:
+            return int(instance_tags(instance)[IDLE_SINCE_TAG])
+        except (KeyError, ValueError):
+            return self.first_seen.setdefault(instance['InstanceId'], int(self.clock()))
+
+    def plan_evictions(self, stopped, keep):
+        return plan_evictions(stopped, keep, self.clock(), self.idle_timeout, self.idle_since)
+
+    def stopped_instances(self, country_code, refresh=False):
+        """A country's stopped warm workers, longest idle first"""
+        fetched_at, instances = self.cache.get(country_code, (0, None))
+        if not refresh and instances is not None and self.clock() - fetched_at < self.cache_seconds:
+            return instances
+
+        instances = []
+        paginator = self.ec2.get_paginator('describe_instances')
+        for page in paginator.paginate(
+            Filters=[
+                {'Name': 'instance-state-name', 'Values': ['stopped']},
+                {'Name': 'tag:Purpose', 'Values': ['dental-scraper']},
+                {'Name': f'tag:{WARM_POOL_TAG}', 'Values': ['true']},
+                {'Name': 'tag:Country', 'Values': [country_code]}
+            ]
+        ):
+            for reservation in page['Reservations']:
+                instances.extend(reservation['Instances'])
+        instances.sort(key=self.idle_since)
+        self.cache[country_code] = (self.clock(), instances)
+        return instances
+
+    def resume(self, instance_ids):
+        """Start stopped workers and return the IDs that are starting
+
+        Resuming a spot instance needs capacity like a launch does, so a
+        failed batch is retried one instance at a time.
+        """
+        if not instance_ids:
+            return []
+        self.invalidate()
+        try:
+            self.ec2.start_instances(InstanceIds=list(instance_ids))
+            logger.info(f"Resumed {len(instance_ids)} warm worker(s)")
+            return list(instance_ids)
+        except self.ec2.exceptions.ClientError as e:
+            if len(instance_ids) == 1:
+                logger.warning(f"Failed to resume warm worker {instance_ids[0]}: {str(e)}")
+                return []
+            logger.warning(f"Failed to resume {len(instance_ids)} warm workers together: {str(e)}")
+        return [instance_id for instance_id in instance_ids if self.resume([instance_id])]
+
+    def evict(self, instance_ids):
+        """Cancel the spot requests behind workers, then terminate them"""
+        if not instance_ids:
+            return
+        self.invalidate()
+        response = self.ec2.describe_instances(InstanceIds=list(instance_ids))
+        request_ids = [instance['SpotInstanceRequestId']
+                       for reservation in response['Reservations'] for instance in reservation['Instances']
+                       if instance.get('SpotInstanceRequestId')]
+        if request_ids:
+            self.ec2.cancel_spot_instance_requests(SpotInstanceRequestIds=request_ids)
+        self.ec2.terminate_instances(InstanceIds=list(instance_ids))
+        logger.info(f"Evicted {len(instance_ids)} warm worker(s)")